@@ -0,0 +1,39 @@
+import os
+import random
+
+"""
+Benchmark inputs: the corpora in data/ plus synthetic adversarial texts that
+stress the split pattern and BPE (long runs of whitespace or of one byte, and
+random unicode without any merges to apply)
+"""
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT_DIR, "data")
+DATA_FILES = ["sample.txt", "text.txt", "random.txt"]
+SYNTHETIC_SIZE = 1 << 17
+
+
+def read_data_file(file_name: str) -> str:
+    with open(os.path.join(DATA_DIR, file_name), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def synthetic_inputs(size: int = SYNTHETIC_SIZE) -> dict[str, str]:
+    rng = random.Random(0)
+    code_points = [rng.randrange(0x20, 0x3000) for _ in range(size // 2)]
+    return {
+        "spaces": " " * size,
+        "newlines": "\n" * size,
+        "mixed_whitespace": "".join(rng.choice(" \t\r\n") for _ in range(size)),
+        "repeated_byte": "a" * size,
+        "repeated_word": "hello " * (size // 6),
+        "digits": "".join(rng.choice("0123456789") for _ in range(size)),
+        "random_unicode": "".join(chr(c) for c in code_points if chr(c).isprintable()),
+    }
+
+
+# Name -> text of every benchmark input
+def load_inputs(synthetic_size: int = SYNTHETIC_SIZE) -> dict[str, str]:
+    inputs = {file_name: read_data_file(file_name) for file_name in DATA_FILES}
+    inputs.update(synthetic_inputs(size=synthetic_size))
+    return inputs
@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+from minbpe import BasicTokenizer, RegexTokenizer, GPT4Tokenizer, Tokenizer
+from minbpe.constants import MAX_BYTE_SIZE, DecodeEngine, SplitEngine, SplitPattern
+
+from .inputs import ROOT_DIR, load_inputs
+
+"""
+Throughput benchmarks of training, encoding and decoding
+
+    python -m benchmarks.run [--output results.json] [--baseline baseline.json]
+
+Results are a JSON object of metric name -> value, for example
+    "train/regex/sample.txt/seconds_per_merge", "train/basic/spaces/seconds_per_merge"
+    "encode/gpt4/text.txt/mb_per_s", "decode/tiktoken/spaces/tokens_per_s"
+    "decode_flat/regex/text.txt/tokens_per_s" (DecodeEngine.FLAT)
+    "import/basic/seconds" (cold start of a fresh interpreter, see IMPORT_CASES)
+    "split/gpt4_fast/text.txt/mb_per_s" (pre-tokenization alone, per SplitEngine)
+Every timing is the best of --repeat runs. With --baseline, metrics that got
+worse than the baseline by more than --threshold (a fraction) are reported and
+the exit status is 1. --update-baseline writes the results to the baseline file.
+"""
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+# Metrics where a larger value is a slowdown, all others are throughputs
+LOWER_IS_BETTER = {"seconds_per_merge", "seconds"}
+# Import benchmarks: name -> code run by a fresh interpreter ("python" is the
+# interpreter startup alone, for reference)
+IMPORT_CASES = {
+    "python": "pass",
+    "package": "import minbpe",
+    "basic": "from minbpe import BasicTokenizer; BasicTokenizer()",
+    "regex": "from minbpe import RegexTokenizer; RegexTokenizer()",
+    "gpt4_module": "import minbpe.gpt4_tokenizer",
+}
+# Split benchmarks: name -> split pattern
+SPLIT_PATTERNS = {
+    "gpt2": SplitPattern.GPT2_SPLIT_PATTERN,
+    "gpt4": SplitPattern.GPT4_SPLIT_PATTERN,
+}
+# Train benchmarks: inputs (names of load_inputs) trained on, the corpora plus
+# the synthetic ones that stress the incremental trainer (overlapping pairs of
+# one repeated byte, long whitespace runs)
+TRAIN_INPUTS = [
+    "sample.txt",
+    "text.txt",
+    "repeated_byte",
+    "spaces",
+    "mixed_whitespace",
+]
+# Heavy modules reported as loaded (or not) by every import benchmark
+HEAVY_MODULES = ["regex", "tiktoken", "numpy", "multiprocessing"]
+
+
+def best_time(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def load_tokenizers() -> dict:
+    basic_tokenizer = BasicTokenizer()
+    basic_tokenizer.load(model_file=os.path.join(ROOT_DIR, "models/basic/basic.model"))
+    regex_tokenizer = RegexTokenizer()
+    regex_tokenizer.load(model_file=os.path.join(ROOT_DIR, "models/regex/regex.model"))
+    tokenizers = {
+        "basic": basic_tokenizer,
+        "regex": regex_tokenizer,
+        "gpt4": GPT4Tokenizer(),
+    }
+
+    try:
+        import tiktoken
+
+        tokenizers["tiktoken"] = tiktoken.get_encoding("cl100k_base")
+    except ImportError:
+        print("tiktoken is not installed, skipping the reference.")
+
+    return tokenizers
+
+
+def encode_ordinary(tokenizer, text: str) -> list[int]:
+    if isinstance(tokenizer, BasicTokenizer):
+        return tokenizer.encode(text)
+    return tokenizer.encode_ordinary(text)
+
+
+def bench_train(
+    inputs: dict[str, str], num_merges: int, repeat: int, results: dict
+) -> None:
+    for name, Tokenizer in [("basic", BasicTokenizer), ("regex", RegexTokenizer)]:
+        for input_name in TRAIN_INPUTS:
+            text = inputs[input_name]
+            tokenizer = Tokenizer()
+            seconds = best_time(
+                lambda: tokenizer.train(text, vocab_size=MAX_BYTE_SIZE + num_merges),
+                repeat,
+            )
+            merges_done = max(1, len(tokenizer.merges))
+            results[f"train/{name}/{input_name}/seconds_per_merge"] = (
+                seconds / merges_done
+            )
+
+
+def bench_encode_decode(
+    tokenizers: dict,
+    inputs: dict[str, str],
+    repeat: int,
+    results: dict,
+    suites: set[str],
+) -> None:
+    for name, tokenizer in tokenizers.items():
+        for input_name, text in inputs.items():
+            num_bytes = len(text.encode(encoding="utf-8"))
+            ids = encode_ordinary(tokenizer, text)
+
+            timed = {
+                "encode": lambda: encode_ordinary(tokenizer, text),
+                "decode": lambda: tokenizer.decode(ids),
+            }
+            if isinstance(tokenizer, Tokenizer):
+                timed["decode_flat"] = lambda: tokenizer.decode(ids)
+            for suite, fn in timed.items():
+                if suite.split("_")[0] not in suites:
+                    continue
+                if suite == "decode_flat":
+                    tokenizer.decode_engine = DecodeEngine.FLAT
+                    tokenizer.decode(ids)  # build the flat vocab outside the timing
+                seconds = best_time(fn, repeat)
+                if suite == "decode_flat":
+                    tokenizer.decode_engine = DecodeEngine.DICT
+                prefix = f"{suite}/{name}/{input_name}"
+                results[f"{prefix}/mb_per_s"] = num_bytes / seconds / 1e6
+                results[f"{prefix}/tokens_per_s"] = len(ids) / seconds
+
+
+def bench_split(inputs: dict[str, str], repeat: int, results: dict) -> None:
+    for pattern_name, pattern in SPLIT_PATTERNS.items():
+        for split_engine in [SplitEngine.REGEX, SplitEngine.FAST]:
+            tokenizer = RegexTokenizer(pattern=pattern, split_engine=split_engine)
+            for input_name, text in inputs.items():
+                num_bytes = len(text.encode(encoding="utf-8"))
+                seconds = best_time(lambda: tokenizer.split_text(text), repeat)
+                prefix = f"split/{pattern_name}_{split_engine}/{input_name}"
+                results[f"{prefix}/mb_per_s"] = num_bytes / seconds / 1e6
+
+
+def bench_import(repeat: int, results: dict) -> None:
+    report = "; import sys; print([m for m in {} if m in sys.modules])".format(
+        HEAVY_MODULES
+    )
+    for name, code in IMPORT_CASES.items():
+        command = [sys.executable, "-c", code]
+        seconds = best_time(
+            lambda: subprocess.run(command, cwd=ROOT_DIR, check=True), repeat
+        )
+        results[f"import/{name}/seconds"] = seconds
+
+        loaded = subprocess.run(
+            [sys.executable, "-c", code + report],
+            cwd=ROOT_DIR,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+        print(f"import/{name}: loads {loaded}")
+
+
+"""
+Metrics that got worse than the baseline by more than threshold
+Returns: list of (metric, baseline value, value, relative change)
+Metrics missing from either side are ignored
+"""
+
+
+def compare_results(
+    results: dict[str, float], baseline: dict[str, float], threshold: float
+) -> list[tuple[str, float, float, float]]:
+    regressions = []
+    for metric, value in results.items():
+        if metric not in baseline or baseline[metric] <= 0 or value <= 0:
+            continue
+        base_value = baseline[metric]
+        if metric.rsplit("/", 1)[-1] in LOWER_IS_BETTER:
+            change = value / base_value - 1
+        else:
+            change = base_value / value - 1
+        if change > threshold:
+            regressions.append((metric, base_value, value, change))
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="minbpe throughput benchmarks")
+    parser.add_argument("--output", default=None, help="write results to this file")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--num-merges", type=int, default=256)
+    parser.add_argument("--synthetic-size", type=int, default=1 << 17)
+    parser.add_argument(
+        "--suites",
+        default="import,train,encode,decode,split",
+        help="comma-separated: import,train,encode,decode,split",
+    )
+    args = parser.parse_args()
+    suites = set(args.suites.split(","))
+
+    results = {}
+    inputs = load_inputs(synthetic_size=args.synthetic_size)
+    if "import" in suites:
+        bench_import(args.repeat, results)
+    if "train" in suites:
+        bench_train(inputs, args.num_merges, args.repeat, results)
+    if suites & {"encode", "decode"}:
+        bench_encode_decode(load_tokenizers(), inputs, args.repeat, results, suites)
+    if "split" in suites:
+        bench_split(inputs, args.repeat, results)
+
+    for metric, value in results.items():
+        print(f"{metric:<60} {value:>14.6g}")
+
+    report = {
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Updated baseline {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, nothing to compare.")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+
+    regressions = compare_results(results, baseline, args.threshold)
+    for metric, base_value, value, change in regressions:
+        print(
+            "Regression: {} {:.6g} -> {:.6g} ({:+.1%})".format(
+                metric, base_value, value, change
+            )
+        )
+    if regressions:
+        return 1
+    print("No regressions beyond {:.0%}.".format(args.threshold))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,11 +1,46 @@
-from .base import Tokenizer
-from .basic_tokenizer import BasicTokenizer
-from .regex_tokenizer import RegexTokenizer
-from .gpt4_tokenizer import GPT4Tokenizer
+import importlib
+from typing import TYPE_CHECKING
+
+"""
+Public classes are imported on first access (module-level __getattr__), so that
+`import minbpe` (e.g. for BasicTokenizer only) does not import regex, tiktoken
+or the modules of the other tokenizers
+"""
+
+if TYPE_CHECKING:
+    from .base import Tokenizer
+    from .basic_tokenizer import BasicTokenizer
+    from .regex_tokenizer import RegexTokenizer
+    from .gpt4_tokenizer import GPT4Tokenizer
+    from .streaming_decoder import StreamingDecoder
+
+# Public name -> module defining it
+_LAZY_IMPORTS = {
+    "Tokenizer": ".base",
+    "BasicTokenizer": ".basic_tokenizer",
+    "RegexTokenizer": ".regex_tokenizer",
+    "GPT4Tokenizer": ".gpt4_tokenizer",
+    "StreamingDecoder": ".streaming_decoder",
+}
 
 __all__ = [
     "Tokenizer",
     "BasicTokenizer",
     "RegexTokenizer",
     "GPT4Tokenizer",
+    "StreamingDecoder",
 ]
+
+
+def __getattr__(name: str):
+    if name not in _LAZY_IMPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module = importlib.import_module(_LAZY_IMPORTS[name], __name__)
+    value = getattr(module, name)
+    # Cache it, later accesses do not go through __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted(set(globals()) | set(__all__))
@@ -1,7 +1,21 @@
 import os
+import time
+import weakref
+from array import array
+from operator import attrgetter
+from typing import TYPE_CHECKING, Callable
 
+from .batch import TokenizerPool, run_batch
+from .binary_model import BINARY_MODEL_EXTENSION, is_binary_model, load_binary
+from .binary_model import save_binary
+from .heap_encoder import pack_merges
+from .instrumentation import Instrumentation
+from .streaming_decoder import StreamingDecoder
 from .utils import bytes_to_string
-from .constants import MAX_BYTE_SIZE
+from .constants import MAX_BYTE_SIZE, BatchBackend, DecodeEngine
+
+if TYPE_CHECKING:
+    from .flat_vocab import FlatVocab
 
 
 class Tokenizer:
@@ -13,11 +27,29 @@ class Tokenizer:
         vocab: dict[int, bytes]
     """
 
+    # Settings the copy of the tokenizer in pool workers depends on, besides merges
+    # and special tokens (dotted names are attributes of attributes)
+    WORKER_SETTINGS = ["pattern", "decode_engine"]
+
     def __init__(self) -> None:
+        self.__version = 0
         self.merges = {}
         self.pattern = ""
         self.special_tokens = {}
         self.vocab = self.__build_vocab()
+        self.__packed_merges = {}
+        self.__packed_key = None
+        self.decode_engine = DecodeEngine.DICT
+        self.__flat_vocab = None
+        self.__flat_key = None
+        self.__worker_pool = None
+        self.__pool_finalizer = None
+        # MappedVocab of the loaded binary model, closed by close or the next load
+        self.__mapped_vocab = None
+        # Opt-in timers and counters (see enable_instrumentation)
+        self.instrumentation = Instrumentation()
+        # Minimum number of seconds between two training progress reports
+        self.progress_interval = 1.0
 
     def __build_vocab(self) -> dict[int, bytes]:
         vocab = {idx: bytes([idx]) for idx in range(MAX_BYTE_SIZE)}
@@ -30,40 +62,204 @@ class Tokenizer:
 
         return vocab
 
+    """
+    Caches derived from merges, vocab and special tokens (packed merges, flat
+    vocab, special token matchers) are keyed on cache_key of what they read:
+    it changes when one of them is replaced or resized, or when mark_changed is
+    called (register_special_tokens, load, train, or a caller that changed them
+    in place).
+    """
+
+    def mark_changed(self) -> None:
+        self.__version += 1
+
+    def cache_key(self, *values: dict) -> tuple:
+        return (self.__version,) + tuple((id(value), len(value)) for value in values)
+
+    # Merges packed into integer keys for the heap encoder
+    def get_packed_merges(self) -> dict[int, int]:
+        key = self.cache_key(self.merges)
+        if self.__packed_key != key:
+            self.__packed_merges = pack_merges(self.merges)
+            self.__packed_key = key
+        return self.__packed_merges
+
+    # Token id -> bytes of every token decode accepts (special tokens included)
+    def decode_table(self) -> dict[int, bytes]:
+        return self.vocab
+
+    # decode_table packed into one buffer for DecodeEngine.FLAT
+    def get_flat_vocab(self) -> "FlatVocab":
+        from .flat_vocab import FlatVocab
+
+        key = self.cache_key(self.vocab, self.special_tokens)
+        if self.__flat_key != key:
+            self.__flat_vocab = FlatVocab(self.decode_table())
+            self.__flat_key = key
+        return self.__flat_vocab
+
     def train(self, text: str, vocab_size: int, verbose: bool = False) -> None:
         raise NotImplementedError
 
     def encode(self, s: str) -> list[int]:
         raise NotImplementedError
 
-    def decode(self, ids: list[int]) -> str:
-        raise NotImplementedError
+    # Number of tokens of encode(s)
+    def count_tokens(self, s: str) -> int:
+        return len(self.encode(s))
+
+    # Concatenated bytes of the tokens ids, with the decode engine
+    def join_tokens(self, ids: list[int] | array) -> bytes:
+        if self.decode_engine == DecodeEngine.FLAT:
+            return self.get_flat_vocab().gather(ids)
+        elif self.decode_engine != DecodeEngine.DICT:
+            raise ValueError(
+                "decode_engine = {} not understood".format(self.decode_engine)
+            )
+        return b"".join([self.vocab[idx] for idx in ids])
+
+    """
+    Decode a list, array.array or 1-D numpy array of ids
+    decode_bytes returns the raw bytes, without utf-8 decoding
+    """
+
+    def decode(self, ids: list[int] | array) -> str:
+        instrumentation = self.instrumentation
+        if instrumentation.enabled:
+            start = time.perf_counter()
+        text = self.join_tokens(ids).decode(encoding="utf-8", errors="replace")
+        if instrumentation.enabled:
+            instrumentation.record("decode", start, decoded_tokens=len(ids))
+        return text
+
+    def decode_bytes(self, ids: list[int] | array) -> bytes:
+        instrumentation = self.instrumentation
+        if instrumentation.enabled:
+            start = time.perf_counter()
+        text_bytes = self.join_tokens(ids)
+        if instrumentation.enabled:
+            instrumentation.record("decode", start, decoded_tokens=len(ids))
+        return text_bytes
+
+    # Raw bytes of a single token (used by StreamingDecoder)
+    def token_bytes(self, idx: int) -> bytes:
+        return self.vocab[idx]
+
+    def streaming_decoder(self) -> StreamingDecoder:
+        return StreamingDecoder(tokenizer=self)
+
+    """
+    Record per-phase timers and counters of train/encode/decode (see instrumentation)
+        callback [Callable[[str, dict], None]]: receives training progress events
+    """
+
+    def enable_instrumentation(
+        self, callback: Callable[[str, dict], None] = None
+    ) -> None:
+        self.instrumentation.enabled = True
+        self.instrumentation.callback = callback
+
+    def disable_instrumentation(self) -> None:
+        self.instrumentation.enabled = False
+        self.instrumentation.callback = None
+
+    # Timers, counters and derived rates recorded since instrumentation was enabled
+    def stats(self) -> dict:
+        return self.instrumentation.stats()
+
+    """
+    Encode/decode many items with a pool of workers, keeping the input order
+        num_workers [int]: number of workers (default: os.cpu_count())
+        backend [str]: BatchBackend.PROCESS or BatchBackend.THREAD
+        chunk_size [int]: items per task (default: about 4 tasks per worker)
+    """
+
+    def encode_batch(
+        self,
+        texts: list[str],
+        num_workers: int = None,
+        backend: str = BatchBackend.PROCESS,
+        chunk_size: int = None,
+        **kwargs,
+    ) -> list[list[int]]:
+        return run_batch(
+            self, "encode", texts, num_workers, backend, chunk_size, **kwargs
+        )
+
+    def decode_batch(
+        self,
+        ids_batch: list[list[int]],
+        num_workers: int = None,
+        backend: str = BatchBackend.PROCESS,
+        chunk_size: int = None,
+    ) -> list[str]:
+        return run_batch(self, "decode", ids_batch, num_workers, backend, chunk_size)
+
+    # Process pool holding a copy of this tokenizer, reused while its state is unchanged
+    def get_worker_pool(self, num_workers: int) -> TokenizerPool:
+        fingerprint = (
+            num_workers,
+            self.cache_key(self.merges, self.special_tokens),
+        ) + tuple(attrgetter(name)(self) for name in self.WORKER_SETTINGS)
+        if self.__worker_pool is None or self.__worker_pool.fingerprint != fingerprint:
+            self.close_worker_pool()
+            pool = TokenizerPool(
+                tokenizer=self, num_workers=num_workers, fingerprint=fingerprint
+            )
+            self.__worker_pool = pool
+            # Shut the workers down if the tokenizer is collected first
+            self.__pool_finalizer = weakref.finalize(self, pool.close)
+        return self.__worker_pool
+
+    def has_worker_pool(self) -> bool:
+        return self.__worker_pool is not None
+
+    def close_worker_pool(self) -> None:
+        if self.__worker_pool is not None:
+            self.__pool_finalizer()
+            self.__worker_pool = None
+            self.__pool_finalizer = None
+
+    # Shut the worker pool down and unmap the loaded binary model (the tokenizer
+    # cannot decode a binary model's tokens afterwards, until the next load)
+    def close(self) -> None:
+        self.close_worker_pool()
+        if self.__mapped_vocab is not None:
+            self.__mapped_vocab.close()
+            self.__mapped_vocab = None
+
+    def __enter__(self) -> "Tokenizer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    # The worker pool is not shipped along with the tokenizer
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_Tokenizer__worker_pool"] = None
+        state["_Tokenizer__pool_finalizer"] = None
+        # Workers do not record stats (nor call back into this process)
+        state["instrumentation"] = Instrumentation()
+        return state
 
     """
     Save two files:
     - .model: contains version, pattern, special tokens, and merges tokens
+        (or .bin: the binary model format, see binary_model)
     - .vocab: contains the vocabulary (pretty printed)
     """
 
-    def save(self, file_prefix: str) -> None:
+    def save(self, file_prefix: str, binary: bool = False) -> None:
         save_dir = file_prefix.rsplit("/", 1)[0]
         if save_dir and not os.path.exists(save_dir):
             os.makedirs(save_dir)
 
-        model_file = file_prefix + ".model"
         vocab_file = file_prefix + ".vocab"
-
-        with open(model_file, "w") as f:
-            f.write("minbpe v1.0\n")
-            f.write(f"{self.pattern}\n")
-
-            f.write(f"{len(self.special_tokens)}\n")
-            for token, idx in self.special_tokens.items():
-                f.write(f"{token} {idx}\n")
-
-            f.write(f"{len(self.merges)}\n")
-            for idx1, idx2 in self.merges:
-                f.write(f"{idx1} {idx2}\n")
+        if binary:
+            self.save_binary(model_file=file_prefix + BINARY_MODEL_EXTENSION)
+        else:
+            self.save_text_model(model_file=file_prefix + ".model")
 
         inverted_merges = {idx: pair for pair, idx in self.merges.items()}
         with open(vocab_file, "w", encoding="utf-8") as f:
@@ -78,29 +274,75 @@ class Tokenizer:
                 else:
                     f.write(f"[{s}] {idx}\n")
 
+    def save_text_model(self, model_file: str) -> None:
+        with open(model_file, "w") as f:
+            f.write("minbpe v1.0\n")
+            f.write(f"{self.pattern}\n")
+
+            f.write(f"{len(self.special_tokens)}\n")
+            for token, idx in self.special_tokens.items():
+                f.write(f"{token} {idx}\n")
+
+            f.write(f"{len(self.merges)}\n")
+            for idx1, idx2 in self.merges:
+                f.write(f"{idx1} {idx2}\n")
+
+    def save_binary(self, model_file: str) -> None:
+        save_binary(
+            model_file=model_file,
+            pattern=self.pattern,
+            special_tokens=self.special_tokens,
+            merges=self.merges,
+            vocab=self.vocab,
+        )
+
     """
-    Only load the .model file
+    Only load the .model file (text or binary format)
     """
 
     def load(self, model_file: str) -> None:
         if not os.path.exists(model_file):
             raise ValueError(f"{model_file} not found.")
 
+        mapped_vocab = None
+        if is_binary_model(model_file):
+            pattern, special_tokens, merges, mapped_vocab = load_binary(model_file)
+        else:
+            pattern, special_tokens, merges = self.__read_text_model(model_file)
+
+        # Both formats replace the whole state (and unmap the previous model)
+        self.close()
+        self.pattern = pattern
+        self.special_tokens = special_tokens
+        self.merges = merges
+        if mapped_vocab is None:
+            self.vocab = self.__build_vocab()
+        else:
+            self.vocab = mapped_vocab
+            self.__mapped_vocab = mapped_vocab
+        self.mark_changed()
+
+    # pattern, special tokens and merges of a text (minbpe v1.0) model
+    def __read_text_model(
+        self, model_file: str
+    ) -> tuple[str, dict[str, int], dict[tuple[int, int], int]]:
+        special_tokens = {}
+        merges = {}
         idx = MAX_BYTE_SIZE
 
         with open(model_file, "r") as f:
             _version = f.readline().strip()
-            self.pattern = f.readline().strip()
+            pattern = f.readline().strip()
 
             num_special_tokens = int(f.readline().strip())
             for _ in range(num_special_tokens):
                 token, cur_idx = f.readline().strip().split()
-                self.special_tokens[token] = int(cur_idx)
+                special_tokens[token] = int(cur_idx)
 
             num_merges = int(f.readline().strip())
             for _ in range(num_merges):
                 idx1, idx2 = map(int, f.readline().strip().split())
-                self.merges[(idx1, idx2)] = int(idx)
+                merges[(idx1, idx2)] = int(idx)
                 idx += 1
 
-        self.vocab = self.__build_vocab()
+        return pattern, special_tokens, merges
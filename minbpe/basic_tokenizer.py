@@ -1,44 +1,125 @@
+import time
+
 from .base import Tokenizer
+from .bpe_trainer import get_train_steps
+from .checkpoint import DEFAULT_CHECKPOINT_INTERVAL, Checkpointer
+from .checkpoint import get_initial_state, input_fingerprint
+from .heap_encoder import encode_heap
+from .instrumentation import ProgressReporter
 from .utils import get_statistics, merge
-from .constants import MAX_BYTE_SIZE
+from .constants import MAX_BYTE_SIZE, DecodeEngine, EncodeEngine, TrainEngine
+
+"""
+train_engine [str]: training engine (TrainEngine.INCREMENTAL, TrainEngine.NAIVE
+    or TrainEngine.NUMPY)
+encode_engine [str]: encoding engine (EncodeEngine.HEAP or EncodeEngine.NAIVE)
+decode_engine [str]: decoding engine (DecodeEngine.DICT or DecodeEngine.FLAT)
+"""
 
 
 class BasicTokenizer(Tokenizer):
-    def __init__(self) -> None:
+    WORKER_SETTINGS = Tokenizer.WORKER_SETTINGS + ["encode_engine"]
+
+    def __init__(
+        self,
+        train_engine: str = TrainEngine.INCREMENTAL,
+        encode_engine: str = EncodeEngine.HEAP,
+        decode_engine: str = DecodeEngine.DICT,
+    ) -> None:
         super().__init__()
+        self.train_engine = train_engine
+        self.encode_engine = encode_engine
+        self.decode_engine = decode_engine
+
+    """
+    Train on text up to vocab_size tokens
+        extend [bool]: continue from the current merges (e.g. of a loaded model)
+        checkpoint_file [str]: save a checkpoint there every checkpoint_interval
+            merges, and resume from it if it exists
+    """
 
-    def train(self, text: str, vocab_size: int, verbose: bool = False) -> None:
+    def train(
+        self,
+        text: str,
+        vocab_size: int,
+        verbose: bool = False,
+        extend: bool = False,
+        checkpoint_file: str = None,
+        checkpoint_interval: int = DEFAULT_CHECKPOINT_INTERVAL,
+    ) -> None:
+        instrumentation = self.instrumentation
+        start = time.perf_counter()
         num_merges = vocab_size - MAX_BYTE_SIZE
-        ids = list(text.encode(encoding="utf-8"))
+        text_bytes = text.encode(encoding="utf-8")
+        if instrumentation.enabled:
+            instrumentation.record("train_split", start, train_bytes=len(text_bytes))
+            start = time.perf_counter()
+
+        if extend and num_merges < len(self.merges):
+            raise ValueError(
+                "vocab_size = {} is smaller than the current vocab".format(vocab_size)
+            )
+        fingerprint = input_fingerprint({text_bytes: 1})
+        merges, words = get_initial_state(
+            words=[list(text_bytes)],
+            fingerprint=fingerprint,
+            checkpoint_file=checkpoint_file,
+            merges=self.merges if extend else None,
+        )
+        initial = len(merges)
 
-        merges = {}
         vocab = {idx: bytes([idx]) for idx in range(MAX_BYTE_SIZE)}
+        for (p0, p1), idx in merges.items():
+            vocab[idx] = vocab[p0] + vocab[p1]
+
+        steps, current_words = get_train_steps(
+            self.train_engine, words, [1], num_merges - initial, MAX_BYTE_SIZE + initial
+        )
+        checkpointer = None
+        if checkpoint_file is not None:
+            checkpointer = Checkpointer(
+                checkpoint_file, checkpoint_interval, fingerprint, current_words
+            )
 
+        reporter = ProgressReporter(
+            num_merges, self.progress_interval, verbose, instrumentation, initial
+        )
         print("Training Basic Tokenizer...")
-        for i in range(num_merges):
-            stats = get_statistics(ids)
-            top_pair = max(stats, key=stats.get)
-            idx = MAX_BYTE_SIZE + i
-            ids = merge(ids=ids, pair=top_pair, new_index=idx)
+        for top_pair, idx, count in steps:
             merges[top_pair] = idx
             vocab[idx] = vocab[top_pair[0]] + vocab[top_pair[1]]
-            if verbose:
-                print(
-                    "Merge {:>4} / {:<4}: {:>10} -> {:>4} ({}) had {} occurrences".format(
-                        i + 1,
-                        num_merges,
-                        str(top_pair),
-                        idx,
-                        str(vocab[idx]),
-                        stats[top_pair],
-                    )
-                )
+            reporter.update(len(merges) - 1, top_pair, idx, vocab[idx], count)
+            if checkpointer is not None:
+                checkpointer.update(merges)
         self.merges = merges
         self.vocab = vocab
+        self.mark_changed()
+
+        if instrumentation.enabled:
+            instrumentation.record("train_merge", start, merges=len(merges) - initial)
+        reporter.finish()
 
     def encode(self, s: str) -> list[int]:
+        instrumentation = self.instrumentation
+        if instrumentation.enabled:
+            start = time.perf_counter()
+            ids = self.__encode(s)
+            instrumentation.record(
+                "bpe", start, encoded_bytes=len(s.encode("utf-8")), tokens=len(ids)
+            )
+            return ids
+        return self.__encode(s)
+
+    def __encode(self, s: str) -> list[int]:
         tokens = list(s.encode(encoding="utf-8"))
 
+        if self.encode_engine == EncodeEngine.HEAP:
+            return encode_heap(ids=tokens, packed_merges=self.get_packed_merges())
+        elif self.encode_engine != EncodeEngine.NAIVE:
+            raise ValueError(
+                "encode_engine = {} not understood".format(self.encode_engine)
+            )
+
         while len(tokens) > 1:
             stats = get_statistics(tokens)
             pair = min(
@@ -51,7 +132,3 @@ class BasicTokenizer(Tokenizer):
             tokens = merge(ids=tokens, pair=pair, new_index=idx)
 
         return tokens
-
-    def decode(self, ids: list[int]) -> str:
-        tokens = [self.vocab[idx] for idx in ids]
-        return b"".join(tokens).decode(encoding="utf-8", errors="replace")
@@ -0,0 +1,102 @@
+import os
+import pickle
+
+from .constants import BatchBackend
+
+"""
+Batch encoding/decoding over a pool of workers
+
+Process backend: a TokenizerPool ships the tokenizer to every worker once, in
+the pool initializer (pickled up front, so the pool holds no reference back to
+the tokenizer). The pool is kept by the tokenizer and reused by later calls
+until its merges, special tokens or settings change (Tokenizer.get_worker_pool),
+and shut down when the tokenizer is collected.
+Thread backend: workers share the tokenizer, nothing is shipped.
+
+Items are sent in chunks of chunk_size and results keep the input order.
+multiprocessing and concurrent.futures are imported when a pool is first needed.
+"""
+
+
+# Worker state: the tokenizer shipped by the pool initializer
+_worker_tokenizer = None
+
+
+def _init_worker(tokenizer_bytes: bytes) -> None:
+    global _worker_tokenizer
+    _worker_tokenizer = pickle.loads(tokenizer_bytes)
+
+
+def _run_chunk(args: tuple[str, list, dict]) -> list:
+    method_name, items, kwargs = args
+    method = getattr(_worker_tokenizer, method_name)
+    return [method(item, **kwargs) for item in items]
+
+
+class TokenizerPool:
+    def __init__(self, tokenizer, num_workers: int, fingerprint: tuple) -> None:
+        from multiprocessing import Pool
+
+        self.num_workers = num_workers
+        self.fingerprint = fingerprint
+        self.pool = Pool(
+            num_workers, initializer=_init_worker, initargs=(pickle.dumps(tokenizer),)
+        )
+
+    def map(self, method_name: str, chunks: list[list], kwargs: dict) -> list[list]:
+        tasks = [(method_name, chunk, kwargs) for chunk in chunks]
+        return self.pool.map(_run_chunk, tasks, chunksize=1)
+
+    def close(self) -> None:
+        self.pool.close()
+        self.pool.join()
+
+
+def split_chunks(items: list, chunk_size: int) -> list[list]:
+    return [items[i : i + chunk_size] for i in range(0, len(items), chunk_size)]
+
+
+"""
+Call tokenizer.<method_name>(item, **kwargs) for every item
+    num_workers [int]: number of workers (default: os.cpu_count())
+    backend [str]: BatchBackend.PROCESS or BatchBackend.THREAD
+    chunk_size [int]: items per task (default: about 4 tasks per worker)
+"""
+
+
+def run_batch(
+    tokenizer,
+    method_name: str,
+    items: list,
+    num_workers: int = None,
+    backend: str = BatchBackend.PROCESS,
+    chunk_size: int = None,
+    **kwargs,
+) -> list:
+    items = list(items)
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+    if backend not in (BatchBackend.PROCESS, BatchBackend.THREAD):
+        raise ValueError("backend = {} not understood".format(backend))
+
+    if num_workers <= 1 or len(items) <= 1:
+        method = getattr(tokenizer, method_name)
+        return [method(item, **kwargs) for item in items]
+
+    if chunk_size is None:
+        chunk_size = max(1, -(-len(items) // (4 * num_workers)))
+    chunks = split_chunks(items, chunk_size)
+
+    if backend == BatchBackend.THREAD:
+        from concurrent.futures import ThreadPoolExecutor
+
+        method = getattr(tokenizer, method_name)
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            results = executor.map(
+                lambda chunk: [method(item, **kwargs) for item in chunk], chunks
+            )
+            results = list(results)
+    else:
+        pool = tokenizer.get_worker_pool(num_workers=num_workers)
+        results = pool.map(method_name, chunks, kwargs)
+
+    return [result for chunk_results in results for result in chunk_results]
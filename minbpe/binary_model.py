@@ -0,0 +1,263 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Mapping
+from typing import Iterator
+
+from .constants import MAX_BYTE_SIZE
+
+"""
+Binary model format (little-endian), loaded with mmap so that forked workers
+share the pages of the vocab blob:
+    header: magic, version, pattern length, number of special tokens,
+        number of merges, special tokens section length, vocab blob length
+    pattern: utf-8 bytes
+    special tokens: (uint32 idx, uint32 length, utf-8 bytes) per token
+    merges: uint32 pairs (idx1, idx2), in merge order (new index 256, 257, ...)
+    offsets: uint32 offsets of tokens 0 .. 256 + num_merges in the vocab blob
+    vocab blob: bytes of all tokens, concatenated
+Every section starts at a multiple of 8 bytes.
+"""
+
+MAGIC = b"minbpe.b"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIIIQ")
+BINARY_MODEL_EXTENSION = ".bin"
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _uint32_view(buffer, offset: int, count: int):
+    view = memoryview(buffer)[offset : offset + 4 * count]
+    if sys.byteorder == "little":
+        return view.cast("I")
+    values = array("I", view)
+    values.byteswap()
+    return values
+
+
+def is_binary_model(model_file: str) -> bool:
+    with open(model_file, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+"""
+MappedVocab: read-only dict[int, bytes] view of the vocab blob
+Token bytes are sliced from the mapped file on access; nothing is copied at load.
+The file stays mapped until close (Tokenizer.close or the next Tokenizer.load).
+"""
+
+
+class MappedVocab(Mapping):
+    def __init__(
+        self,
+        model_file: str,
+        buffer,
+        offsets,
+        blob_start: int,
+        special_tokens: dict[str, int],
+    ) -> None:
+        self.model_file = model_file
+        self.buffer = buffer
+        self.offsets = offsets
+        self.blob_start = blob_start
+        self.size = len(offsets) - 1
+        self.specials = {
+            idx: token.encode(encoding="utf-8") for token, idx in special_tokens.items()
+        }
+
+    def __getitem__(self, idx: int) -> bytes:
+        if 0 <= idx < self.size:
+            start = self.blob_start + self.offsets[idx]
+            end = self.blob_start + self.offsets[idx + 1]
+            return self.buffer[start:end]
+        return self.specials[idx]
+
+    def __contains__(self, idx: object) -> bool:
+        return (isinstance(idx, int) and 0 <= idx < self.size) or idx in self.specials
+
+    def __iter__(self) -> Iterator[int]:
+        yield from range(self.size)
+        yield from self.specials
+
+    def __len__(self) -> int:
+        return self.size + len(self.specials)
+
+    def close(self) -> None:
+        if isinstance(self.offsets, memoryview):
+            self.offsets.release()
+        self.buffer.close()
+
+    # Pickled by path: the receiving process maps the file again
+    def __reduce__(self) -> tuple:
+        return _load_mapped_vocab, (self.model_file,)
+
+
+def _load_mapped_vocab(model_file: str) -> MappedVocab:
+    return load_binary(model_file)[3]
+
+
+def save_binary(
+    model_file: str,
+    pattern: str,
+    special_tokens: dict[str, int],
+    merges: dict[tuple[int, int], int],
+    vocab: Mapping[int, bytes],
+) -> None:
+    pattern_bytes = pattern.encode(encoding="utf-8")
+
+    specials = bytearray()
+    for token, idx in special_tokens.items():
+        token_bytes = token.encode(encoding="utf-8")
+        specials += struct.pack("<II", idx, len(token_bytes)) + token_bytes
+
+    merge_values = array("I")
+    for idx1, idx2 in merges:
+        merge_values.extend((idx1, idx2))
+
+    offsets = array("I", [0])
+    blob = bytearray()
+    for idx in range(MAX_BYTE_SIZE + len(merges)):
+        blob += vocab[idx]
+        offsets.append(len(blob))
+    if len(blob) >= 1 << 32:
+        raise ValueError("Vocab blob is too large for uint32 offsets")
+
+    if sys.byteorder != "little":
+        merge_values.byteswap()
+        offsets.byteswap()
+
+    header = HEADER.pack(
+        MAGIC,
+        VERSION,
+        len(pattern_bytes),
+        len(special_tokens),
+        len(merges),
+        len(specials),
+        len(blob),
+    )
+    sections = [header, pattern_bytes, specials, merge_values.tobytes()]
+    sections += [offsets.tobytes(), blob]
+
+    save_dir = os.path.dirname(model_file)
+    if save_dir and not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+
+    with open(model_file, "wb") as f:
+        offset = 0
+        for section in sections:
+            f.write(b"\0" * (_align(offset) - offset))
+            offset = _align(offset)
+            f.write(section)
+            offset += len(section)
+
+
+# Close the mapping of a model that does not hold the sections its header claims
+def _close_truncated(buffer: mmap.mmap, model_file: str) -> ValueError:
+    buffer.close()
+    return ValueError(f"{model_file} is a truncated binary model.")
+
+
+"""
+Load a binary model
+Returns: pattern, special tokens, merges and a MappedVocab over the mapped file
+(the caller closes it)
+Raises ValueError, with the file unmapped, if it is not a binary model or is
+shorter than its header claims.
+"""
+
+
+def load_binary(
+    model_file: str,
+) -> tuple[str, dict[str, int], dict[tuple[int, int], int], MappedVocab]:
+    with open(model_file, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if len(buffer) < HEADER.size:
+        raise _close_truncated(buffer, model_file)
+    magic, version, pattern_len, num_special, num_merges, specials_len, blob_len = (
+        HEADER.unpack_from(buffer, 0)
+    )
+    if magic != MAGIC or version != VERSION:
+        buffer.close()
+        raise ValueError(f"{model_file} is not a minbpe binary model.")
+
+    # Every section must fit in the file before any of them is read
+    num_tokens = MAX_BYTE_SIZE + num_merges
+    pattern_start = _align(HEADER.size)
+    specials_start = _align(pattern_start + pattern_len)
+    specials_end = specials_start + specials_len
+    merges_start = _align(specials_end)
+    offsets_start = _align(merges_start + 8 * num_merges)
+    blob_start = _align(offsets_start + 4 * (num_tokens + 1))
+    if len(buffer) < blob_start + blob_len:
+        raise _close_truncated(buffer, model_file)
+
+    try:
+        pattern = buffer[pattern_start : pattern_start + pattern_len].decode(
+            encoding="utf-8"
+        )
+        special_tokens = {}
+        cursor = specials_start
+        for _ in range(num_special):
+            if cursor + 8 > specials_end:
+                raise _close_truncated(buffer, model_file)
+            idx, token_len = struct.unpack_from("<II", buffer, cursor)
+            cursor += 8
+            if cursor + token_len > specials_end:
+                raise _close_truncated(buffer, model_file)
+            token = buffer[cursor : cursor + token_len].decode(encoding="utf-8")
+            special_tokens[token] = idx
+            cursor += token_len
+    except UnicodeDecodeError:
+        buffer.close()
+        raise
+
+    pairs = _uint32_view(buffer, merges_start, 2 * num_merges)
+    new_indexes = range(MAX_BYTE_SIZE, MAX_BYTE_SIZE + num_merges)
+    merges = dict(zip(zip(pairs[0::2], pairs[1::2]), new_indexes))
+    if isinstance(pairs, memoryview):
+        pairs.release()
+
+    offsets = _uint32_view(buffer, offsets_start, num_tokens + 1)
+    if offsets[num_tokens] > blob_len:
+        if isinstance(offsets, memoryview):
+            offsets.release()
+        raise _close_truncated(buffer, model_file)
+
+    vocab = MappedVocab(
+        model_file=os.path.abspath(model_file),
+        buffer=buffer,
+        offsets=offsets,
+        blob_start=blob_start,
+        special_tokens=special_tokens,
+    )
+    return pattern, special_tokens, merges, vocab
+
+
+"""
+Convert a model between the minbpe v1.0 text format and the binary format
+The direction is picked from the input file (binary input -> text output)
+"""
+
+
+def convert_model(input_file: str, output_file: str) -> None:
+    from .base import Tokenizer
+
+    with Tokenizer() as tokenizer:
+        tokenizer.load(model_file=input_file)
+        if is_binary_model(input_file):
+            tokenizer.save_text_model(model_file=output_file)
+        else:
+            tokenizer.save_binary(model_file=output_file)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python -m minbpe.binary_model <input model> <output model>")
+        sys.exit(1)
+    convert_model(input_file=sys.argv[1], output_file=sys.argv[2])
@@ -0,0 +1,258 @@
+import heapq
+from typing import Callable, Iterable, Iterator
+
+from .heap_encoder import encode_heap, pack_merges
+from .utils import get_statistics, merge
+from .constants import TrainEngine
+
+"""
+BPETrainer: incremental pair-count BPE training engine
+    words [Iterable[tuple[Iterable[int], int]]]: sequences of ids with their weights
+        (e.g. one word for the whole text, or one word per regex chunk)
+
+All words are laid out in one flat array of symbols, linked with prev/next
+indexes (-1 marks a word boundary). The engine keeps, for every adjacent pair:
+    counts: weighted number of occurrences
+    positions: flat indexes of the left symbol of every occurrence
+    first: lower bound of the smallest position (first occurrence)
+and a lazy-deletion max-heap of (-count, first, pair) entries. Each merge only
+touches the neighbours of the merged occurrences, instead of recounting the
+whole corpus.
+
+Tie-breaking matches `max(stats, key=stats.get)` over `get_statistics`: among
+the pairs with the highest count, the one that occurs first in the corpus wins.
+"""
+
+
+class BPETrainer:
+    def __init__(self, words: Iterable[tuple[Iterable[int], int]]) -> None:
+        self.ids = []
+        self.prev = []
+        self.next = []
+        self.weights = []
+        # Flat index of the first symbol of every word (-1 for empty words)
+        self.starts = []
+
+        for word, weight in words:
+            start = len(self.ids)
+            self.ids.extend(word)
+            end = len(self.ids)
+            if start == end:
+                self.starts.append(-1)
+                continue
+            self.starts.append(start)
+            self.prev.extend(range(start - 1, end - 1))
+            self.next.extend(range(start + 1, end + 1))
+            self.prev[start] = -1
+            self.next[end - 1] = -1
+            self.weights.extend([weight] * (end - start))
+
+        self.counts = {}
+        self.positions = {}
+        self.first = {}
+
+        ids, nxt, weights = self.ids, self.next, self.weights
+        for pos in range(len(ids)):
+            if nxt[pos] != -1:
+                pair = (ids[pos], ids[nxt[pos]])
+                if pair in self.counts:
+                    self.counts[pair] += weights[pos]
+                    self.positions[pair].add(pos)
+                else:
+                    self.counts[pair] = weights[pos]
+                    self.positions[pair] = {pos}
+                    self.first[pair] = pos
+
+        self.heap = [
+            (-count, self.first[pair], pair) for pair, count in self.counts.items()
+        ]
+        heapq.heapify(self.heap)
+
+    def __add(self, pair: tuple[int, int], pos: int, changed: set) -> None:
+        if pair in self.counts:
+            self.counts[pair] += self.weights[pos]
+            self.positions[pair].add(pos)
+            if pos < self.first[pair]:
+                self.first[pair] = pos
+        else:
+            self.counts[pair] = self.weights[pos]
+            self.positions[pair] = {pos}
+            self.first[pair] = pos
+        changed.add(pair)
+
+    def __remove(self, pair: tuple[int, int], pos: int, changed: set) -> None:
+        self.counts[pair] -= self.weights[pos]
+        self.positions[pair].discard(pos)
+        changed.add(pair)
+
+    # Pop the pair with the highest count (first occurrence on ties), or None
+    def top_pair(self) -> tuple[tuple[int, int], int] | None:
+        heap = self.heap
+        while heap:
+            neg_count, first, pair = heap[0]
+            count = self.counts.get(pair, 0)
+            if count <= 0 or count != -neg_count:
+                # Stale entry: a fresher one was pushed when the count changed
+                heapq.heappop(heap)
+                continue
+            true_first = min(self.positions[pair])
+            self.first[pair] = true_first
+            if true_first != first:
+                heapq.heapreplace(heap, (neg_count, true_first, pair))
+                continue
+            return pair, count
+        return None
+
+    # Replace every occurrence of pair (left to right, like utils.merge) with new_index
+    def merge(self, pair: tuple[int, int], new_index: int) -> None:
+        for changed_pair in self.apply_merge(pair=pair, new_index=new_index):
+            if changed_pair in self.counts:
+                count = self.counts[changed_pair]
+                heapq.heappush(
+                    self.heap, (-count, self.first[changed_pair], changed_pair)
+                )
+
+    """
+    Merge without touching the heap (e.g. when a coordinator picks the pairs)
+    Returns: the pairs whose count changed; those whose count dropped to 0 are removed
+    """
+
+    def apply_merge(
+        self, pair: tuple[int, int], new_index: int
+    ) -> set[tuple[int, int]]:
+        ids, prev, nxt = self.ids, self.prev, self.next
+        p0, p1 = pair
+        changed = set()
+
+        for pos in sorted(self.positions[pair]):
+            # Skip occurrences consumed by an overlapping merge (e.g. "aaa")
+            if ids[pos] != p0:
+                continue
+            right = nxt[pos]
+            if right == -1 or ids[right] != p1:
+                continue
+            left = prev[pos]
+            after = nxt[right]
+
+            if left != -1:
+                self.__remove((ids[left], p0), left, changed)
+            self.__remove(pair, pos, changed)
+            if after != -1:
+                self.__remove((p1, ids[after]), right, changed)
+
+            ids[pos] = new_index
+            ids[right] = -1
+            nxt[pos] = after
+            if after != -1:
+                prev[after] = pos
+
+            if left != -1:
+                self.__add((ids[left], new_index), left, changed)
+            if after != -1:
+                self.__add((new_index, ids[after]), pos, changed)
+
+        for changed_pair in changed:
+            if self.counts[changed_pair] <= 0:
+                del self.counts[changed_pair]
+                del self.positions[changed_pair]
+                del self.first[changed_pair]
+        return changed
+
+    # Current ids of every word, in input order (the first symbol is never merged away)
+    def words(self) -> list[list[int]]:
+        ids, nxt = self.ids, self.next
+        words = []
+        for pos in self.starts:
+            word = []
+            while pos != -1:
+                word.append(ids[pos])
+                pos = nxt[pos]
+            words.append(word)
+        return words
+
+    """
+    Run num_merges merges, yielding (pair, new_index, count) after each one
+    Stops early if no pairs are left to merge
+    """
+
+    def train(
+        self, num_merges: int, start_index: int
+    ) -> Iterator[tuple[tuple[int, int], int, int]]:
+        for i in range(num_merges):
+            top = self.top_pair()
+            if top is None:
+                break
+            pair, count = top
+            idx = start_index + i
+            self.merge(pair=pair, new_index=idx)
+            yield pair, idx, count
+
+
+"""
+Reference training loop: recount all pairs and rebuild every chunk per merge
+    chunks [list[list[int]]]: sequences of ids (the input lists are not modified)
+    weights [list[int]]: number of occurrences of each chunk (default: 1 each)
+"""
+
+
+def naive_train(
+    chunks: list[list[int]],
+    num_merges: int,
+    start_index: int,
+    weights: list[int] = None,
+) -> Iterator[tuple[tuple[int, int], int, int]]:
+    weights = [1] * len(chunks) if weights is None else weights
+    for i in range(num_merges):
+        stats = {}
+        for chunk_ids, weight in zip(chunks, weights):
+            stats = get_statistics(chunk_ids, stats, weight)
+        if not stats:
+            break
+
+        top_pair = max(stats, key=stats.get)
+        idx = start_index + i
+        chunks = [
+            merge(ids=chunk_ids, pair=top_pair, new_index=idx) for chunk_ids in chunks
+        ]
+        yield top_pair, idx, stats[top_pair]
+
+
+"""
+Training steps of train_engine over words (sequences of ids) with their weights
+Returns: the steps, and a function giving the current ids of every word after
+the merges yielded so far (used for checkpoints)
+"""
+
+
+def get_train_steps(
+    train_engine: str,
+    words: list[list[int]],
+    weights: list[int],
+    num_merges: int,
+    start_index: int,
+) -> tuple[Iterator[tuple[tuple[int, int], int, int]], Callable[[], list[list[int]]]]:
+    if train_engine == TrainEngine.INCREMENTAL:
+        trainer = BPETrainer(words=zip(words, weights))
+        return trainer.train(num_merges, start_index), trainer.words
+    elif train_engine == TrainEngine.NAIVE:
+        steps = naive_train(words, num_merges, start_index, weights)
+    elif train_engine == TrainEngine.NUMPY:
+        from .numpy_utils import numpy_train
+
+        steps = numpy_train(words, num_merges, start_index, weights)
+    else:
+        raise ValueError("train_engine = {} not understood".format(train_engine))
+
+    # These engines keep no per-word state: re-encode the words with the merges
+    merges = {}
+
+    def record_merges() -> Iterator[tuple[tuple[int, int], int, int]]:
+        for pair, idx, count in steps:
+            merges[pair] = idx
+            yield pair, idx, count
+
+    def current_words() -> list[list[int]]:
+        packed_merges = pack_merges(merges)
+        return [encode_heap(ids=word, packed_merges=packed_merges) for word in words]
+
+    return record_merges(), current_words
@@ -0,0 +1,179 @@
+import hashlib
+import os
+import struct
+import sys
+from array import array
+from typing import Callable
+
+from .heap_encoder import encode_heap, pack_merges
+from .constants import MAX_BYTE_SIZE
+
+"""
+Training checkpoints: the merges so far and the current (compacted) ids of
+every training word, so that training resumes exactly where it stopped.
+
+Checkpoint format (little-endian):
+    header: magic, version, number of merges, number of words, total number of
+        ids, sha256 fingerprint of the training input
+    merges: uint32 pairs (idx1, idx2), in merge order (new index 256, 257, ...)
+    word lengths: uint32 per word
+    ids: uint32 ids of all words, concatenated
+Word weights are not stored: they come from the training input, which must
+match the fingerprint.
+"""
+
+MAGIC = b"minbpe.c"
+VERSION = 1
+HEADER = struct.Struct("<8sIIIQ32s")
+DEFAULT_CHECKPOINT_INTERVAL = 1000
+
+
+# sha256 over (length, count, bytes) of every unique chunk, in order
+def input_fingerprint(chunk_counts: dict[bytes, int]) -> bytes:
+    digest = hashlib.sha256()
+    for chunk_bytes, count in chunk_counts.items():
+        digest.update(struct.pack("<QQ", len(chunk_bytes), count))
+        digest.update(chunk_bytes)
+    return digest.digest()
+
+
+def _little_bytes(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values.tobytes()
+
+
+def _little_array(data: bytes) -> array:
+    values = array("I")
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def save_checkpoint(
+    checkpoint_file: str,
+    fingerprint: bytes,
+    merges: dict[tuple[int, int], int],
+    words: list[list[int]],
+) -> None:
+    merge_values = array("I")
+    for idx1, idx2 in merges:
+        merge_values.extend((idx1, idx2))
+    lengths = array("I", (len(word) for word in words))
+    ids = array("I")
+    for word in words:
+        ids.extend(word)
+
+    save_dir = os.path.dirname(checkpoint_file)
+    if save_dir and not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+
+    # Replace the previous checkpoint atomically: a kill never leaves a partial one
+    tmp_file = f"{checkpoint_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(
+            HEADER.pack(MAGIC, VERSION, len(merges), len(words), len(ids), fingerprint)
+        )
+        f.write(_little_bytes(merge_values))
+        f.write(_little_bytes(lengths))
+        f.write(_little_bytes(ids))
+    os.replace(tmp_file, checkpoint_file)
+
+
+"""
+Load a checkpoint
+Returns: fingerprint, merges and the ids of every word
+"""
+
+
+def load_checkpoint(
+    checkpoint_file: str,
+) -> tuple[bytes, dict[tuple[int, int], int], list[list[int]]]:
+    with open(checkpoint_file, "rb") as f:
+        data = f.read()
+
+    magic, version, num_merges, num_words, num_ids, fingerprint = HEADER.unpack_from(
+        data, 0
+    )
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{checkpoint_file} is not a minbpe training checkpoint.")
+
+    offset = HEADER.size
+    pairs = _little_array(data[offset : offset + 8 * num_merges])
+    new_indexes = range(MAX_BYTE_SIZE, MAX_BYTE_SIZE + num_merges)
+    merges = dict(zip(zip(pairs[0::2], pairs[1::2]), new_indexes))
+    offset += 8 * num_merges
+
+    lengths = _little_array(data[offset : offset + 4 * num_words])
+    offset += 4 * num_words
+    ids = _little_array(data[offset : offset + 4 * num_ids]).tolist()
+
+    words = []
+    start = 0
+    for length in lengths:
+        words.append(ids[start : start + length])
+        start += length
+    return fingerprint, merges, words
+
+
+"""
+Starting merges and word ids of a training run
+    words [list[list[int]]]: the training words as bytes
+    checkpoint_file [str]: resume from this checkpoint if it exists
+    merges [dict[tuple[int, int], int]]: otherwise continue from these merges (e.g.
+        of a loaded model), the words are encoded with them first
+Encoding a word with the merges gives the same ids as applying the merges one
+after the other during training, so both ways continue to the same merges as an
+uninterrupted run.
+"""
+
+
+def get_initial_state(
+    words: list[list[int]],
+    fingerprint: bytes,
+    checkpoint_file: str = None,
+    merges: dict[tuple[int, int], int] = None,
+) -> tuple[dict[tuple[int, int], int], list[list[int]]]:
+    if checkpoint_file is not None and os.path.exists(checkpoint_file):
+        checkpoint_fingerprint, merges, words = load_checkpoint(checkpoint_file)
+        if checkpoint_fingerprint != fingerprint:
+            raise ValueError(
+                f"{checkpoint_file} was written for a different training input."
+            )
+        return merges, words
+
+    if not merges:
+        return {}, words
+    packed_merges = pack_merges(merges)
+    words = [encode_heap(ids=word, packed_merges=packed_merges) for word in words]
+    return dict(merges), words
+
+
+"""
+Checkpointer: saves a checkpoint every interval merges
+    current_words [Callable[[], list[list[int]]]]: current ids of every word
+"""
+
+
+class Checkpointer:
+    def __init__(
+        self,
+        checkpoint_file: str,
+        interval: int,
+        fingerprint: bytes,
+        current_words: Callable[[], list[list[int]]],
+    ) -> None:
+        self.checkpoint_file = checkpoint_file
+        self.interval = interval
+        self.fingerprint = fingerprint
+        self.current_words = current_words
+
+    def update(self, merges: dict[tuple[int, int], int]) -> None:
+        if len(merges) % self.interval == 0:
+            self.save(merges)
+
+    def save(self, merges: dict[tuple[int, int], int]) -> None:
+        save_checkpoint(
+            self.checkpoint_file, self.fingerprint, merges, self.current_words()
+        )
@@ -0,0 +1,72 @@
+import threading
+from collections import OrderedDict
+
+"""
+ChunkCache: bounded LRU memoization of chunk bytes -> token ids
+    max_size [int]: maximum number of cached chunks (0 disables the cache)
+    max_chunk_len [int]: chunks longer than this (in bytes) bypass the cache
+    hits, misses, evictions [int]: counters since the last reset
+Ids are stored as tuples, so callers cannot modify the cached ids. A lock guards
+the LRU order (OrderedDict is not safe to reorder from several threads, e.g.
+with BatchBackend.THREAD).
+"""
+
+
+class ChunkCache:
+    def __init__(self, max_size: int = 0, max_chunk_len: int = 64) -> None:
+        self.max_size = max_size
+        self.max_chunk_len = max_chunk_len
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_size > 0
+
+    def get(self, chunk_bytes: bytes) -> tuple[int, ...] | None:
+        with self.lock:
+            ids = self.data.get(chunk_bytes)
+            if ids is None:
+                self.misses += 1
+                return None
+            self.data.move_to_end(chunk_bytes)
+            self.hits += 1
+            return ids
+
+    def put(self, chunk_bytes: bytes, ids: list[int]) -> None:
+        with self.lock:
+            self.data[chunk_bytes] = tuple(ids)
+            if len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.data.clear()
+
+    def reset_stats(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self.data),
+            "max_size": self.max_size,
+        }
+
+    # The lock is not pickled (e.g. along with a tokenizer sent to a worker)
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
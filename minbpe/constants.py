@@ -20,3 +20,37 @@ class TokenizerType:
     BASIC = "basic"
     REGEX = "regex"
     GPT4 = "gpt4"
+
+
+class TrainEngine:
+    NAIVE = "naive"
+    INCREMENTAL = "incremental"
+    # Naive loop on uint32 arrays, needs numpy
+    NUMPY = "numpy"
+
+
+class EncodeEngine:
+    NAIVE = "naive"
+    HEAP = "heap"
+    # GPT4Tokenizer only: BPE on tiktoken mergeable ranks, no byte shuffle
+    RANKS = "ranks"
+
+
+class DecodeEngine:
+    # Dict lookup per id
+    DICT = "dict"
+    # Gather from one contiguous buffer of all token bytes, needs numpy
+    FLAT = "flat"
+
+
+class SplitEngine:
+    # Compiled split pattern (regex module)
+    REGEX = "regex"
+    # Character class scanner of GPT-2 and GPT-4 patterns (minbpe.fast_split),
+    # other patterns fall back to REGEX
+    FAST = "fast"
+
+
+class BatchBackend:
+    PROCESS = "process"
+    THREAD = "thread"
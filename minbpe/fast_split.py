@@ -0,0 +1,128 @@
+import re
+from itertools import accumulate
+from typing import Iterator
+
+import regex
+
+from .constants import SplitPattern
+
+"""
+Fast pre-tokenizer for SplitPattern.GPT2_SPLIT_PATTERN and GPT4_SPLIT_PATTERN
+
+Both patterns only look at a few character classes: letters (\\p{L}), numbers
+(\\p{N}), whitespace (\\s), the space, \\r and \\n, the apostrophe and the letters
+of the contractions. FastSplitter maps every character to an ASCII character of
+the same class with str.translate (the identity on ASCII, so pure ASCII text is
+not translated at all) and splits the result with an ASCII-only equivalent of
+the pattern in the standard re module, without Unicode property lookups. The
+chunks have the same lengths as those of the original text, which gives the
+spans. The classes of non-ASCII characters are computed with the regex module on
+first sight, so they follow the same Unicode tables as the original pattern.
+
+Splits are identical to the regex ones (see test_fast_split). Other patterns
+have no fast splitter and keep using the regex module.
+"""
+
+WHITESPACE = r"\t\n\x0b\x0c\r "
+# Split pattern -> equivalent pattern on ASCII text (possessive quantifiers of the
+# GPT-4 pattern never backtrack there, plain ones match the same)
+ASCII_PATTERNS = {
+    SplitPattern.GPT2_SPLIT_PATTERN: (
+        rf"""'(?:[sdmt]|ll|ve|re)| ?[A-Za-z]+| ?[0-9]+| ?[^{WHITESPACE}A-Za-z0-9]+"""
+        rf"""|[{WHITESPACE}]+(?![^{WHITESPACE}])|[{WHITESPACE}]+"""
+    ),
+    SplitPattern.GPT4_SPLIT_PATTERN: (
+        rf"""'(?i:[sdmt]|ll|ve|re)|[^\r\nA-Za-z0-9]?[A-Za-z]+|[0-9]{{1,3}}"""
+        rf"""| ?[^{WHITESPACE}A-Za-z0-9]+[\r\n]*|[{WHITESPACE}]*[\r\n]"""
+        rf"""|[{WHITESPACE}]+(?![^{WHITESPACE}])|[{WHITESPACE}]+"""
+    ),
+}
+# Characters translated at once: str.translate only stays on its ASCII fast path
+# up to the first non-ASCII character, so mostly ASCII text is done in blocks
+TRANSLATE_BLOCK_SIZE = 512
+
+
+"""
+ClassTable: str.translate table, code point -> ASCII character of the same class
+    case_insensitive [bool]: the contractions match case-insensitively (GPT-4)
+"""
+
+
+class ClassTable(dict):
+    def __init__(self, case_insensitive: bool) -> None:
+        super().__init__((code, chr(code)) for code in range(128))
+        flags = "(?i)" if case_insensitive else ""
+        self.contraction_letters = [
+            (letter, regex.compile(flags + letter)) for letter in "sdmtlver"
+        ]
+        self.whitespace = regex.compile(r"\s")
+        self.letter = regex.compile(r"\p{L}")
+        self.number = regex.compile(r"\p{N}")
+
+    def __missing__(self, code: int) -> str:
+        char = chr(code)
+        if self.whitespace.match(char):
+            value = "\t"
+        elif self.number.match(char):
+            value = "0"
+        elif self.letter.match(char):
+            value = "a"
+            for letter, letter_pattern in self.contraction_letters:
+                if letter_pattern.match(char):
+                    value = letter
+                    break
+        else:
+            value = "."
+        self[code] = value
+        return value
+
+
+class FastSplitter:
+    def __init__(self, pattern: str) -> None:
+        self.pattern = pattern
+        self.compiled_pattern = re.compile(ASCII_PATTERNS[pattern])
+        self.table = ClassTable(
+            case_insensitive=pattern == SplitPattern.GPT4_SPLIT_PATTERN
+        )
+
+    # text with every character replaced by the ASCII character of its class
+    def classify(self, text: str) -> str:
+        if text.isascii():
+            return text
+        table = self.table
+        return "".join(
+            [
+                text[i : i + TRANSLATE_BLOCK_SIZE].translate(table)
+                for i in range(0, len(text), TRANSLATE_BLOCK_SIZE)
+            ]
+        )
+
+    # Same as re.findall(pattern, text)
+    def findall(self, text: str) -> list[str]:
+        if text.isascii():
+            return self.compiled_pattern.findall(text)
+        ends = list(
+            accumulate(map(len, self.compiled_pattern.findall(self.classify(text))))
+        )
+        return [text[start:end] for start, end in zip([0] + ends, ends)]
+
+    # (start, end) of every chunk, without slicing text
+    def spans(self, text: str) -> Iterator[tuple[int, int]]:
+        start = 0
+        for end in accumulate(
+            map(len, self.compiled_pattern.findall(self.classify(text)))
+        ):
+            yield start, end
+            start = end
+
+
+_splitters = {}
+
+
+# FastSplitter of pattern, or None if pattern has none
+def get_fast_splitter(pattern: str) -> FastSplitter | None:
+    if pattern not in ASCII_PATTERNS:
+        return None
+    if pattern not in _splitters:
+        _splitters[pattern] = FastSplitter(pattern)
+    return _splitters[pattern]
@@ -0,0 +1,85 @@
+from array import array
+
+import numpy as np
+
+"""
+FlatVocab: the bytes of every token in one contiguous buffer (DecodeEngine.FLAT)
+    tokens [dict[int, bytes]]: token id -> bytes, special tokens included
+
+Token idx is blob[offsets[idx] : offsets[idx + 1]]. Ids without a token get an
+empty slice, which is how unknown ids are detected (every token has at least
+one byte). gather() concatenates the tokens of a whole id array with vectorized
+index arithmetic: no dict lookup nor bytes object per id.
+Only ids below len(tokens) are stored that way (the bytes and the merges, ids
+0 .. n - 1 without gaps). Larger ids, e.g. special tokens far past the vocab,
+are kept in the sparse dict, so the memory does not grow with the largest id.
+"""
+
+
+class FlatVocab:
+    def __init__(self, tokens: dict[int, bytes]) -> None:
+        size = len(tokens)
+        token_ids = sorted(idx for idx in tokens if 0 <= idx < size)
+        self.sparse = {idx: tokens[idx] for idx in tokens if not 0 <= idx < size}
+        lengths = np.zeros(size, dtype=np.int64)
+        lengths[token_ids] = [len(tokens[idx]) for idx in token_ids]
+
+        self.offsets = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        self.blob = np.frombuffer(
+            b"".join(tokens[idx] for idx in token_ids), dtype=np.uint8
+        )
+
+    """
+    Concatenated bytes of the tokens ids
+        ids [list[int] | array | np.ndarray]: one-dimensional sequence of token ids
+    """
+
+    def gather(self, ids: list[int] | array | np.ndarray) -> bytes:
+        if isinstance(ids, list):
+            ids = np.fromiter(ids, dtype=np.int64, count=len(ids))
+        else:
+            ids = np.asarray(ids)
+        if ids.size == 0:
+            return b""
+        if ids.ndim != 1 or ids.dtype.kind not in "iu":
+            raise ValueError(
+                "ids of shape {} and dtype {} not understood".format(
+                    ids.shape, ids.dtype
+                )
+            )
+        ids = ids.astype(np.int64, copy=False)
+
+        # Ids of the sparse dict split ids into runs gathered from the blob
+        sparse = (ids < 0) | (ids >= len(self.offsets) - 1)
+        if not sparse.any():
+            return self.__gather_dense(ids)
+        parts = []
+        start = 0
+        for i in np.flatnonzero(sparse).tolist():
+            idx = int(ids[i])
+            if idx not in self.sparse:
+                raise ValueError("Unknown token: {}".format(idx))
+            parts.append(self.__gather_dense(ids[start:i]))
+            parts.append(self.sparse[idx])
+            start = i + 1
+        parts.append(self.__gather_dense(ids[start:]))
+        return b"".join(parts)
+
+    # gather of ids that are all below len(offsets) - 1
+    def __gather_dense(self, ids: np.ndarray) -> bytes:
+        if ids.size == 0:
+            return b""
+        offsets = self.offsets
+        starts = offsets[ids]
+        lengths = offsets[ids + 1] - starts
+        if not lengths.all():
+            raise ValueError("Unknown token: {}".format(ids[lengths.argmin()]))
+
+        # Blob positions of the output bytes: consecutive within a token, with a
+        # jump to the start of the next token at every token boundary
+        ends = np.cumsum(lengths)
+        steps = np.ones(int(ends[-1]), dtype=np.int64)
+        steps[0] = starts[0]
+        steps[ends[:-1]] = starts[1:] - (starts[:-1] + lengths[:-1] - 1)
+        return self.blob[np.cumsum(steps)].tobytes()
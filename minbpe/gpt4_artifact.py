@@ -0,0 +1,168 @@
+import hashlib
+import os
+import struct
+import sys
+from array import array
+
+from .constants import MAX_BYTE_SIZE
+
+"""
+On-disk artifact of a GPT4Tokenizer build, so later constructions skip tiktoken
+and recover_merges (and work offline):
+    header: magic, version, number of merges, number of vocab entries,
+        sha256 checksum of the source mergeable ranks, sha256 digest of the
+        payload (everything after the header)
+    byte_shuffle: uint32 rank of the single byte token, for bytes 0 .. 255
+    merges: uint32 triples (idx0, idx1, rank), in rank order
+    vocab: uint32 ids, uint32 offsets into the blob, then the bytes blob
+All integers are little-endian.
+"""
+
+MAGIC = b"minbpe.g"
+VERSION = 2
+HEADER = struct.Struct("<8sIII32s32s")
+
+
+def default_artifact_path(encoding_name: str = "cl100k_base") -> str:
+    cache_dir = os.environ.get(
+        "MINBPE_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "minbpe")
+    )
+    return os.path.join(cache_dir, f"{encoding_name}.gpt4")
+
+
+# sha256 over (rank, length, token bytes) of every mergeable rank, in rank order
+def ranks_checksum(mergeable_ranks: dict[bytes, int]) -> bytes:
+    digest = hashlib.sha256()
+    for token, rank in sorted(mergeable_ranks.items(), key=lambda item: item[1]):
+        digest.update(struct.pack("<II", rank, len(token)))
+        digest.update(token)
+    return digest.digest()
+
+
+def _to_little(values: array) -> bytes:
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _from_little(data: bytes) -> array:
+    values = array("I")
+    values.frombytes(data)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+
+def save_artifact(
+    artifact_file: str,
+    checksum: bytes,
+    merges: dict[tuple[int, int], int],
+    byte_shuffle: dict[int, int],
+    vocab: dict[int, bytes],
+) -> None:
+    merge_values = array("I")
+    for (idx0, idx1), rank in merges.items():
+        merge_values.extend((idx0, idx1, rank))
+
+    ids = array("I", vocab.keys())
+    offsets = array("I", [0])
+    blob = bytearray()
+    for token in vocab.values():
+        blob += token
+        offsets.append(len(blob))
+
+    save_dir = os.path.dirname(artifact_file)
+    if save_dir and not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+
+    payload = b"".join(
+        [
+            _to_little(array("I", (byte_shuffle[i] for i in range(MAX_BYTE_SIZE)))),
+            _to_little(merge_values),
+            _to_little(ids),
+            _to_little(offsets),
+            blob,
+        ]
+    )
+    header = HEADER.pack(
+        MAGIC,
+        VERSION,
+        len(merges),
+        len(vocab),
+        checksum,
+        hashlib.sha256(payload).digest(),
+    )
+
+    # Write to a temporary file first so readers never see a partial artifact
+    tmp_file = f"{artifact_file}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, "wb") as f:
+            f.write(header)
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, artifact_file)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+"""
+LazyVocab: builds the vocab dict from the artifact bytes on first call
+"""
+
+
+class LazyVocab:
+    def __init__(self, data: bytes, num_tokens: int) -> None:
+        self.data = data
+        self.num_tokens = num_tokens
+
+    def __call__(self) -> dict[int, bytes]:
+        offsets_start = 4 * self.num_tokens
+        blob_start = offsets_start + 4 * (self.num_tokens + 1)
+
+        ids = _from_little(self.data[:offsets_start])
+        offsets = _from_little(self.data[offsets_start:blob_start])
+        blob = self.data[blob_start:]
+        return {idx: blob[offsets[i] : offsets[i + 1]] for i, idx in enumerate(ids)}
+
+
+"""
+Load an artifact
+Returns: checksum, merges, byte_shuffle and a LazyVocab to build the vocab
+Raises ValueError if the file is not an artifact of this version, or is
+truncated or corrupt (its payload does not match the digest of the header).
+"""
+
+
+def load_artifact(
+    artifact_file: str,
+) -> tuple[bytes, dict[tuple[int, int], int], dict[int, int], LazyVocab]:
+    with open(artifact_file, "rb") as f:
+        data = memoryview(f.read())
+
+    if len(data) < HEADER.size:
+        raise ValueError(f"{artifact_file} is not a GPT4Tokenizer artifact.")
+    magic, version, num_merges, num_tokens, checksum, digest = HEADER.unpack_from(
+        data, 0
+    )
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{artifact_file} is not a GPT4Tokenizer artifact.")
+    if hashlib.sha256(data[HEADER.size :]).digest() != digest:
+        raise ValueError(f"{artifact_file} is truncated or corrupt.")
+
+    offset = HEADER.size
+    byte_shuffle = dict(
+        enumerate(_from_little(data[offset : offset + 4 * MAX_BYTE_SIZE]))
+    )
+    offset += 4 * MAX_BYTE_SIZE
+
+    merge_values = _from_little(data[offset : offset + 12 * num_merges])
+    pairs = zip(merge_values[0::3], merge_values[1::3])
+    merges = dict(zip(pairs, merge_values[2::3]))
+    offset += 12 * num_merges
+
+    vocab = LazyVocab(data=bytes(data[offset:]), num_tokens=num_tokens)
+    return checksum, merges, byte_shuffle, vocab
@@ -1,13 +1,25 @@
 import os
-import tiktoken
+from array import array
 
-from minbpe import RegexTokenizer
+from .regex_tokenizer import RegexTokenizer
+from .gpt4_artifact import default_artifact_path, load_artifact, ranks_checksum
+from .gpt4_artifact import save_artifact
+from .rank_encoder import encode_ranks
 from .utils import bytes_to_string
 from .constants import GPT4_SPECIAL_TOKENS, MAX_BYTE_SIZE, SplitPattern
+from .constants import DecodeEngine, EncodeEngine, SplitEngine
 
 
 # Helper functions
 
+
+# tiktoken is imported only when the artifact is built or verified
+def get_cl100k_ranks() -> dict[bytes, int]:
+    import tiktoken
+
+    return tiktoken.get_encoding("cl100k_base")._mergeable_ranks
+
+
 """
 bpe: Byte Pair Encoding
 Convert a token into a list of bytes [byte0, byte1]
@@ -65,31 +77,143 @@ def recover_merges(mergeable_ranks: dict[bytes, int]) -> dict[tuple[int, int], i
     return merges
 
 
+"""
+artifact_file [str]: cached build of the tokenizer (default: default_artifact_path())
+    Built from tiktoken on first use, then loaded without tiktoken (offline)
+    A missing, truncated or corrupt artifact is rebuilt from tiktoken and
+    rewritten (ImportError only if tiktoken is not installed then)
+verify_artifact [bool]: rebuild the artifact if the tiktoken ranks changed
+encode_engine [str]: EncodeEngine.RANKS (default, no byte shuffle), HEAP or NAIVE
+decode_engine [str]: DecodeEngine.DICT or DecodeEngine.FLAT
+split_engine [str]: SplitEngine.REGEX or SplitEngine.FAST
+"""
+
+
 class GPT4Tokenizer(RegexTokenizer):
-    def __init__(self) -> None:
-        super().__init__(pattern=SplitPattern.GPT4_SPLIT_PATTERN)
-        # Load the encoding from the tiktoken
-        enc = tiktoken.get_encoding("cl100k_base")
-        mergeable_ranks = enc._mergeable_ranks
-        self.merges = recover_merges(mergeable_ranks)
-
-        vocab = {idx: bytes([idx]) for idx in range(MAX_BYTE_SIZE)}
-        for (p0, p1), idx in self.merges.items():
-            vocab[idx] = vocab[p0] + vocab[p1]
-        self.vocab = vocab
+    def __init__(
+        self,
+        encode_engine: str = EncodeEngine.RANKS,
+        cache_size: int = 0,
+        cache_max_chunk_len: int = 64,
+        artifact_file: str = None,
+        verify_artifact: bool = False,
+        decode_engine: str = DecodeEngine.DICT,
+        split_engine: str = SplitEngine.REGEX,
+    ) -> None:
+        super().__init__(
+            pattern=SplitPattern.GPT4_SPLIT_PATTERN,
+            encode_engine=encode_engine,
+            cache_size=cache_size,
+            cache_max_chunk_len=cache_max_chunk_len,
+            decode_engine=decode_engine,
+            split_engine=split_engine,
+        )
+        artifact_file = (
+            default_artifact_path() if artifact_file is None else artifact_file
+        )
+        built = True
+        if os.path.exists(artifact_file):
+            try:
+                artifact = load_artifact(artifact_file)
+            except (OSError, ValueError):
+                # Unreadable artifact: rebuilt below
+                artifact = None
+            if artifact is not None:
+                checksum, self.merges, self.byte_shuffle, vocab_loader = artifact
+                self.__vocab = None
+                self.__vocab_loader = vocab_loader
+                built = verify_artifact and (
+                    ranks_checksum(get_cl100k_ranks()) != checksum
+                )
+
+        if built:
+            # Load the encoding from the tiktoken
+            mergeable_ranks = get_cl100k_ranks()
+            self.merges = recover_merges(mergeable_ranks)
+
+            vocab = {idx: bytes([idx]) for idx in range(MAX_BYTE_SIZE)}
+            for (p0, p1), idx in self.merges.items():
+                vocab[idx] = vocab[p0] + vocab[p1]
+            self.vocab = vocab
+
+            # byte_shuffle: byte (0-255) -> mergeable rank[byte]
+            self.byte_shuffle = {
+                i: mergeable_ranks[bytes([i])] for i in range(MAX_BYTE_SIZE)
+            }
+            self.__mergeable_ranks = mergeable_ranks
+
+            try:
+                save_artifact(
+                    artifact_file=artifact_file,
+                    checksum=ranks_checksum(mergeable_ranks),
+                    merges=self.merges,
+                    byte_shuffle=self.byte_shuffle,
+                    vocab=vocab,
+                )
+            except OSError:
+                # The artifact only speeds up later constructions
+                pass
 
-        # byte_shuffle: byte (0-255) -> mergeable rank[byte]
-        self.byte_shuffle = {
-            i: mergeable_ranks[bytes([i])] for i in range(MAX_BYTE_SIZE)
-        }
         # inverse_byte_shuffle: mergeable rank[byte] -> byte (0-255)
         self.inverse_byte_shuffle = {v: k for k, v in self.byte_shuffle.items()}
+        # byte_table, inverse_byte_table: bytes.translate tables for the shuffles
+        self.byte_table = bytes(self.byte_shuffle[i] for i in range(MAX_BYTE_SIZE))
+        self.inverse_byte_table = bytes(
+            self.inverse_byte_shuffle[i] for i in range(MAX_BYTE_SIZE)
+        )
 
         self.register_special_tokens(GPT4_SPECIAL_TOKENS)
 
+    # vocab is built from the artifact on first use
+    @property
+    def vocab(self) -> dict[int, bytes]:
+        if self.__vocab is None:
+            self.__vocab = self.__vocab_loader()
+            self.__vocab_loader = None
+        return self.__vocab
+
+    @vocab.setter
+    def vocab(self, vocab: dict[int, bytes]) -> None:
+        self.__vocab = vocab
+        self.__vocab_loader = None
+        self.__raw_vocab = None
+        self.__mergeable_ranks = None
+
+    # raw_vocab: token id -> original (unshuffled) bytes, special tokens included
+    @property
+    def raw_vocab(self) -> dict[int, bytes]:
+        if self.__raw_vocab is None:
+            raw_vocab = {
+                idx: token.translate(self.inverse_byte_table)
+                for idx, token in self.vocab.items()
+            }
+            for idx, token in self.inverse_special_tokens.items():
+                raw_vocab[idx] = token.encode(encoding="utf-8")
+            self.__raw_vocab = raw_vocab
+        return self.__raw_vocab
+
+    # mergeable_ranks: original bytes -> rank (token id), as in tiktoken
+    @property
+    def mergeable_ranks(self) -> dict[bytes, int]:
+        if self.__mergeable_ranks is None:
+            self.__mergeable_ranks = {
+                token.translate(self.inverse_byte_table): idx
+                for idx, token in self.vocab.items()
+            }
+        return self.__mergeable_ranks
+
+    def register_special_tokens(self, special_tokens: dict[str, int]) -> None:
+        super().register_special_tokens(special_tokens=special_tokens)
+        self.__raw_vocab = None
+
     def train(self, text: str, vocab_size: int, verbose: bool = False) -> None:
         raise NotImplementedError("GPT4Tokenizer cannot be trained")
 
+    def train_from_chunks(
+        self, chunk_counts: dict[bytes, int], vocab_size: int, verbose: bool = False
+    ) -> None:
+        raise NotImplementedError("GPT4Tokenizer cannot be trained")
+
     def save(self, file_prefix: str) -> None:
         raise NotImplementedError("GPT4Tokenizer cannot be saved")
 
@@ -97,13 +221,24 @@ class GPT4Tokenizer(RegexTokenizer):
         raise NotImplementedError("GPT4Tokenizer cannot be loaded")
 
     def encode_chunk(self, text_bytes: bytes) -> list[int]:
-        text_bytes = bytes(self.byte_shuffle[b] for b in text_bytes)
+        if self.encode_engine == EncodeEngine.RANKS:
+            return encode_ranks(piece=text_bytes, mergeable_ranks=self.mergeable_ranks)
+        text_bytes = text_bytes.translate(self.byte_table)
         return super().encode_chunk(text_bytes)
 
-    def decode(self, ids: list[int]) -> str:
-        text_bytes = b"".join(self.vocab[idx] for idx in ids)
-        text_bytes = bytes([self.inverse_byte_shuffle[b] for b in text_bytes])
-        return text_bytes.decode(encoding="utf-8", errors="replace")
+    def decode_table(self) -> dict[int, bytes]:
+        return self.raw_vocab
+
+    def join_tokens(self, ids: list[int] | array) -> bytes:
+        if self.decode_engine != DecodeEngine.DICT:
+            return super().join_tokens(ids)
+        raw_vocab = self.raw_vocab
+        return b"".join(raw_vocab[idx] for idx in ids)
+
+    def token_bytes(self, idx: int) -> bytes:
+        if idx in self.raw_vocab:
+            return self.raw_vocab[idx]
+        raise ValueError("Unknown token: {}".format(idx))
 
     def save_vocab(self, vocab_file: str) -> None:
         vocab = {
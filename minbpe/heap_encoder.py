@@ -0,0 +1,68 @@
+import heapq
+
+"""
+Linked-list + heap BPE encoder, O(n log n) per chunk
+
+Symbols are kept in a doubly linked array (prev/next indexes, -1 at the ends,
+merged-away symbols set to -1). Candidate pairs sit in a heap ordered by
+(rank, position), so the lowest-ranked pair is always merged first and equal
+ranks are merged left to right, exactly like the get_statistics/merge loop.
+Stale heap entries are skipped when popped.
+
+Merges are looked up in a packed table: (p0 << PAIR_SHIFT) | p1 -> new index,
+which avoids building a tuple per lookup.
+"""
+
+PAIR_SHIFT = 32
+
+
+def pack_merges(merges: dict[tuple[int, int], int]) -> dict[int, int]:
+    return {(p0 << PAIR_SHIFT) | p1: idx for (p0, p1), idx in merges.items()}
+
+
+def encode_heap(ids: list[int], packed_merges: dict[int, int]) -> list[int]:
+    n = len(ids)
+    if n < 2:
+        return list(ids)
+
+    ids = list(ids)
+    prev = list(range(-1, n - 1))
+    nxt = list(range(1, n + 1))
+    nxt[-1] = -1
+    get_rank = packed_merges.get
+
+    heap = []
+    for i in range(n - 1):
+        rank = get_rank((ids[i] << PAIR_SHIFT) | ids[i + 1])
+        if rank is not None:
+            heap.append((rank, i))
+    heapq.heapify(heap)
+
+    while heap:
+        rank, i = heapq.heappop(heap)
+        j = nxt[i]
+        if ids[i] < 0 or j < 0:
+            continue
+        if get_rank((ids[i] << PAIR_SHIFT) | ids[j]) != rank:
+            continue
+
+        # Merge symbols i and j into i (the rank is the new token index)
+        ids[i] = rank
+        ids[j] = -1
+        k = nxt[j]
+        nxt[i] = k
+        if k >= 0:
+            prev[k] = i
+
+        # Push the new candidate pairs with the left and right neighbours
+        p = prev[i]
+        if p >= 0:
+            left_rank = get_rank((ids[p] << PAIR_SHIFT) | rank)
+            if left_rank is not None:
+                heapq.heappush(heap, (left_rank, p))
+        if k >= 0:
+            right_rank = get_rank((rank << PAIR_SHIFT) | ids[k])
+            if right_rank is not None:
+                heapq.heappush(heap, (right_rank, i))
+
+    return [idx for idx in ids if idx >= 0]
@@ -0,0 +1,159 @@
+import time
+from typing import Callable
+
+"""
+Opt-in instrumentation of the hot paths
+
+Instrumentation accumulates per-phase timers (seconds) and counters. It is
+disabled by default: instrumented code only checks `enabled` before taking a
+timestamp, so the cost when disabled is one attribute lookup per call.
+    callback [Callable[[str, dict], None]]: called with (event, info), e.g. on
+        rate-limited training progress ("train_progress") and at the end of
+        training ("train_end")
+
+Phases recorded by the tokenizers:
+    train_split, train_merge: pre-tokenization and merge loop of train
+    special: special-token matching in encode
+    split: regex split in encode_ordinary
+    bpe: merging chunks (or the whole text for BasicTokenizer) into tokens
+    decode: decode
+"""
+
+
+class Instrumentation:
+    def __init__(
+        self, enabled: bool = False, callback: Callable[[str, dict], None] = None
+    ) -> None:
+        self.enabled = enabled
+        self.callback = callback
+        self.timers = {}
+        self.counters = {}
+
+    # Add the time elapsed since start (a time.perf_counter() value) to phase
+    def record(self, phase: str, start: float, **counters: int) -> None:
+        self.timers[phase] = self.timers.get(phase, 0.0) + time.perf_counter() - start
+        self.count(**counters)
+
+    def count(self, **counters: int) -> None:
+        for name, value in counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def emit(self, event: str, info: dict) -> None:
+        if self.callback is not None:
+            self.callback(event, info)
+
+    def reset(self) -> None:
+        self.timers = {}
+        self.counters = {}
+
+    """
+    Snapshot of the timers and counters, with derived rates:
+        avg_chunk_len: average chunk length in bytes
+        merges_per_s: merges applied per second of the training merge loop
+        encode_mb_per_s, decode_tokens_per_s: throughput of encode and decode
+    """
+
+    def stats(self) -> dict:
+        timers, counters = self.timers, self.counters
+        derived = {}
+        if counters.get("chunks"):
+            derived["avg_chunk_len"] = counters["encoded_bytes"] / counters["chunks"]
+        if timers.get("train_merge"):
+            derived["merges_per_s"] = counters["merges"] / timers["train_merge"]
+        encode_time = sum(
+            timers.get(phase, 0.0) for phase in ("special", "split", "bpe")
+        )
+        if encode_time and counters.get("encoded_bytes"):
+            derived["encode_mb_per_s"] = counters["encoded_bytes"] / encode_time / 1e6
+        if timers.get("decode"):
+            derived["decode_tokens_per_s"] = (
+                counters["decoded_tokens"] / timers["decode"]
+            )
+        return {"timers": dict(timers), "counters": dict(counters), **derived}
+
+
+"""
+ProgressReporter: rate-limited training progress
+Prints (if verbose) and emits "train_progress" at most once every interval
+seconds. finish, called once training stops (at num_merges, min_frequency or out
+of pairs), reports the last merge if it was skipped and emits "train_end". It
+does nothing when neither verbose nor a callback is set.
+    initial [int]: number of merges done before (when resuming or extending)
+"""
+
+
+class ProgressReporter:
+    def __init__(
+        self,
+        num_merges: int,
+        interval: float,
+        verbose: bool,
+        instrumentation: Instrumentation,
+        initial: int = 0,
+    ) -> None:
+        self.num_merges = num_merges
+        self.initial = initial
+        self.interval = interval
+        self.verbose = verbose
+        self.instrumentation = instrumentation
+        self.active = verbose or instrumentation.callback is not None
+        self.start = time.perf_counter()
+        self.last = self.start
+        # Last merge not reported yet (reported by finish)
+        self.skipped = None
+
+    def update(
+        self, i: int, pair: tuple[int, int], idx: int, token: bytes, count: int
+    ) -> None:
+        if not self.active:
+            return
+        now = time.perf_counter()
+        if now - self.last < self.interval:
+            self.skipped = (i, pair, idx, token, count)
+            return
+        self.last = now
+        self.skipped = None
+        self.report(now, i, pair, idx, token, count)
+
+    def finish(self) -> None:
+        if not self.active:
+            return
+        if self.skipped is not None:
+            self.report(time.perf_counter(), *self.skipped)
+            self.skipped = None
+        self.instrumentation.emit("train_end", self.instrumentation.stats())
+
+    def report(
+        self,
+        now: float,
+        i: int,
+        pair: tuple[int, int],
+        idx: int,
+        token: bytes,
+        count: int,
+    ) -> None:
+        merges_per_s = (i + 1 - self.initial) / max(now - self.start, 1e-9)
+        if self.verbose:
+            print(
+                "Merge {:>4} / {:<4}: {:>10} -> {:>4} ({}) had {} occurrences"
+                " [{:.1f} merges/s]".format(
+                    i + 1,
+                    self.num_merges,
+                    str(pair),
+                    idx,
+                    str(token),
+                    count,
+                    merges_per_s,
+                )
+            )
+        self.instrumentation.emit(
+            "train_progress",
+            {
+                "merges": i + 1,
+                "num_merges": self.num_merges,
+                "pair": pair,
+                "idx": idx,
+                "count": count,
+                "merges_per_s": merges_per_s,
+            },
+        )
@@ -0,0 +1,157 @@
+from typing import Iterator
+
+import numpy as np
+
+"""
+NumPy versions of utils.get_statistics and utils.merge
+
+Token sequences are contiguous uint32 arrays. Adjacent pairs are packed into
+uint64 keys (p0 << PAIR_SHIFT) | p1, counted with np.unique, and merges are a
+vectorized mask-and-compact. Results match the list-based functions exactly,
+including the order of the statistics dict (first occurrence), so training
+tie-breaks are unchanged.
+"""
+
+PAIR_SHIFT = np.uint64(32)
+PAIR_MASK = np.uint64(0xFFFFFFFF)
+# Marks a word boundary in a flat array of words, never part of a pair
+SEPARATOR = np.uint32(0xFFFFFFFF)
+
+
+def to_array(ids) -> np.ndarray:
+    return np.asarray(ids, dtype=np.uint32)
+
+
+def pack_pairs(ids: np.ndarray) -> np.ndarray:
+    return (ids[:-1].astype(np.uint64) << PAIR_SHIFT) | ids[1:].astype(np.uint64)
+
+
+def unpack_pair(key: int) -> tuple[int, int]:
+    return int(np.uint64(key) >> PAIR_SHIFT), int(np.uint64(key) & PAIR_MASK)
+
+
+"""
+Count adjacent pairs of a flat array
+    weights [np.ndarray]: weight of the pair starting at every position (optional)
+Pairs touching SEPARATOR are skipped
+Returns: unique pair keys in order of first occurrence and their counts
+"""
+
+
+def count_pairs(
+    ids: np.ndarray, weights: np.ndarray = None
+) -> tuple[np.ndarray, np.ndarray]:
+    if len(ids) < 2:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+
+    keys = pack_pairs(ids)
+    valid = (ids[:-1] != SEPARATOR) & (ids[1:] != SEPARATOR)
+    if not valid.all():
+        keys = keys[valid]
+        if weights is not None:
+            weights = weights[:-1][valid]
+    elif weights is not None:
+        weights = weights[:-1]
+
+    unique_keys, first, inverse = np.unique(
+        keys, return_index=True, return_inverse=True
+    )
+    if weights is None:
+        counts = np.bincount(inverse, minlength=len(unique_keys))
+    else:
+        counts = np.zeros(len(unique_keys), dtype=np.int64)
+        np.add.at(counts, inverse, weights)
+
+    order = np.argsort(first, kind="stable")
+    return unique_keys[order], counts[order].astype(np.int64)
+
+
+# Statistic frequency of pairs of adjacent tokens, same result as utils.get_statistics
+def get_statistics(ids: np.ndarray, counts: dict = None, weight: int = 1) -> dict:
+    counts = {} if counts is None else counts
+    keys, pair_counts = count_pairs(to_array(ids))
+    for key, count in zip(keys.tolist(), pair_counts.tolist()):
+        pair = unpack_pair(key)
+        counts[pair] = counts.get(pair, 0) + count * weight
+    return counts
+
+
+"""
+Mask of the positions where pair is merged, scanning left to right like utils.merge
+Overlapping matches only occur when pair[0] == pair[1] (e.g. "aaa"): within a run
+of consecutive matches, only every other one (from the start of the run) is kept
+"""
+
+
+def merge_mask(ids: np.ndarray, pair: tuple[int, int]) -> np.ndarray:
+    mask = np.zeros(len(ids), dtype=bool)
+    if len(ids) < 2:
+        return mask
+    mask[:-1] = (ids[:-1] == pair[0]) & (ids[1:] == pair[1])
+    if pair[0] != pair[1] or not mask.any():
+        return mask
+
+    positions = np.arange(len(ids))
+    run_starts = mask.copy()
+    run_starts[1:] &= ~mask[:-1]
+    run_start = np.maximum.accumulate(np.where(run_starts, positions, 0))
+    return mask & ((positions - run_start) % 2 == 0)
+
+
+# Replace all occurrences of a pair of tokens with a single token (new_index)
+# Returns the compacted array and the keep mask (to compact parallel arrays)
+def merge_with_mask(
+    ids: np.ndarray, pair: tuple[int, int], new_index: int
+) -> tuple[np.ndarray, np.ndarray]:
+    mask = merge_mask(ids, pair)
+    keep = np.ones(len(ids), dtype=bool)
+    keep[1:] = ~mask[:-1]
+    new_ids = ids.copy()
+    new_ids[mask] = new_index
+    return new_ids[keep], keep
+
+
+# Replace all occurrences of a pair of tokens with a single token (new_index)
+def merge(ids: np.ndarray, pair: tuple[int, int], new_index: int) -> np.ndarray:
+    return merge_with_mask(to_array(ids), pair, new_index)[0]
+
+
+"""
+NumPy training loop, same merges as bpe_trainer.naive_train
+    chunks [list[list[int]]]: sequences of ids, laid out in one flat array
+    weights [list[int]]: number of occurrences of each chunk (default: 1 each)
+"""
+
+
+def numpy_train(
+    chunks: list[list[int]],
+    num_merges: int,
+    start_index: int,
+    weights: list[int] = None,
+) -> Iterator[tuple[tuple[int, int], int, int]]:
+    weights = [1] * len(chunks) if weights is None else weights
+
+    flat_ids = []
+    flat_weights = []
+    for chunk_ids, weight in zip(chunks, weights):
+        flat_ids.extend(chunk_ids)
+        flat_ids.append(int(SEPARATOR))
+        flat_weights.extend([weight] * (len(chunk_ids) + 1))
+    ids = to_array(flat_ids)
+    position_weights = np.asarray(flat_weights, dtype=np.int64)
+    if all(weight == 1 for weight in weights):
+        position_weights = None
+
+    for i in range(num_merges):
+        keys, counts = count_pairs(ids, position_weights)
+        if len(keys) == 0:
+            break
+
+        # argmax returns the first maximum: the pair that occurs first
+        top = int(np.argmax(counts))
+        top_pair = unpack_pair(keys[top])
+        idx = start_index + i
+        ids, keep = merge_with_mask(ids, top_pair, idx)
+        if position_weights is not None:
+            position_weights = position_weights[keep]
+        yield top_pair, idx, int(counts[top])
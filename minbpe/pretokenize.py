@@ -0,0 +1,168 @@
+import glob
+import os
+from collections import deque
+from typing import Iterable, Iterator, TextIO
+
+import regex as re
+
+from .utils import get_chunk_counts
+from .constants import SplitPattern
+
+"""
+Streaming pre-tokenization: split input files into chunks with the split pattern
+and reduce them into one chunk-frequency table (dict[bytes, int]).
+
+Files are read in blocks of about block_size characters. A block is only cut at
+a safe boundary: a space " " that follows a non-whitespace character. For the
+GPT-2/GPT-4 split patterns this is always a match boundary and none of the
+matches before it look past it, so splitting the blocks separately yields the
+same chunks as splitting the whole file. The text after the last safe boundary
+is carried over to the next block. Other patterns have no safe cut: their files
+are split whole.
+
+Peak memory is bounded by the chunk-frequency table plus a few blocks in flight.
+"""
+
+DEFAULT_BLOCK_SIZE = 1 << 20
+
+
+# Expand a path, a glob or a list of them into a sorted list of files
+def resolve_paths(input_paths: str | list[str]) -> list[str]:
+    if isinstance(input_paths, str):
+        input_paths = [input_paths]
+
+    paths = []
+    for input_path in input_paths:
+        matches = sorted(glob.glob(input_path))
+        if not matches:
+            raise FileNotFoundError(f"File {input_path} not found.")
+        paths.extend(path for path in matches if os.path.isfile(path))
+
+    return paths
+
+
+# Whether safe boundaries are match boundaries of pattern (GPT-2/GPT-4 patterns)
+def has_safe_boundaries(pattern: str) -> bool:
+    return pattern in (
+        SplitPattern.GPT2_SPLIT_PATTERN,
+        SplitPattern.GPT4_SPLIT_PATTERN,
+    )
+
+
+# Index of the last safe boundary in text (0 if there is none)
+def find_safe_boundary(text: str) -> int:
+    k = text.rfind(" ")
+    while k > 0:
+        if not text[k - 1].isspace():
+            return k
+        k = text.rfind(" ", 0, k)
+    return 0
+
+
+"""
+Read files in blocks of about block_size characters, each ending at a safe boundary
+The last block of every file ends at the end of the file
+block_size None reads every file as one block
+"""
+
+
+def iter_blocks(
+    paths: list[str], block_size: int | None = DEFAULT_BLOCK_SIZE
+) -> Iterator[str]:
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            if block_size is None:
+                text = f.read()
+                if text:
+                    yield text
+                continue
+            carry = ""
+            while True:
+                data = f.read(block_size)
+                if not data:
+                    break
+                text = carry + data
+                k = find_safe_boundary(text)
+                if k == 0:
+                    # No safe boundary yet: keep reading
+                    carry = text
+                    continue
+                yield text[:k]
+                carry = text[k:]
+            if carry:
+                yield carry
+
+
+# Pieces of text from a file-like object (read in buffer_size chars) or an iterable
+def iter_text(source: TextIO | Iterable[str], buffer_size: int) -> Iterator[str]:
+    if hasattr(source, "read"):
+        while True:
+            piece = source.read(buffer_size)
+            if not piece:
+                break
+            yield piece
+    else:
+        yield from source
+
+
+# Worker state: the split pattern is compiled once per process
+_compiled_pattern = None
+
+
+def _init_worker(pattern: str) -> None:
+    global _compiled_pattern
+    _compiled_pattern = re.compile(pattern)
+
+
+def _count_block(text: str) -> dict[bytes, int]:
+    return get_chunk_counts(re.findall(_compiled_pattern, text))
+
+
+"""
+Build the chunk-frequency table of input files
+    input_paths [str | list[str]]: file path(s) or glob(s)
+    pattern [str]: split pattern (e.g. tokenizer.pattern)
+    block_size [int]: number of characters read at once (patterns other than
+        GPT-2/GPT-4 have no safe boundaries: their files are read whole)
+    num_workers [int]: number of worker processes (default: os.cpu_count())
+Keys keep the order of first occurrence across all files
+"""
+
+
+def count_chunks(
+    input_paths: str | list[str],
+    pattern: str,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    num_workers: int = None,
+) -> dict[bytes, int]:
+    paths = resolve_paths(input_paths)
+    if not has_safe_boundaries(pattern):
+        block_size = None
+    blocks = iter_blocks(paths, block_size=block_size)
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+
+    chunk_counts = {}
+    if num_workers <= 1:
+        _init_worker(pattern)
+        for block in blocks:
+            _merge_counts(chunk_counts, _count_block(block))
+        return chunk_counts
+
+    from multiprocessing import Pool
+
+    # Keep a bounded window of blocks in flight and reduce them in order
+    with Pool(num_workers, initializer=_init_worker, initargs=(pattern,)) as pool:
+        pending = deque()
+        for block in blocks:
+            pending.append(pool.apply_async(_count_block, (block,)))
+            if len(pending) >= 2 * num_workers:
+                _merge_counts(chunk_counts, pending.popleft().get())
+        while pending:
+            _merge_counts(chunk_counts, pending.popleft().get())
+
+    return chunk_counts
+
+
+def _merge_counts(counts: dict[bytes, int], other: dict[bytes, int]) -> None:
+    for chunk_bytes, count in other.items():
+        counts[chunk_bytes] = counts.get(chunk_bytes, 0) + count
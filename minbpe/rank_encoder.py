@@ -0,0 +1,67 @@
+import heapq
+
+"""
+Rank-native BPE encoder working directly on tiktoken-style mergeable ranks
+(bytes -> rank), so GPT4Tokenizer needs no byte shuffle to encode.
+
+A piece that is itself a token is returned at once (most words are). Otherwise
+the piece is split into single bytes, kept as a linked list of segments
+(next[i]: start of the segment after the one starting at i), and adjacent
+segments are merged lowest rank first (leftmost on ties) through a heap of
+(rank, start) entries, like heap_encoder. The rank of two adjacent segments is
+the rank of their concatenated bytes.
+"""
+
+
+def encode_ranks(piece: bytes, mergeable_ranks: dict[bytes, int]) -> list[int]:
+    get_rank = mergeable_ranks.get
+    rank = get_rank(piece)
+    if rank is not None:
+        return [rank]
+
+    n = len(piece)
+    prev = list(range(-1, n - 1))
+    nxt = list(range(1, n + 1))
+    alive = [True] * n
+
+    heap = []
+    for i in range(n - 1):
+        rank = get_rank(piece[i : i + 2])
+        if rank is not None:
+            heap.append((rank, i))
+    heapq.heapify(heap)
+
+    while heap:
+        rank, i = heapq.heappop(heap)
+        if not alive[i]:
+            continue
+        j = nxt[i]
+        if j >= n:
+            continue
+        end = nxt[j]
+        if get_rank(piece[i:end]) != rank:
+            continue
+
+        # Merge the segments starting at i and j
+        alive[j] = False
+        nxt[i] = end
+        if end < n:
+            prev[end] = i
+
+        # Push the new candidate pairs with the left and right neighbours
+        p = prev[i]
+        if p >= 0:
+            left_rank = get_rank(piece[p:end])
+            if left_rank is not None:
+                heapq.heappush(heap, (left_rank, p))
+        if end < n:
+            right_rank = get_rank(piece[i : nxt[end]])
+            if right_rank is not None:
+                heapq.heappush(heap, (right_rank, i))
+
+    ids = []
+    i = 0
+    while i < n:
+        ids.append(mergeable_ranks[piece[i : nxt[i]]])
+        i = nxt[i]
+    return ids
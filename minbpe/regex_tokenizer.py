@@ -1,104 +1,512 @@
+import time
+from array import array
+from typing import Iterable, Iterator, TextIO
+
 import regex as re
 
 from .base import Tokenizer
-from .utils import get_statistics, merge
-from .constants import SplitPattern, MAX_BYTE_SIZE
+from .bpe_trainer import get_train_steps
+from .checkpoint import DEFAULT_CHECKPOINT_INTERVAL, Checkpointer
+from .checkpoint import get_initial_state, input_fingerprint
+from .chunk_cache import ChunkCache
+from .fast_split import get_fast_splitter
+from .heap_encoder import encode_heap
+from .instrumentation import ProgressReporter
+from .pretokenize import find_safe_boundary, has_safe_boundaries, iter_text
+from .train_options import prune_fingerprint, prune_words, sample_chunk_counts
+from .utils import get_statistics, get_chunk_counts, merge
+from .constants import (
+    SplitPattern,
+    MAX_BYTE_SIZE,
+    BatchBackend,
+    DecodeEngine,
+    EncodeEngine,
+    SplitEngine,
+    TrainEngine,
+)
 
 """
 pattern [str]: regex pattern to split text into tokens
-compiled_pattern [re.Pattern]: compiled regex pattern
+compiled_pattern [re.Pattern]: compiled regex pattern (compiled on first use)
 special_tokens [dict[str, int]]: special tokens (e.g. {'<|endoftext|>': 100257})
 inverse_special_tokens [dict[int, str]]: inverse of special tokens
+train_engine [str]: training engine (TrainEngine.INCREMENTAL, TrainEngine.NAIVE
+    or TrainEngine.NUMPY)
+encode_engine [str]: encoding engine (EncodeEngine.HEAP or EncodeEngine.NAIVE)
+decode_engine [str]: decoding engine (DecodeEngine.DICT or DecodeEngine.FLAT)
+split_engine [str]: pre-tokenizer (SplitEngine.REGEX or SplitEngine.FAST)
+cache_size [int]: number of chunks memoized by encode_ordinary (0 disables the cache)
+cache_max_chunk_len [int]: chunks longer than this (in bytes) bypass the cache
 """
 
 
 class RegexTokenizer(Tokenizer):
-    def __init__(self, pattern: str = None) -> None:
+    WORKER_SETTINGS = Tokenizer.WORKER_SETTINGS + [
+        "encode_engine",
+        "split_engine",
+        "chunk_cache.max_size",
+        "chunk_cache.max_chunk_len",
+    ]
+
+    def __init__(
+        self,
+        pattern: str = None,
+        train_engine: str = TrainEngine.INCREMENTAL,
+        encode_engine: str = EncodeEngine.HEAP,
+        cache_size: int = 0,
+        cache_max_chunk_len: int = 64,
+        decode_engine: str = DecodeEngine.DICT,
+        split_engine: str = SplitEngine.REGEX,
+    ) -> None:
         super().__init__()
         self.pattern = SplitPattern.GPT4_SPLIT_PATTERN if pattern is None else pattern
-        self.compiled_pattern = re.compile(self.pattern)
+        self.__compiled_pattern = None
+        self.__compiled_source = None
         self.special_tokens = {}
         self.inverse_special_tokens = {}
+        self.train_engine = train_engine
+        self.encode_engine = encode_engine
+        self.decode_engine = decode_engine
+        self.split_engine = split_engine
+        self.chunk_cache = ChunkCache(
+            max_size=cache_size, max_chunk_len=cache_max_chunk_len
+        )
+        self.__special_matchers = {}
+        self.__matchers_key = None
 
-    def train(self, text: str, vocab_size: int, verbose: bool = False) -> None:
+    # compiled_pattern: compiled on first use, and again whenever pattern changes
+    @property
+    def compiled_pattern(self) -> re.Pattern:
+        if self.__compiled_source != self.pattern:
+            self.__compiled_pattern = re.compile(self.pattern)
+            self.__compiled_source = self.pattern
+        return self.__compiled_pattern
+
+    # FastSplitter of pattern with SplitEngine.FAST, None to use compiled_pattern
+    def fast_splitter(self):
+        if self.split_engine == SplitEngine.FAST:
+            return get_fast_splitter(self.pattern)
+        if self.split_engine != SplitEngine.REGEX:
+            raise ValueError(
+                "split_engine = {} not understood".format(self.split_engine)
+            )
+        return None
+
+    # Split text into chunks with pattern
+    def split_text(self, text: str) -> list[str]:
+        splitter = self.fast_splitter()
+        if splitter is not None:
+            return splitter.findall(text)
+        return self.compiled_pattern.findall(text)
+
+    """
+    Train on text up to vocab_size tokens
+        extend [bool]: continue from the current merges (e.g. of a loaded model)
+        checkpoint_file [str]: save a checkpoint there every checkpoint_interval
+            merges, and resume from it if it exists
+        min_frequency [int]: stop early once the top pair occurs fewer times
+        sample_rate [float]: train on a seeded subsample of the chunks (0 < rate <= 1)
+        seed [int]: seed of the subsample
+        prune [bool]: drop the parts of the chunks that can no longer be merged
+    See minbpe.train_options
+    """
+
+    def train(
+        self,
+        text: str,
+        vocab_size: int,
+        verbose: bool = False,
+        extend: bool = False,
+        checkpoint_file: str = None,
+        checkpoint_interval: int = DEFAULT_CHECKPOINT_INTERVAL,
+        min_frequency: int = 1,
+        sample_rate: float = None,
+        seed: int = 0,
+        prune: bool = False,
+    ) -> None:
+        start = time.perf_counter()
+        text_chunks = self.split_text(text)
+        chunk_counts = get_chunk_counts(text_chunks)
+        if self.instrumentation.enabled:
+            self.instrumentation.record(
+                "train_split",
+                start,
+                train_chunks=len(text_chunks),
+                unique_chunks=len(chunk_counts),
+            )
+        self.train_from_chunks(
+            chunk_counts=chunk_counts,
+            vocab_size=vocab_size,
+            verbose=verbose,
+            extend=extend,
+            checkpoint_file=checkpoint_file,
+            checkpoint_interval=checkpoint_interval,
+            min_frequency=min_frequency,
+            sample_rate=sample_rate,
+            seed=seed,
+            prune=prune,
+        )
+
+    """
+    Train from a chunk-frequency table instead of raw text
+        chunk_counts [dict[bytes, int]]: unique chunk bytes -> number of occurrences,
+            in order of first occurrence (see utils.get_chunk_counts)
+    Identical chunks are stored and merged once, their pairs weighted by count
+    """
+
+    def train_from_chunks(
+        self,
+        chunk_counts: dict[bytes, int],
+        vocab_size: int,
+        verbose: bool = False,
+        extend: bool = False,
+        checkpoint_file: str = None,
+        checkpoint_interval: int = DEFAULT_CHECKPOINT_INTERVAL,
+        min_frequency: int = 1,
+        sample_rate: float = None,
+        seed: int = 0,
+        prune: bool = False,
+    ) -> None:
+        start = time.perf_counter()
         num_merges = vocab_size - MAX_BYTE_SIZE
 
-        text_chunks = re.findall(self.compiled_pattern, text)
-        ids = [list(chunk.encode(encoding="utf-8")) for chunk in text_chunks]
+        if extend and num_merges < len(self.merges):
+            raise ValueError(
+                "vocab_size = {} is smaller than the current vocab".format(vocab_size)
+            )
+        if extend and prune:
+            raise ValueError("prune cannot continue from existing merges")
+        if sample_rate is not None:
+            chunk_counts = sample_chunk_counts(chunk_counts, sample_rate, seed)
+        fingerprint = input_fingerprint(chunk_counts)
+        words = [list(chunk_bytes) for chunk_bytes in chunk_counts]
+        weights = list(chunk_counts.values())
+        if prune:
+            words, weights = prune_words(words, weights, min_frequency)
+            fingerprint = prune_fingerprint(fingerprint, min_frequency)
+        merges, ids = get_initial_state(
+            words=words,
+            fingerprint=fingerprint,
+            checkpoint_file=checkpoint_file,
+            merges=self.merges if extend else None,
+        )
+        initial = len(merges)
 
-        merges = {}
-        vocab = {idx: bytes([idx]) for idx in range(MAX_BYTE_SIZE)}
+        steps, current_words = get_train_steps(
+            self.train_engine,
+            ids,
+            weights,
+            num_merges - initial,
+            MAX_BYTE_SIZE + initial,
+        )
+        checkpointer = None
+        if checkpoint_file is not None:
+            checkpointer = Checkpointer(
+                checkpoint_file, checkpoint_interval, fingerprint, current_words
+            )
 
-        print("Training Regex Tokenizer...")
-        for i in range(num_merges):
-            stats = {}
-            for chunk_ids in ids:
-                stats = get_statistics(chunk_ids, stats)
+        self.train_from_steps(
+            steps=steps,
+            vocab_size=vocab_size,
+            verbose=verbose,
+            merges=merges,
+            checkpointer=checkpointer,
+            start=start,
+            min_frequency=min_frequency,
+        )
 
-            top_pair = max(stats, key=stats.get)
-            idx = MAX_BYTE_SIZE + i
-            ids = [
-                merge(ids=chunk_ids, pair=top_pair, new_index=idx) for chunk_ids in ids
-            ]
+    """
+    Build merges and vocab from training steps (pair, new index, count)
+        steps: e.g. from get_train_steps or a sharded_train.ShardCoordinator
+        merges [dict[tuple[int, int], int]]: merges done before the steps
+        checkpointer [Checkpointer]: saves checkpoints as merges are added
+        start [float]: time.perf_counter() when training started
+        min_frequency [int]: stop at the first step whose pair count is lower
+    """
 
+    def train_from_steps(
+        self,
+        steps: Iterable[tuple[tuple[int, int], int, int]],
+        vocab_size: int,
+        verbose: bool = False,
+        merges: dict[tuple[int, int], int] = None,
+        checkpointer: Checkpointer = None,
+        start: float = None,
+        min_frequency: int = 1,
+    ) -> None:
+        instrumentation = self.instrumentation
+        start = time.perf_counter() if start is None else start
+        num_merges = vocab_size - MAX_BYTE_SIZE
+        merges = {} if merges is None else merges
+        initial = len(merges)
+
+        vocab = {idx: bytes([idx]) for idx in range(MAX_BYTE_SIZE)}
+        for (p0, p1), idx in merges.items():
+            vocab[idx] = vocab[p0] + vocab[p1]
+
+        reporter = ProgressReporter(
+            num_merges, self.progress_interval, verbose, instrumentation, initial
+        )
+        print("Training Regex Tokenizer...")
+        for top_pair, idx, count in steps:
+            if count < min_frequency:
+                break
             merges[top_pair] = idx
             vocab[idx] = vocab[top_pair[0]] + vocab[top_pair[1]]
-
-            if verbose:
-                print(
-                    "Merge {:>4} / {:<4}: {:>10} -> {:>4} ({}) had {} occurrences".format(
-                        i + 1,
-                        num_merges,
-                        str(top_pair),
-                        idx,
-                        str(vocab[idx]),
-                        stats[top_pair],
-                    )
-                )
+            reporter.update(len(merges) - 1, top_pair, idx, vocab[idx], count)
+            if checkpointer is not None:
+                checkpointer.update(merges)
         self.merges = merges
         self.vocab = vocab
+        self.mark_changed()
+        self.chunk_cache.clear()
+
+        if instrumentation.enabled:
+            instrumentation.record("train_merge", start, merges=len(merges) - initial)
+        reporter.finish()
+
+    """
+    Compiled matcher of the special tokens to look for with allowed_special
+    ("none_raise" looks for all of them), None if there are none
+    Matchers are cached per allowed_special and rebuilt when special_tokens changes
+    (see Tokenizer.cache_key), so the cost per call does not grow with the number
+    of special tokens.
+    The alternation keeps the order of special_tokens.
+    """
 
-    def encode(self, s: str, allowed_special: str | set = "none_raise") -> list[int]:
-        special_tokens = None
-        if allowed_special == "all":
-            special_tokens = self.special_tokens
-        elif allowed_special == "none":
-            special_tokens = {}
+    def get_special_matcher(self, allowed_special: str | set) -> re.Pattern | None:
+        state_key = self.cache_key(self.special_tokens)
+        if self.__matchers_key != state_key:
+            self.__special_matchers = {}
+            self.__matchers_key = state_key
+
+        if isinstance(allowed_special, str):
+            key = allowed_special
+        else:
+            key = frozenset(allowed_special)
+        if key in self.__special_matchers:
+            return self.__special_matchers[key]
+
+        if allowed_special == "none":
+            tokens = []
+        elif allowed_special in ("all", "none_raise"):
+            tokens = list(self.special_tokens)
+        else:
+            tokens = [k for k in self.special_tokens if k in allowed_special]
+        matcher = None
+        if tokens:
+            matcher = re.compile("|".join(re.escape(k) for k in tokens))
+        self.__special_matchers[key] = matcher
+        return matcher
+
+    # Matcher of the special tokens to encode in s (asserts there are none for "none_raise")
+    def __encode_matcher(self, s: str, allowed_special: str | set) -> re.Pattern | None:
+        if allowed_special in ("all", "none") or isinstance(allowed_special, set):
+            return self.get_special_matcher(allowed_special)
         elif allowed_special == "none_raise":
-            special_tokens = {}
-            assert all(
-                token not in s for token in self.special_tokens
+            all_matcher = self.get_special_matcher(allowed_special)
+            assert (
+                all_matcher is None or all_matcher.search(s) is None
             ), "Error: Text contains special tokens"
-        elif isinstance(allowed_special, set):
-            special_tokens = {
-                key: value
-                for key, value in self.special_tokens.items()
-                if key in allowed_special
-            }
-        else:
-            raise ValueError(
-                "allowed_special = {} not understood".format(allowed_special.items())
-            )
+            return None
+        raise ValueError("allowed_special = {} not understood".format(allowed_special))
+
+    """
+    Encode s, or only its first max_tokens tokens
+        max_tokens [int]: stop splitting and merging once max_tokens tokens are
+            produced, the result equals encode(s)[:max_tokens]
+    """
+
+    def encode(
+        self,
+        s: str,
+        allowed_special: str | set = "none_raise",
+        max_tokens: int = None,
+    ) -> list[int]:
+        if max_tokens is not None:
+            return self.__encode_prefix(s, allowed_special, max_tokens)
+
+        instrumentation = self.instrumentation
+        if instrumentation.enabled:
+            start = time.perf_counter()
+
+        matcher = self.__encode_matcher(s, allowed_special)
         # If no special tokens, just use the ordinary encoding
-        if not special_tokens:
+        if matcher is None:
+            if instrumentation.enabled and allowed_special == "none_raise":
+                instrumentation.record("special", start)
             return self.encode_ordinary(s)
-        # Create a regex pattern to match special tokens
-        special_pattern = (
-            "(" + "|".join(re.escape(k) for k in special_tokens.keys()) + ")"
-        )
-        # Split the text into chunks of ordinary text and special tokens
-        special_chunks = re.split(pattern=special_pattern, string=s)
 
+        matches = list(matcher.finditer(s))
+        if instrumentation.enabled:
+            instrumentation.record("special", start, special_tokens=len(matches))
+
+        # Encode the ordinary text between special tokens
         ids = []
-        for chunk in special_chunks:
-            if chunk in special_tokens:
-                ids.append(special_tokens[chunk])
-            else:
-                ids.extend(self.encode_ordinary(text=chunk))
+        end = 0
+        for match in matches:
+            ids.extend(self.encode_ordinary(text=s[end : match.start()]))
+            ids.append(self.special_tokens[match.group()])
+            end = match.end()
+        ids.extend(self.encode_ordinary(text=s[end:]))
 
         return ids
 
-    def decode(self, ids: list[int]) -> str:
+    """
+    Encode s lazily, one chunk or special token at a time
+    Yields (ids, end): the ids of the chunk or special token and its end offset in s
+    """
+
+    def iter_encode(
+        self, s: str, allowed_special: str | set = "none_raise"
+    ) -> Iterator[tuple[list[int], int]]:
+        matcher = self.__encode_matcher(s, allowed_special)
+        end = 0
+        if matcher is not None:
+            for match in matcher.finditer(s):
+                yield from self.__iter_encode_ordinary(s[end : match.start()], end)
+                yield [self.special_tokens[match.group()]], match.end()
+                end = match.end()
+        yield from self.__iter_encode_ordinary(s[end:], end)
+
+    def __iter_encode_ordinary(
+        self, text: str, offset: int
+    ) -> Iterator[tuple[list[int], int]]:
+        splitter = self.fast_splitter()
+        if splitter is None:
+            spans = (match.span() for match in self.compiled_pattern.finditer(text))
+        else:
+            spans = splitter.spans(text)
+        for start, end in spans:
+            chunk_bytes = text[start:end].encode(encoding="utf-8")
+            yield self.encode_chunk_cached(text_bytes=chunk_bytes), offset + end
+
+    def __encode_prefix(
+        self, s: str, allowed_special: str | set, max_tokens: int
+    ) -> list[int]:
+        if max_tokens < 0:
+            raise ValueError("max_tokens = {} not understood".format(max_tokens))
+        ids = []
+        if max_tokens == 0:
+            return ids
+        for chunk_ids, _ in self.iter_encode(s, allowed_special=allowed_special):
+            ids.extend(chunk_ids[: max_tokens - len(ids)])
+            if len(ids) == max_tokens:
+                break
+        return ids
+
+    # Number of tokens of encode(s), without building the list of ids
+    def count_tokens(self, s: str, allowed_special: str | set = "none_raise") -> int:
+        return sum(
+            len(ids) for ids, _ in self.iter_encode(s, allowed_special=allowed_special)
+        )
+
+    """
+    Longest prefix of s made of whole chunks and special tokens that encode to at
+    most max_tokens tokens (never cut inside a chunk or a character)
+    """
+
+    def truncate(
+        self, s: str, max_tokens: int, allowed_special: str | set = "none_raise"
+    ) -> str:
+        if max_tokens < 0:
+            raise ValueError("max_tokens = {} not understood".format(max_tokens))
+        num_tokens = 0
+        end = 0
+        for ids, chunk_end in self.iter_encode(s, allowed_special=allowed_special):
+            num_tokens += len(ids)
+            if num_tokens > max_tokens:
+                break
+            end = chunk_end
+        return s[:end]
+
+    """
+    Encode a file-like object or an iterable of str incrementally
+        buffer_size [int]: number of characters read (and roughly held) at once
+    Yields a list of ids per encoded block; their concatenation equals encode()
+    of the whole text. A block is cut at the end of a special token or, for the
+    GPT-2/GPT-4 split patterns, at a safe boundary (see pretokenize), never inside
+    a special token. Other patterns are only cut at special tokens. Text without
+    any cut keeps accumulating until one shows up.
+    """
+
+    def encode_stream(
+        self,
+        source: TextIO | Iterable[str],
+        allowed_special: str | set = "none_raise",
+        buffer_size: int = 1 << 16,
+    ) -> Iterator[list[int]]:
+        # Special tokens to look for ("none_raise" must see all of them to raise)
+        if allowed_special == "none":
+            special_tokens = []
+        elif allowed_special in ("all", "none_raise"):
+            special_tokens = list(self.special_tokens)
+        else:
+            special_tokens = [k for k in self.special_tokens if k in allowed_special]
+        special_pattern = self.get_special_matcher(allowed_special)
+        max_special_len = max((len(k) for k in special_tokens), default=1)
+        safe_boundaries = has_safe_boundaries(self.pattern)
+
+        buffer = ""
+        for piece in iter_text(source, buffer_size):
+            buffer += piece
+            if len(buffer) < buffer_size:
+                continue
+
+            # Matches starting before limit cannot reach past the end of buffer
+            limit = len(buffer) - max_special_len + 1
+            start = 0
+            if special_pattern is not None:
+                for match in special_pattern.finditer(buffer):
+                    if match.start() >= limit:
+                        break
+                    start = match.end()
+            cut = start
+            if safe_boundaries:
+                cut += find_safe_boundary(buffer[start:limit])
+
+            if cut > 0:
+                yield self.encode(buffer[:cut], allowed_special=allowed_special)
+                buffer = buffer[cut:]
+
+        if buffer:
+            yield self.encode(buffer, allowed_special=allowed_special)
+
+    def encode_batch(
+        self,
+        texts: list[str],
+        allowed_special: str | set = "none_raise",
+        num_workers: int = None,
+        backend: str = BatchBackend.PROCESS,
+        chunk_size: int = None,
+    ) -> list[list[int]]:
+        return super().encode_batch(
+            texts,
+            num_workers=num_workers,
+            backend=backend,
+            chunk_size=chunk_size,
+            allowed_special=allowed_special,
+        )
+
+    def token_bytes(self, idx: int) -> bytes:
+        if idx in self.vocab:
+            return self.vocab[idx]
+        elif idx in self.inverse_special_tokens:
+            return self.inverse_special_tokens[idx].encode(encoding="utf-8")
+        else:
+            raise ValueError("Unknown token: {}".format(idx))
+
+    def decode_table(self) -> dict[int, bytes]:
+        table = {
+            idx: token.encode(encoding="utf-8")
+            for idx, token in self.inverse_special_tokens.items()
+        }
+        table.update(self.vocab)
+        return table
+
+    def join_tokens(self, ids: list[int] | array) -> bytes:
+        if self.decode_engine != DecodeEngine.DICT:
+            return super().join_tokens(ids)
         list_bytes = []
 
         for idx in ids:
@@ -111,18 +519,25 @@ class RegexTokenizer(Tokenizer):
             else:
                 raise ValueError("Unknown token: {}".format(idx))
 
-        text_bytes = b"".join(list_bytes)
-        return text_bytes.decode(encoding="utf-8", errors="replace")
+        return b"".join(list_bytes)
 
     def register_special_tokens(self, special_tokens: dict[str, int]) -> None:
         self.special_tokens = special_tokens
         self.inverse_special_tokens = {
             idx: token for token, idx in special_tokens.items()
         }
+        self.mark_changed()
 
     def encode_chunk(self, text_bytes: bytes) -> list[int]:
         ids = list(text_bytes)
 
+        if self.encode_engine == EncodeEngine.HEAP:
+            return encode_heap(ids=ids, packed_merges=self.get_packed_merges())
+        elif self.encode_engine != EncodeEngine.NAIVE:
+            raise ValueError(
+                "encode_engine = {} not understood".format(self.encode_engine)
+            )
+
         while len(ids) > 1:
             stats = get_statistics(ids)
             pair = min(stats, key=lambda x: self.merges.get(x, float("inf")))
@@ -133,13 +548,52 @@ class RegexTokenizer(Tokenizer):
 
         return ids
 
+    # encode_chunk through the LRU chunk cache (if enabled and the chunk is short)
+    def encode_chunk_cached(self, text_bytes: bytes) -> list[int]:
+        cache = self.chunk_cache
+        if not cache.enabled or len(text_bytes) > cache.max_chunk_len:
+            return self.encode_chunk(text_bytes=text_bytes)
+
+        cached_ids = cache.get(text_bytes)
+        if cached_ids is not None:
+            # A new list: the caller (e.g. of iter_encode) may modify it
+            return list(cached_ids)
+        ids = self.encode_chunk(text_bytes=text_bytes)
+        cache.put(text_bytes, ids)
+        return ids
+
     def encode_ordinary(self, text: str) -> list[int]:
-        text_chunks = re.findall(self.compiled_pattern, text)
+        instrumentation = self.instrumentation
+        if instrumentation.enabled:
+            start = time.perf_counter()
+        text_chunks = self.split_text(text)
+        if instrumentation.enabled:
+            instrumentation.record("split", start, chunks=len(text_chunks))
+            start = time.perf_counter()
         ids = []
 
         for chunk in text_chunks:
             chunk_bytes = chunk.encode(encoding="utf-8")
-            chunk_ids = self.encode_chunk(text_bytes=chunk_bytes)
+            chunk_ids = self.encode_chunk_cached(text_bytes=chunk_bytes)
             ids.extend(chunk_ids)
 
+        if instrumentation.enabled:
+            instrumentation.record(
+                "bpe", start, encoded_bytes=len(text.encode("utf-8")), tokens=len(ids)
+            )
         return ids
+
+    # Hits, misses, evictions and size of the chunk cache
+    def cache_stats(self) -> dict[str, int]:
+        return self.chunk_cache.stats()
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        if self.chunk_cache.enabled:
+            stats["cache"] = self.cache_stats()
+        return stats
+
+    def load(self, model_file: str) -> None:
+        super().load(model_file=model_file)
+        self.register_special_tokens(self.special_tokens)
+        self.chunk_cache.clear()
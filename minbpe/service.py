@@ -0,0 +1,432 @@
+import asyncio
+import json
+import os
+import struct
+import time
+from collections import deque
+
+from .base import Tokenizer
+from .batch import run_batch
+from .regex_tokenizer import RegexTokenizer
+from .constants import BatchBackend
+
+"""
+Local tokenization service: one process loads the tokenizer once and serves
+encode / decode / count requests over a Unix socket or localhost TCP.
+
+Wire format: every message is a 4-byte big-endian length followed by a JSON
+object. Requests carry an id (echoed in the response), so a client can have
+many requests in flight on one connection:
+    {"id": 1, "op": "encode", "text": "...", "allowed_special": "none_raise"}
+    {"id": 2, "op": "decode", "ids": [...]}
+    {"id": 3, "op": "count", "text": "..."}
+    {"id": 4, "op": "stats"}
+Responses are {"id": ..., "result": ...} or {"id": ..., "error": "..."}.
+
+Requests from all connections go through one bounded queue. A batcher takes
+whatever is queued (waiting at most max_delay seconds for more, up to
+max_batch requests), groups it by op and allowed_special and runs every group
+as one batch.run_batch call on the tokenizer's worker pool. Backpressure: when
+the queue is full, connections stop reading new requests until it drains, and
+at most max_inflight batches run at once.
+"""
+
+FRAME_HEADER = struct.Struct(">I")
+MAX_FRAME_SIZE = 1 << 28
+DEFAULT_MAX_BATCH = 64
+DEFAULT_MAX_DELAY = 0.002
+DEFAULT_MAX_PENDING = 1024
+# Number of most recent latencies the percentiles are computed over
+LATENCY_WINDOW = 10000
+# Request op -> tokenizer method run for a batch of them
+OPS = {"encode": "encode", "decode": "decode", "count": "count_tokens"}
+# String values of allowed_special (otherwise a list of special tokens)
+ALLOWED_SPECIAL = ["all", "none", "none_raise"]
+
+
+async def read_frame(reader: asyncio.StreamReader) -> dict | None:
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    (size,) = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError("frame size = {} not understood".format(size))
+    return json.loads(await reader.readexactly(size))
+
+
+def write_frame(writer: asyncio.StreamWriter, message: dict) -> None:
+    body = json.dumps(message, ensure_ascii=False).encode(encoding="utf-8")
+    writer.write(FRAME_HEADER.pack(len(body)) + body)
+
+
+"""
+LatencyTracker: latency percentiles (in milliseconds) over a sliding window
+"""
+
+
+class LatencyTracker:
+    def __init__(self, window: int = LATENCY_WINDOW) -> None:
+        self.latencies = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, seconds: float) -> None:
+        self.latencies.append(seconds)
+        self.count += 1
+
+    def percentiles(self) -> dict:
+        latencies = sorted(self.latencies)
+        stats = {"count": self.count}
+        if not latencies:
+            return stats
+        for name, q in [("p50", 0.5), ("p90", 0.9), ("p99", 0.99)]:
+            idx = min(len(latencies) - 1, int(q * len(latencies)))
+            stats[f"{name}_ms"] = latencies[idx] * 1e3
+        stats["max_ms"] = latencies[-1] * 1e3
+        return stats
+
+
+# allowed_special is one of ALLOWED_SPECIAL or a list of special tokens
+def is_allowed_special(allowed_special) -> bool:
+    if isinstance(allowed_special, list):
+        return all(isinstance(token, str) for token in allowed_special)
+    return allowed_special in ALLOWED_SPECIAL
+
+
+# JSON allowed_special (a string or a list of special tokens) -> tokenizer argument
+def parse_allowed_special(allowed_special: str | list) -> str | set:
+    if isinstance(allowed_special, list):
+        return set(allowed_special)
+    return allowed_special
+
+
+"""
+TokenizationServer: serves a loaded tokenizer (see module docstring)
+    num_workers [int]: workers of the batch pool (default: os.cpu_count())
+    backend [str]: BatchBackend.PROCESS or BatchBackend.THREAD
+    max_batch [int]: maximum number of requests coalesced into one batch
+    max_delay [float]: seconds the batcher waits for more requests
+    max_pending [int]: bound of the request queue
+    max_inflight [int]: batches running at once (default: num_workers)
+"""
+
+
+class TokenizationServer:
+    def __init__(
+        self,
+        tokenizer: Tokenizer,
+        num_workers: int = None,
+        backend: str = BatchBackend.PROCESS,
+        max_batch: int = DEFAULT_MAX_BATCH,
+        max_delay: float = DEFAULT_MAX_DELAY,
+        max_pending: int = DEFAULT_MAX_PENDING,
+        max_inflight: int = None,
+    ) -> None:
+        self.tokenizer = tokenizer
+        self.num_workers = os.cpu_count() if num_workers is None else num_workers
+        self.backend = backend
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.max_inflight = (
+            max(1, self.num_workers) if max_inflight is None else max_inflight
+        )
+        self.latency = LatencyTracker()
+        self.num_batches = 0
+        self.num_batched_requests = 0
+        self.server = None
+        self.__queue = None
+        self.__slots = None
+        self.__tasks = set()
+
+    async def start(
+        self, host: str = "127.0.0.1", port: int = 0, path: str = None
+    ) -> asyncio.AbstractServer:
+        if self.backend == BatchBackend.PROCESS and self.num_workers > 1:
+            # Ship the tokenizer to the workers once, before serving
+            self.tokenizer.get_worker_pool(num_workers=self.num_workers)
+        self.__queue = asyncio.Queue(maxsize=self.max_pending)
+        self.__slots = asyncio.Semaphore(self.max_inflight)
+        self.__spawn(self.__run_batcher())
+
+        if path is not None:
+            self.server = await asyncio.start_unix_server(
+                self.__handle_connection, path=path
+            )
+        else:
+            self.server = await asyncio.start_server(
+                self.__handle_connection, host=host, port=port
+            )
+        return self.server
+
+    # Address clients connect to: (host, port) or the socket path
+    def address(self) -> tuple[str, int] | str:
+        return self.server.sockets[0].getsockname()
+
+    async def close(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+        for task in list(self.__tasks):
+            task.cancel()
+        await asyncio.gather(*self.__tasks, return_exceptions=True)
+        self.tokenizer.close_worker_pool()
+
+    def __spawn(self, coroutine) -> asyncio.Task:
+        task = asyncio.ensure_future(coroutine)
+        self.__tasks.add(task)
+        task.add_done_callback(self.__tasks.discard)
+        return task
+
+    def stats(self) -> dict:
+        return {
+            "latency": self.latency.percentiles(),
+            "batches": self.num_batches,
+            "mean_batch_size": self.num_batched_requests / max(1, self.num_batches),
+            "pending": self.__queue.qsize(),
+        }
+
+    async def __handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        # Responses still to write on this connection
+        responses = set()
+        try:
+            while True:
+                request = await read_frame(reader)
+                if request is None:
+                    break
+                start = time.perf_counter()
+                future = loop.create_future()
+                if not isinstance(request, dict) or "op" not in request:
+                    future.set_exception(
+                        ValueError("request = {} not understood".format(request))
+                    )
+                    request = {}
+                elif request["op"] == "stats":
+                    future.set_result(self.stats())
+                elif request["op"] not in OPS:
+                    future.set_exception(
+                        ValueError("op = {} not understood".format(request["op"]))
+                    )
+                elif ("ids" if request["op"] == "decode" else "text") not in request:
+                    future.set_exception(
+                        ValueError("request = {} not understood".format(request))
+                    )
+                elif not is_allowed_special(
+                    request.get("allowed_special", "none_raise")
+                ):
+                    future.set_exception(
+                        ValueError(
+                            "allowed_special = {} not understood".format(
+                                request["allowed_special"]
+                            )
+                        )
+                    )
+                else:
+                    # Blocks (and stops reading this connection) while the queue is full
+                    await self.__queue.put((request, future))
+                response = self.__spawn(
+                    self.__respond(writer, request.get("id"), future, start)
+                )
+                responses.add(response)
+                response.add_done_callback(responses.discard)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            # A client may half-close after its last request: answer everything first
+            await asyncio.gather(*responses, return_exceptions=True)
+            writer.close()
+
+    async def __respond(
+        self,
+        writer: asyncio.StreamWriter,
+        request_id: int | None,
+        future: asyncio.Future,
+        start: float,
+    ) -> None:
+        try:
+            response = {"id": request_id, "result": await future}
+        except Exception as e:
+            response = {"id": request_id, "error": f"{type(e).__name__}: {e}"}
+        if writer.is_closing():
+            return
+        write_frame(writer, response)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            return
+        self.latency.add(time.perf_counter() - start)
+
+    async def __run_batcher(self) -> None:
+        loop = asyncio.get_running_loop()
+        queue = self.__queue
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                if not queue.empty():
+                    batch.append(queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self.__slots.acquire()
+            self.num_batches += 1
+            self.num_batched_requests += len(batch)
+            self.__spawn(self.__run_batch(batch))
+
+    async def __run_batch(self, batch: list[tuple[dict, asyncio.Future]]) -> None:
+        try:
+            groups = {}
+            for request, future in batch:
+                allowed_special = request.get("allowed_special", "none_raise")
+                if isinstance(allowed_special, list):
+                    allowed_special = tuple(sorted(allowed_special))
+                key = (request["op"], allowed_special)
+                groups.setdefault(key, []).append((request, future))
+
+            loop = asyncio.get_running_loop()
+            for (op, _), group in groups.items():
+                requests = [request for request, _ in group]
+                results = await loop.run_in_executor(None, self.run_group, requests)
+                for (_, future), result in zip(group, results):
+                    if future.cancelled():
+                        continue
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+        except Exception as e:
+            # Never leave a request of the batch waiting for a response
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.__slots.release()
+
+    """
+    Run requests of the same op and allowed_special as one batch (blocking)
+    Returns: one result per request, or the exception it raised
+    """
+
+    def run_group(self, requests: list[dict]) -> list:
+        op = requests[0]["op"]
+        key = "ids" if op == "decode" else "text"
+        items = [request[key] for request in requests]
+        kwargs = {}
+        if op != "decode" and isinstance(self.tokenizer, RegexTokenizer):
+            kwargs["allowed_special"] = parse_allowed_special(
+                requests[0].get("allowed_special", "none_raise")
+            )
+
+        try:
+            return run_batch(
+                self.tokenizer,
+                OPS[op],
+                items,
+                self.num_workers,
+                self.backend,
+                None,
+                **kwargs,
+            )
+        except Exception:
+            pass
+        # One of the items failed: run them one by one to report it to its request
+        method = getattr(self.tokenizer, OPS[op])
+        results = []
+        for item in items:
+            try:
+                results.append(method(item, **kwargs))
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+"""
+TokenizationClient: asyncio client of a TokenizationServer
+Requests can be issued concurrently on one connection (e.g. with asyncio.gather).
+Server-side errors are raised as RuntimeError.
+"""
+
+
+class TokenizationClient:
+    def __init__(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.latency = LatencyTracker()
+        self.__next_id = 0
+        self.__pending = {}
+        self.__reader_task = asyncio.ensure_future(self.__read_responses())
+
+    @classmethod
+    async def connect(
+        cls, host: str = "127.0.0.1", port: int = None, path: str = None
+    ) -> "TokenizationClient":
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path=path)
+        else:
+            reader, writer = await asyncio.open_connection(host=host, port=port)
+        return cls(reader, writer)
+
+    async def __read_responses(self) -> None:
+        try:
+            while True:
+                response = await read_frame(self.reader)
+                if response is None:
+                    break
+                future = self.__pending.pop(response["id"], None)
+                if future is None or future.done():
+                    continue
+                if "error" in response:
+                    future.set_exception(RuntimeError(response["error"]))
+                else:
+                    future.set_result(response["result"])
+        finally:
+            for future in self.__pending.values():
+                if not future.done():
+                    future.set_exception(ConnectionError("Connection closed"))
+            self.__pending = {}
+
+    async def request(self, op: str, **payload):
+        self.__next_id += 1
+        request_id = self.__next_id
+        future = asyncio.get_running_loop().create_future()
+        self.__pending[request_id] = future
+        start = time.perf_counter()
+        write_frame(self.writer, {"id": request_id, "op": op, **payload})
+        await self.writer.drain()
+        result = await future
+        self.latency.add(time.perf_counter() - start)
+        return result
+
+    async def encode(
+        self, text: str, allowed_special: str | set = "none_raise"
+    ) -> list[int]:
+        if isinstance(allowed_special, set):
+            allowed_special = sorted(allowed_special)
+        return await self.request("encode", text=text, allowed_special=allowed_special)
+
+    async def decode(self, ids: list[int]) -> str:
+        return await self.request("decode", ids=list(ids))
+
+    async def count_tokens(
+        self, text: str, allowed_special: str | set = "none_raise"
+    ) -> int:
+        if isinstance(allowed_special, set):
+            allowed_special = sorted(allowed_special)
+        return await self.request("count", text=text, allowed_special=allowed_special)
+
+    async def stats(self) -> dict:
+        return await self.request("stats")
+
+    async def close(self) -> None:
+        self.writer.close()
+        await self.__reader_task
@@ -0,0 +1,337 @@
+import argparse
+import heapq
+import os
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Iterator
+
+from .bpe_trainer import BPETrainer
+from .pretokenize import DEFAULT_BLOCK_SIZE, count_chunks
+from .regex_tokenizer import RegexTokenizer
+from .constants import MAX_BYTE_SIZE
+
+"""
+Map-reduce BPE training over shards of the chunk-frequency table
+
+Every worker owns a shard (dict[bytes, int]) and runs a BPETrainer on it. The
+coordinator keeps the global pair counts (the sum of the local counts) and a
+lazy max-heap, like BPETrainer does for a single process. Every round it picks
+the global best pair and broadcasts the merge. The workers apply it locally and
+report the new local counts of the pairs it changed.
+
+Ties are broken by the first occurrence, as in single-process training. A
+worker of rank r reports occurrence positions as (r << RANK_SHIFT) | local
+position, and workers report lower bounds of their first occurrences. The
+coordinator asks the workers for exact first occurrences only when the best
+count is tied. The merges are those of single-process training on the shards
+concatenated in rank order (for example chunk_counts split into contiguous
+slices, or the files of the workers concatenated by rank).
+
+Messages go over multiprocessing Connection objects: Pipe for local worker
+processes, Listener/Client sockets for workers on other machines.
+"""
+
+RANK_SHIFT = 48
+
+
+# Worker loop: serve merge and first-occurrence requests until "stop"
+def run_worker(conn: Connection, chunk_counts: dict[bytes, int], rank: int) -> None:
+    words = [list(chunk_bytes) for chunk_bytes in chunk_counts]
+    trainer = BPETrainer(words=zip(words, chunk_counts.values()))
+    base = rank << RANK_SHIFT
+
+    def report(pairs) -> dict[tuple[int, int], tuple[int, int | None]]:
+        counts, first = trainer.counts, trainer.first
+        return {
+            pair: (counts.get(pair, 0), base + first[pair] if pair in first else None)
+            for pair in pairs
+        }
+
+    conn.send(report(trainer.counts))
+    while True:
+        message = conn.recv()
+        if message[0] == "merge":
+            _, pair, new_index = message
+            changed = ()
+            if pair in trainer.positions:
+                changed = trainer.apply_merge(pair=pair, new_index=new_index)
+            conn.send(report(changed))
+        elif message[0] == "first":
+            _, pair = message
+            positions = trainer.positions.get(pair)
+            if not positions:
+                conn.send(None)
+                continue
+            trainer.first[pair] = min(positions)
+            conn.send(base + trainer.first[pair])
+        elif message[0] == "stop":
+            conn.close()
+            return
+        else:
+            raise ValueError("message = {} not understood".format(message))
+
+
+"""
+ShardCoordinator: picks the global merges of workers connected in rank order
+    connections [list[Connection]]: connection of the worker of rank i at index i
+"""
+
+
+class ShardCoordinator:
+    def __init__(self, connections: list[Connection]) -> None:
+        self.connections = connections
+        self.counts = {}
+        self.first = {}
+        self.local_counts = [{} for _ in connections]
+
+        for rank, conn in enumerate(connections):
+            self.__update(rank, conn.recv())
+        self.heap = [
+            (-count, self.first[pair], pair) for pair, count in self.counts.items()
+        ]
+        heapq.heapify(self.heap)
+
+    def __update(
+        self, rank: int, report: dict[tuple[int, int], tuple[int, int | None]]
+    ) -> None:
+        local_counts = self.local_counts[rank]
+        for pair, (count, first) in report.items():
+            delta = count - local_counts.get(pair, 0)
+            if count > 0:
+                local_counts[pair] = count
+            else:
+                local_counts.pop(pair, None)
+            self.counts[pair] = self.counts.get(pair, 0) + delta
+            # The global first occurrence is bounded by the lowest local bound
+            if first is not None and first < self.first.get(pair, first + 1):
+                self.first[pair] = first
+
+    def __broadcast(self, message: tuple) -> list:
+        for conn in self.connections:
+            conn.send(message)
+        return [conn.recv() for conn in self.connections]
+
+    def __exact_first(self, pair: tuple[int, int]) -> int:
+        firsts = self.__broadcast(("first", pair))
+        return min(first for first in firsts if first is not None)
+
+    # Pop the pair with the highest count (first occurrence on ties), or None
+    def top_pair(self) -> tuple[tuple[int, int], int] | None:
+        heap = self.heap
+        while heap:
+            neg_count, first, pair = heap[0]
+            count = self.counts.get(pair, 0)
+            if count <= 0 or count != -neg_count:
+                heapq.heappop(heap)
+                continue
+            if first != self.first[pair]:
+                heapq.heapreplace(heap, (neg_count, self.first[pair], pair))
+                continue
+
+            heapq.heappop(heap)
+            # Every pair has an entry with its current count, so a tie is only
+            # possible if the next entry has the same count
+            if heap and heap[0][0] == neg_count:
+                true_first = self.__exact_first(pair)
+                self.first[pair] = true_first
+                if true_first != first:
+                    heapq.heappush(heap, (neg_count, true_first, pair))
+                    continue
+            return pair, count
+        return None
+
+    def merge(self, pair: tuple[int, int], new_index: int) -> None:
+        reports = self.__broadcast(("merge", pair, new_index))
+        changed = set()
+        for rank, report in enumerate(reports):
+            self.__update(rank, report)
+            changed.update(report)
+
+        for changed_pair in changed:
+            count = self.counts.get(changed_pair, 0)
+            if count > 0:
+                heapq.heappush(
+                    self.heap, (-count, self.first[changed_pair], changed_pair)
+                )
+            else:
+                self.counts.pop(changed_pair, None)
+                self.first.pop(changed_pair, None)
+
+    """
+    Run num_merges merges, yielding (pair, new_index, count) after each one
+    Stops early if no pairs are left to merge
+    """
+
+    def train(
+        self, num_merges: int, start_index: int
+    ) -> Iterator[tuple[tuple[int, int], int, int]]:
+        for i in range(num_merges):
+            top = self.top_pair()
+            if top is None:
+                break
+            pair, count = top
+            idx = start_index + i
+            self.merge(pair=pair, new_index=idx)
+            yield pair, idx, count
+
+    def close(self) -> None:
+        for conn in self.connections:
+            conn.send(("stop",))
+            conn.close()
+
+
+# Split a chunk-frequency table into num_shards contiguous slices of similar size
+def split_chunk_counts(
+    chunk_counts: dict[bytes, int], num_shards: int
+) -> list[dict[bytes, int]]:
+    items = list(chunk_counts.items())
+    total = sum(len(chunk_bytes) for chunk_bytes, _ in items)
+    shards = []
+    start = 0
+    size = 0
+    for i, (chunk_bytes, _) in enumerate(items):
+        size += len(chunk_bytes)
+        if size * num_shards >= total * (len(shards) + 1):
+            shards.append(dict(items[start : i + 1]))
+            start = i + 1
+    if start < len(items) or not shards:
+        shards.append(dict(items[start:]))
+    return shards
+
+
+"""
+Train a RegexTokenizer on a chunk-frequency table with local worker processes
+    num_workers [int]: number of shards and worker processes (default: os.cpu_count())
+Same merges as tokenizer.train_from_chunks(chunk_counts, vocab_size)
+"""
+
+
+def train_sharded(
+    tokenizer: RegexTokenizer,
+    chunk_counts: dict[bytes, int],
+    vocab_size: int,
+    num_workers: int = None,
+    verbose: bool = False,
+) -> None:
+    num_workers = os.cpu_count() if num_workers is None else num_workers
+    shards = split_chunk_counts(chunk_counts, num_workers)
+
+    connections = []
+    processes = []
+    for rank, shard in enumerate(shards):
+        conn, worker_conn = Pipe()
+        process = Process(target=run_worker, args=(worker_conn, shard, rank))
+        process.start()
+        worker_conn.close()
+        connections.append(conn)
+        processes.append(process)
+
+    try:
+        coordinator = ShardCoordinator(connections)
+        steps = coordinator.train(vocab_size - MAX_BYTE_SIZE, MAX_BYTE_SIZE)
+        tokenizer.train_from_steps(steps=steps, vocab_size=vocab_size, verbose=verbose)
+        coordinator.close()
+    finally:
+        for process in processes:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+
+
+"""
+Train a RegexTokenizer with workers on other machines (see connect_worker)
+    address [tuple[str, int]]: address to listen on
+    num_workers [int]: number of workers to wait for, with ranks 0 .. num_workers - 1
+Same merges as single-process training on the files of all workers, by rank
+"""
+
+
+def train_distributed(
+    tokenizer: RegexTokenizer,
+    address: tuple[str, int],
+    num_workers: int,
+    vocab_size: int,
+    authkey: bytes,
+    verbose: bool = False,
+) -> None:
+    connections = {}
+    with Listener(address, authkey=authkey) as listener:
+        while len(connections) < num_workers:
+            conn = listener.accept()
+            rank = conn.recv()
+            if rank in connections or not 0 <= rank < num_workers:
+                conn.close()
+                raise ValueError("rank = {} not understood".format(rank))
+            connections[rank] = conn
+
+    connections = [connections[rank] for rank in range(num_workers)]
+    for conn in connections:
+        conn.send(tokenizer.pattern)
+    coordinator = ShardCoordinator(connections)
+    steps = coordinator.train(vocab_size - MAX_BYTE_SIZE, MAX_BYTE_SIZE)
+    tokenizer.train_from_steps(steps=steps, vocab_size=vocab_size, verbose=verbose)
+    coordinator.close()
+
+
+# Worker on another machine: count the chunks of its own files, then serve merges
+def connect_worker(
+    address: tuple[str, int],
+    rank: int,
+    input_paths: str | list[str],
+    authkey: bytes,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    num_workers: int = None,
+) -> None:
+    conn = Client(address, authkey=authkey)
+    conn.send(rank)
+    pattern = conn.recv()
+    chunk_counts = count_chunks(
+        input_paths=input_paths,
+        pattern=pattern,
+        block_size=block_size,
+        num_workers=num_workers,
+    )
+    run_worker(conn, chunk_counts, rank)
+
+
+def parse_address(address: str) -> tuple[str, int]:
+    host, port = address.rsplit(":", 1)
+    return host, int(port)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded BPE training")
+    subparsers = parser.add_subparsers(dest="role", required=True)
+
+    coordinator_parser = subparsers.add_parser("coordinator")
+    coordinator_parser.add_argument("--address", required=True, help="host:port")
+    coordinator_parser.add_argument("--num-workers", type=int, required=True)
+    coordinator_parser.add_argument("--vocab-size", type=int, required=True)
+    coordinator_parser.add_argument("--output", required=True, help="file prefix")
+    coordinator_parser.add_argument("--authkey", required=True)
+
+    worker_parser = subparsers.add_parser("worker")
+    worker_parser.add_argument("inputs", nargs="+", help="input files or globs")
+    worker_parser.add_argument("--address", required=True, help="host:port")
+    worker_parser.add_argument("--rank", type=int, required=True)
+    worker_parser.add_argument("--authkey", required=True)
+    args = parser.parse_args()
+
+    if args.role == "coordinator":
+        tokenizer = RegexTokenizer()
+        train_distributed(
+            tokenizer=tokenizer,
+            address=parse_address(args.address),
+            num_workers=args.num_workers,
+            vocab_size=args.vocab_size,
+            authkey=args.authkey.encode(encoding="utf-8"),
+            verbose=True,
+        )
+        tokenizer.save(file_prefix=args.output)
+    else:
+        connect_worker(
+            address=parse_address(args.address),
+            rank=args.rank,
+            input_paths=args.inputs,
+            authkey=args.authkey.encode(encoding="utf-8"),
+        )
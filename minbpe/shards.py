@@ -0,0 +1,328 @@
+import argparse
+import json
+import os
+from typing import Iterator
+
+import numpy as np
+
+from .base import Tokenizer
+from .basic_tokenizer import BasicTokenizer
+from .batch import run_batch
+from .pretokenize import resolve_paths
+from .regex_tokenizer import RegexTokenizer
+
+"""
+Dataset tokenization pipeline: encode text/JSONL documents with a trained model
+into fixed-size binary token shards that readers can np.memmap without copying.
+
+Output directory:
+    shard_00000.bin, shard_00001.bin, ...: shard_size tokens each (the last one
+        may be shorter), little-endian uint16 if every token id fits, else uint32
+    offsets.bin: little-endian uint64 token offsets of the documents in the token
+        stream, num_docs + 1 entries starting at 0 (documents may span shards)
+    meta.json: dtype, shard_size, separator id, inputs and the committed progress
+
+Input documents: every line of a .jsonl file (the text_key field), or the whole
+content of any other file. An optional separator special token (e.g.
+"<|endoftext|>") is appended to every document.
+
+Documents are encoded in batches of batch_size over a worker pool. After every
+batch the shards and offsets are appended and meta.json is replaced atomically,
+so a killed run can be restarted with the same arguments: bytes written after
+the last commit are truncated and the already committed documents are skipped.
+"""
+
+DEFAULT_SHARD_SIZE = 1 << 24
+DEFAULT_BATCH_SIZE = 256
+META_FILE = "meta.json"
+OFFSETS_FILE = "offsets.bin"
+VERSION = 1
+
+
+def shard_path(output_dir: str, shard_index: int) -> str:
+    return os.path.join(output_dir, f"shard_{shard_index:05d}.bin")
+
+
+# Narrowest unsigned dtype for all token ids of a tokenizer
+def get_token_dtype(tokenizer: Tokenizer) -> np.dtype:
+    max_idx = max(tokenizer.vocab)
+    max_idx = max(max_idx, max(tokenizer.special_tokens.values(), default=0))
+    return np.dtype("<u2") if max_idx < 1 << 16 else np.dtype("<u4")
+
+
+# Load a .model file into a RegexTokenizer, or a BasicTokenizer if it has no pattern
+def load_tokenizer(model_file: str) -> Tokenizer:
+    tokenizer = RegexTokenizer()
+    tokenizer.load(model_file=model_file)
+    if tokenizer.pattern:
+        return tokenizer
+
+    tokenizer = BasicTokenizer()
+    tokenizer.load(model_file=model_file)
+    return tokenizer
+
+
+def iter_documents(paths: list[str], text_key: str = "text") -> Iterator[str]:
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            if not path.endswith(".jsonl"):
+                yield f.read()
+                continue
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)[text_key]
+
+
+def iter_batches(documents: Iterator[str], batch_size: int) -> Iterator[list[str]]:
+    batch = []
+    for document in documents:
+        batch.append(document)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def read_meta(output_dir: str) -> dict | None:
+    meta_file = os.path.join(output_dir, META_FILE)
+    if not os.path.exists(meta_file):
+        return None
+    with open(meta_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_meta(output_dir: str, meta: dict) -> None:
+    meta_file = os.path.join(output_dir, META_FILE)
+    tmp_file = f"{meta_file}.{os.getpid()}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_file, meta_file)
+
+
+# Drop everything written after the last commit recorded in meta
+def truncate_to_meta(output_dir: str, meta: dict) -> None:
+    itemsize = np.dtype(meta["dtype"]).itemsize
+    shard_size = meta["shard_size"]
+    num_tokens = meta["num_tokens"]
+
+    last_shard = num_tokens // shard_size
+    shard_index = last_shard
+    while os.path.exists(shard_path(output_dir, shard_index)):
+        path = shard_path(output_dir, shard_index)
+        if shard_index == last_shard:
+            os.truncate(path, (num_tokens % shard_size) * itemsize)
+        else:
+            os.remove(path)
+        shard_index += 1
+
+    offsets_file = os.path.join(output_dir, OFFSETS_FILE)
+    os.truncate(offsets_file, (meta["num_docs"] + 1) * 8)
+
+
+# Append tokens to the shards, starting a new shard every shard_size tokens
+def append_tokens(output_dir: str, tokens: np.ndarray, meta: dict) -> None:
+    shard_size = meta["shard_size"]
+    num_tokens = meta["num_tokens"]
+    start = 0
+    while start < len(tokens):
+        shard_index, shard_offset = divmod(num_tokens + start, shard_size)
+        end = start + min(shard_size - shard_offset, len(tokens) - start)
+        with open(shard_path(output_dir, shard_index), "ab") as f:
+            tokens[start:end].tofile(f)
+        start = end
+
+
+"""
+Encode documents into token shards (see the module description)
+    input_path [str | list[str]]: file path(s) or glob(s), .jsonl or plain text
+    tokenizer [Tokenizer | str]: a tokenizer or the path of a .model file
+    separator [str]: special token appended to every document (default: none)
+    shard_size [int]: number of tokens per shard
+    text_key [str]: field holding the text in .jsonl records
+    batch_size [int]: number of documents encoded between two commits
+    num_workers [int]: number of encoding processes (default: os.cpu_count())
+Returns: the final meta dict
+"""
+
+
+def tokenize_to_shards(
+    input_path: str | list[str],
+    tokenizer: Tokenizer | str,
+    output_dir: str,
+    separator: str = None,
+    shard_size: int = DEFAULT_SHARD_SIZE,
+    text_key: str = "text",
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    num_workers: int = None,
+) -> dict:
+    paths = resolve_paths(input_path)
+    if isinstance(tokenizer, str):
+        tokenizer = load_tokenizer(model_file=tokenizer)
+
+    separator_id = None
+    if separator is not None:
+        if separator not in tokenizer.special_tokens:
+            raise ValueError(f"Special token {separator} not found in the tokenizer.")
+        separator_id = tokenizer.special_tokens[separator]
+
+    settings = {
+        "version": VERSION,
+        "dtype": get_token_dtype(tokenizer).str,
+        "shard_size": shard_size,
+        "separator_id": separator_id,
+        "inputs": [os.path.abspath(path) for path in paths],
+    }
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    meta = read_meta(output_dir)
+    if meta is None:
+        meta = dict(settings, num_tokens=0, num_docs=0, complete=False)
+        with open(os.path.join(output_dir, OFFSETS_FILE), "wb") as f:
+            np.zeros(1, dtype="<u8").tofile(f)
+        write_meta(output_dir, meta)
+    elif any(meta[key] != value for key, value in settings.items()):
+        raise ValueError(f"{output_dir} was written with different settings.")
+    elif meta["complete"]:
+        return meta
+    else:
+        truncate_to_meta(output_dir, meta)
+
+    dtype = np.dtype(meta["dtype"])
+    method_name = (
+        "encode_ordinary" if isinstance(tokenizer, RegexTokenizer) else "encode"
+    )
+
+    documents = iter_documents(paths, text_key=text_key)
+    # Skip the documents committed by a previous run
+    try:
+        for _ in range(meta["num_docs"]):
+            next(documents)
+    except StopIteration:
+        raise ValueError(
+            f"{output_dir} holds more documents than the inputs: they no longer match."
+        ) from None
+
+    # Only shut down a worker pool started here, not one the caller still uses
+    owns_pool = not tokenizer.has_worker_pool()
+    try:
+        for batch in iter_batches(documents, batch_size=batch_size):
+            ids_batch = run_batch(
+                tokenizer, method_name, batch, num_workers=num_workers
+            )
+            if separator_id is not None:
+                for ids in ids_batch:
+                    ids.append(separator_id)
+
+            lengths = np.fromiter((len(ids) for ids in ids_batch), dtype="<u8")
+            tokens = np.fromiter(
+                (idx for ids in ids_batch for idx in ids),
+                dtype=dtype,
+                count=int(lengths.sum()),
+            )
+            append_tokens(output_dir, tokens, meta)
+            with open(os.path.join(output_dir, OFFSETS_FILE), "ab") as f:
+                (meta["num_tokens"] + np.cumsum(lengths, dtype="<u8")).tofile(f)
+
+            meta["num_tokens"] += len(tokens)
+            meta["num_docs"] += len(batch)
+            write_meta(output_dir, meta)
+    finally:
+        if owns_pool:
+            tokenizer.close_worker_pool()
+
+    meta["complete"] = True
+    write_meta(output_dir, meta)
+    return meta
+
+
+"""
+TokenShards: zero-copy reader of a shard directory
+    shards [list[np.memmap]]: one read-only memmap per shard
+    offsets [np.memmap]: token offsets of the documents (num_docs + 1 entries)
+"""
+
+
+class TokenShards:
+    def __init__(self, output_dir: str) -> None:
+        self.meta = read_meta(output_dir)
+        if self.meta is None:
+            raise ValueError(f"{output_dir} does not contain token shards.")
+
+        self.shard_size = self.meta["shard_size"]
+        self.num_tokens = self.meta["num_tokens"]
+        self.dtype = np.dtype(self.meta["dtype"])
+
+        self.shards = []
+        for shard_index in range(-(-self.num_tokens // self.shard_size)):
+            size = min(self.shard_size, self.num_tokens - shard_index * self.shard_size)
+            self.shards.append(
+                np.memmap(
+                    shard_path(output_dir, shard_index),
+                    dtype=self.dtype,
+                    mode="r",
+                    shape=(size,),
+                )
+            )
+        self.offsets = np.memmap(
+            os.path.join(output_dir, OFFSETS_FILE),
+            dtype="<u8",
+            mode="r",
+            shape=(self.meta["num_docs"] + 1,),
+        )
+
+    def __len__(self) -> int:
+        return self.meta["num_docs"]
+
+    # Tokens [start, end) of the stream (a view unless the range spans shards)
+    def tokens(self, start: int, end: int) -> np.ndarray:
+        if start >= end:
+            return np.empty(0, dtype=self.dtype)
+        first_shard, first_offset = divmod(start, self.shard_size)
+        if end - start <= self.shard_size - first_offset:
+            return self.shards[first_shard][first_offset : first_offset + end - start]
+
+        pieces = []
+        while start < end:
+            shard_index, shard_offset = divmod(start, self.shard_size)
+            size = min(self.shard_size - shard_offset, end - start)
+            pieces.append(self.shards[shard_index][shard_offset : shard_offset + size])
+            start += size
+        return np.concatenate(pieces)
+
+    def document(self, doc_index: int) -> np.ndarray:
+        start, end = self.offsets[doc_index], self.offsets[doc_index + 1]
+        return self.tokens(int(start), int(end))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Encode text/JSONL files into memory-mapped token shards"
+    )
+    parser.add_argument("inputs", nargs="+", help="input files or globs")
+    parser.add_argument("--model", required=True, help="path of a .model file")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--separator", default=None, help="e.g. <|endoftext|>")
+    parser.add_argument("--shard-size", type=int, default=DEFAULT_SHARD_SIZE)
+    parser.add_argument("--text-key", default="text")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--num-workers", type=int, default=None)
+    args = parser.parse_args()
+
+    meta = tokenize_to_shards(
+        input_path=args.inputs,
+        tokenizer=args.model,
+        output_dir=args.output_dir,
+        separator=args.separator,
+        shard_size=args.shard_size,
+        text_key=args.text_key,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+    )
+    print(
+        "Wrote {} tokens of {} documents ({}).".format(
+            meta["num_tokens"], meta["num_docs"], meta["dtype"]
+        )
+    )
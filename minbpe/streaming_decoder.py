@@ -0,0 +1,33 @@
+import codecs
+
+"""
+StreamingDecoder: incremental decoding for token-by-token generation
+    tokenizer [Tokenizer]: tokenizer providing token_bytes(idx)
+    errors [str]: utf-8 error handler (same default as Tokenizer.decode)
+
+decode() takes one id or a few, and returns only the newly completed text.
+Incomplete utf-8 sequences are held back until the next ids complete them,
+so the concatenated output equals tokenizer.decode() of all ids once flush()
+has been called. The work per call is proportional to the ids passed in.
+"""
+
+
+class StreamingDecoder:
+    def __init__(self, tokenizer, errors: str = "replace") -> None:
+        self.tokenizer = tokenizer
+        self.errors = errors
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors=errors)
+
+    def decode(self, ids: int | list[int]) -> str:
+        if isinstance(ids, int):
+            text_bytes = self.tokenizer.token_bytes(ids)
+        else:
+            text_bytes = b"".join(self.tokenizer.token_bytes(idx) for idx in ids)
+        return self.decoder.decode(text_bytes)
+
+    # Emit whatever is still held back (incomplete sequences become U+FFFD)
+    def flush(self) -> str:
+        return self.decoder.decode(b"", final=True)
+
+    def reset(self) -> None:
+        self.decoder.reset()
@@ -2,7 +2,10 @@ import os
 import time
 
 from minbpe import Tokenizer, BasicTokenizer, RegexTokenizer, GPT4Tokenizer
-from .constants import TokenizerType
+from .checkpoint import DEFAULT_CHECKPOINT_INTERVAL
+from .constants import MAX_BYTE_SIZE, TokenizerType
+from .pretokenize import DEFAULT_BLOCK_SIZE, count_chunks, resolve_paths
+from .train_options import heldout_report
 
 
 def get_tokenizer(tokenizer_name: str) -> Tokenizer:
@@ -17,37 +20,255 @@ def get_tokenizer(tokenizer_name: str) -> Tokenizer:
     return tokenizers.get(tokenizer_name, BasicTokenizer)
 
 
-def train_bpe(input_path: str, output_dir: str, tokenizers: list[dict]):
-    if not os.path.exists(input_path):
-        raise FileNotFoundError(f"File {input_path} not found.")
+def read_file(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
 
-    with open(input_path, "r", encoding="utf-8") as f:
-        text = f.read()
 
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
+# Options of a tokenizer dict that change the merges of its training run
+MERGE_OPTIONS = ["pattern", "min_frequency", "sample_rate", "seed", "prune"]
+# Options passed to RegexTokenizer.train_from_chunks
+TRAIN_OPTIONS = ["min_frequency", "sample_rate", "seed", "prune"]
+
+
+def get_vocab_size(tokenizer_dict: dict) -> int:
+    return (
+        tokenizer_dict["vocab_size"] if "vocab_size" in tokenizer_dict.keys() else 512
+    )
+
+
+# Directory and file names of the saved model: "output_name", default "name"
+def get_output_name(tokenizer_dict: dict) -> str:
+    if "output_name" in tokenizer_dict.keys():
+        return tokenizer_dict["output_name"]
+    return tokenizer_dict["name"]
+
+
+# Untrained tokenizer of a tokenizer dict (loaded from "model_file" to extend it)
+def new_tokenizer(tokenizer_dict: dict) -> Tokenizer:
+    tokenizer = get_tokenizer(tokenizer_dict["name"])()
+    if "model_file" in tokenizer_dict.keys():
+        tokenizer.load(model_file=tokenizer_dict["model_file"])
+    elif "pattern" in tokenizer_dict.keys():
+        tokenizer.pattern = tokenizer_dict["pattern"]
+    return tokenizer
+
+
+"""
+Group the tokenizer dicts that one training run serves: same tokenizer and
+MERGE_OPTIONS, nothing to extend. Each group is sorted by decreasing vocab_size,
+its first dict is trained and the others are prefix snapshots of it.
+"""
 
-    for tokenizer_dict in tokenizers:
-        start = time.time()
 
-        name = tokenizer_dict["name"]
-        Tokenizer = get_tokenizer(tokenizer_dict["name"])
-        tokenizer = Tokenizer()
-        vocab_size = (
-            tokenizer_dict["vocab_size"]
-            if "vocab_size" in tokenizer_dict.keys()
-            else 512
+def group_configs(tokenizers: list[dict]) -> list[list[dict]]:
+    groups = {}
+    for i, tokenizer_dict in enumerate(tokenizers):
+        if "model_file" in tokenizer_dict.keys():
+            key = ("model_file", i)
+        else:
+            key = (get_tokenizer(tokenizer_dict["name"]),) + tuple(
+                tokenizer_dict.get(option) for option in MERGE_OPTIONS
+            )
+        groups.setdefault(key, []).append(tokenizer_dict)
+    return [
+        sorted(group, key=get_vocab_size, reverse=True) for group in groups.values()
+    ]
+
+
+"""
+Tokenizer with the first vocab_size - 256 merges of a trained tokenizer
+BPE merges are prefix-stable: a merge only depends on the merges before it, so
+this is the tokenizer a training run up to vocab_size gives.
+"""
+
+
+def prefix_snapshot(tokenizer: Tokenizer, vocab_size: int) -> Tokenizer:
+    snapshot = type(tokenizer)()
+    snapshot.pattern = tokenizer.pattern
+    merges = list(tokenizer.merges.items())[: vocab_size - MAX_BYTE_SIZE]
+    snapshot.merges = dict(merges)
+    snapshot.vocab = {
+        idx: tokenizer.vocab[idx] for idx in range(MAX_BYTE_SIZE + len(merges))
+    }
+    return snapshot
+
+
+def print_heldout_report(
+    tokenizer: Tokenizer, tokenizer_dict: dict, heldout_path: str, heldout_text: str
+) -> None:
+    reference = None
+    if "reference_model" in tokenizer_dict.keys():
+        from .shards import load_tokenizer
+
+        reference = load_tokenizer(model_file=tokenizer_dict["reference_model"])
+    report = heldout_report(tokenizer, heldout_text, reference)
+    print(
+        "Held-out {} ({}): {}".format(
+            heldout_path, get_output_name(tokenizer_dict), report
         )
-        verbose = (
-            tokenizer_dict["verbose"] if "verbose" in tokenizer_dict.keys() else True
+    )
+
+
+"""
+Train the first tokenizer dict of a group and save every dict of the group
+    chunk_counts [dict[bytes, int]]: chunk-frequency table (RegexTokenizer only)
+"""
+
+
+def train_group(
+    group: list[dict],
+    input_paths: list[str],
+    output_dir: str,
+    chunk_counts: dict[bytes, int] = None,
+    checkpoint_interval: int = None,
+    heldout_path: str = None,
+) -> None:
+    start = time.time()
+    heldout_text = None if heldout_path is None else read_file(heldout_path)
+
+    tokenizer_dict = group[0]
+    tokenizer = new_tokenizer(tokenizer_dict)
+    vocab_size = get_vocab_size(tokenizer_dict)
+    verbose = tokenizer_dict["verbose"] if "verbose" in tokenizer_dict.keys() else True
+    extend = "model_file" in tokenizer_dict.keys()
+
+    name = get_output_name(tokenizer_dict)
+    prefix = os.path.join(output_dir, name, name)
+    checkpoint_file = None
+    if checkpoint_interval is not None:
+        checkpoint_file = f"{prefix}.ckpt"
+    train_options = {
+        "extend": extend,
+        "checkpoint_file": checkpoint_file,
+        "checkpoint_interval": checkpoint_interval or DEFAULT_CHECKPOINT_INTERVAL,
+    }
+
+    if isinstance(tokenizer, RegexTokenizer):
+        for option in TRAIN_OPTIONS:
+            if option in tokenizer_dict.keys():
+                train_options[option] = tokenizer_dict[option]
+        tokenizer.train_from_chunks(
+            chunk_counts=chunk_counts,
+            vocab_size=vocab_size,
+            verbose=verbose,
+            **train_options,
+        )
+    else:
+        text = "".join(read_file(path) for path in input_paths)
+        tokenizer.train(
+            text=text, vocab_size=vocab_size, verbose=verbose, **train_options
         )
 
-        tokenizer.train(text=text, vocab_size=vocab_size, verbose=verbose)
+    tokenizer.save(file_prefix=prefix)
+    if checkpoint_file is not None and os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+
+    end = time.time()
 
-        prefix = os.path.join(output_dir, name, name)
-        tokenizer.save(file_prefix=prefix)
+    print("Completed training.")
+    print("Training time: {:.2f} seconds.".format(end - start))
+    if heldout_text is not None:
+        print_heldout_report(tokenizer, tokenizer_dict, heldout_path, heldout_text)
+
+    for snapshot_dict in group[1:]:
+        snapshot = prefix_snapshot(tokenizer, get_vocab_size(snapshot_dict))
+        snapshot_name = get_output_name(snapshot_dict)
+        snapshot.save(
+            file_prefix=os.path.join(output_dir, snapshot_name, snapshot_name)
+        )
+        print("Saved {} as a prefix of {}.".format(snapshot_name, name))
+        if heldout_text is not None:
+            print_heldout_report(snapshot, snapshot_dict, heldout_path, heldout_text)
+
+
+"""
+Train tokenizers on one or more input files
+    input_path [str | list[str]]: file path(s) or glob(s)
+    block_size [int]: number of characters read at once when pre-tokenizing
+    num_workers [int]: number of pre-tokenization processes (default: os.cpu_count())
+    checkpoint_interval [int]: save a checkpoint (<output_dir>/<name>/<name>.ckpt)
+        every checkpoint_interval merges and resume from it if it exists; it is
+        removed once the model is saved (default: no checkpoints)
+    heldout_path [str]: file to report the compression of every tokenizer on
+    train_workers [int]: number of independent training runs (e.g. basic and
+        regex) done at once in separate processes (default: all of them, up to
+        os.cpu_count(); 1 trains them one after the other)
+A tokenizer dict may set "model_file" to extend a saved model to its vocab_size,
+"output_name" to save it as <output_dir>/<output_name>/<output_name> instead of
+<output_dir>/<name>/<name>, and "pattern" (RegexTokenizer).
+RegexTokenizer dicts may set the faster training options "min_frequency",
+"sample_rate", "seed" and "prune" (see minbpe.train_options), and
+"reference_model": a model (e.g. of a full run) to compare the token count on
+heldout_path with.
+The corpus is pre-tokenized once per distinct pattern. Tokenizer dicts that only
+differ in vocab_size (and "verbose") are trained once, up to the largest
+vocab_size; the smaller ones are saved as prefix snapshots of it.
+RegexTokenizer is trained from a streamed chunk-frequency table, so it never
+holds the whole corpus in memory. BasicTokenizer treats the corpus as one
+sequence and still reads it whole.
+"""
+
+
+def train_bpe(
+    input_path: str | list[str],
+    output_dir: str,
+    tokenizers: list[dict],
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    num_workers: int = None,
+    checkpoint_interval: int = None,
+    heldout_path: str = None,
+    train_workers: int = None,
+):
+    input_paths = resolve_paths(input_path)
+    output_names = [get_output_name(tokenizer_dict) for tokenizer_dict in tokenizers]
+    for output_name in output_names:
+        if output_names.count(output_name) > 1:
+            raise ValueError(
+                "output_name = {} is used by more than one tokenizer".format(
+                    output_name
+                )
+            )
+
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+
+    # Pre-tokenize once per distinct pattern, for all the groups using it
+    groups = group_configs(tokenizers)
+    jobs = []
+    pattern_chunk_counts = {}
+    for group in groups:
+        tokenizer = new_tokenizer(group[0])
+        chunk_counts = None
+        if isinstance(tokenizer, RegexTokenizer):
+            if tokenizer.pattern not in pattern_chunk_counts:
+                pattern_chunk_counts[tokenizer.pattern] = count_chunks(
+                    input_paths=input_paths,
+                    pattern=tokenizer.pattern,
+                    block_size=block_size,
+                    num_workers=num_workers,
+                )
+            chunk_counts = pattern_chunk_counts[tokenizer.pattern]
+        jobs.append(
+            {
+                "group": group,
+                "input_paths": input_paths,
+                "output_dir": output_dir,
+                "chunk_counts": chunk_counts,
+                "checkpoint_interval": checkpoint_interval,
+                "heldout_path": heldout_path,
+            }
+        )
 
-        end = time.time()
+    if train_workers is None:
+        train_workers = min(len(jobs), os.cpu_count() or 1)
+    if train_workers > 1 and len(jobs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
 
-        print("Completed training.")
-        print("Training time: {:.2f} seconds.".format(end - start))
+        with ProcessPoolExecutor(max_workers=min(train_workers, len(jobs))) as executor:
+            futures = [executor.submit(train_group, **job) for job in jobs]
+            for future in futures:
+                future.result()
+    else:
+        for job in jobs:
+            train_group(**job)
@@ -0,0 +1,112 @@
+import hashlib
+import math
+import random
+import struct
+
+from .base import Tokenizer
+from .utils import get_statistics
+
+"""
+Training options for faster vocab builds (RegexTokenizer.train_from_chunks)
+    min_frequency: stop once the top pair occurs fewer than min_frequency times
+    sample_rate: train on a seeded subsample of the chunk-frequency table
+    prune: drop the parts of the words that can no longer be merged
+min_frequency and prune give the same merges as a full run up to the stop,
+sampling is approximate: heldout_report measures how much it costs in tokens.
+"""
+
+
+"""
+Subsample of a chunk-frequency table, every occurrence kept with probability
+sample_rate: count * sample_rate rounded down or up at random (expected value
+count * sample_rate), chunks that end up with no occurrence are dropped
+The same table, sample_rate and seed always give the same subsample.
+"""
+
+
+def sample_chunk_counts(
+    chunk_counts: dict[bytes, int], sample_rate: float, seed: int = 0
+) -> dict[bytes, int]:
+    if not 0 < sample_rate <= 1:
+        raise ValueError("sample_rate = {} not understood".format(sample_rate))
+    rng = random.Random(seed)
+    sampled = {}
+    for chunk_bytes, count in chunk_counts.items():
+        expected = count * sample_rate
+        sampled_count = math.floor(expected)
+        if rng.random() < expected - sampled_count:
+            sampled_count += 1
+        if sampled_count > 0:
+            sampled[chunk_bytes] = sampled_count
+    return sampled
+
+
+"""
+Remove what cannot take part in a merge from words of bytes with their weights
+    - words shorter than 2 bytes
+    - with min_frequency > 1, the byte pairs occurring fewer than min_frequency
+      times: no merge ever spans them (a merged pair occurs at most as often as
+      its byte pairs), so words are cut there into separate words
+Kept bytes stay in the same order, so the tie-breaks and the merges are the
+same as without pruning.
+"""
+
+
+def prune_words(
+    words: list[list[int]], weights: list[int], min_frequency: int = 1
+) -> tuple[list[list[int]], list[int]]:
+    pair_counts = {}
+    if min_frequency > 1:
+        for word, weight in zip(words, weights):
+            get_statistics(word, pair_counts, weight)
+
+    pruned_words = []
+    pruned_weights = []
+    for word, weight in zip(words, weights):
+        if len(word) < 2:
+            continue
+        start = 0
+        if min_frequency > 1:
+            for i, pair in enumerate(zip(word, word[1:]), start=1):
+                if pair_counts[pair] < min_frequency:
+                    if i - start >= 2:
+                        pruned_words.append(word[start:i])
+                        pruned_weights.append(weight)
+                    start = i
+        if len(word) - start >= 2:
+            pruned_words.append(word[start:])
+            pruned_weights.append(weight)
+    return pruned_words, pruned_weights
+
+
+# Fingerprint of the pruned training input (checkpoints of pruned runs only resume
+# with the same min_frequency)
+def prune_fingerprint(fingerprint: bytes, min_frequency: int) -> bytes:
+    return hashlib.sha256(
+        fingerprint + b"prune" + struct.pack("<Q", max(min_frequency, 1))
+    ).digest()
+
+
+"""
+Compression of tokenizer on held-out text
+    reference [Tokenizer]: e.g. the tokenizer of a full training run
+Returns: bytes, tokens and bytes_per_token, and with a reference its tokens and
+the inflation of the token count (tokens / reference_tokens - 1)
+"""
+
+
+def heldout_report(
+    tokenizer: Tokenizer, text: str, reference: Tokenizer = None
+) -> dict[str, float]:
+    num_bytes = len(text.encode(encoding="utf-8"))
+    num_tokens = tokenizer.count_tokens(text)
+    report = {
+        "bytes": num_bytes,
+        "tokens": num_tokens,
+        "bytes_per_token": num_bytes / max(num_tokens, 1),
+    }
+    if reference is not None:
+        reference_tokens = reference.count_tokens(text)
+        report["reference_tokens"] = reference_tokens
+        report["inflation"] = num_tokens / max(reference_tokens, 1) - 1
+    return report
@@ -1,11 +1,23 @@
 import unicodedata
+from typing import Iterable
 
 
 # Statistic frequency of pairs of adjacent tokens in a list of ids
-def get_statistics(ids: list[int], counts: dict = None) -> dict:
+# weight: number of times the list of ids occurs (e.g. count of a unique chunk)
+def get_statistics(ids: list[int], counts: dict = None, weight: int = 1) -> dict:
     counts = {} if counts is None else counts
     for pair in zip(ids, ids[1:]):
-        counts[pair] = counts.get(pair, 0) + 1
+        counts[pair] = counts.get(pair, 0) + weight
+    return counts
+
+
+# Statistic frequency of text chunks, keyed by their utf-8 bytes
+# Keys keep the order of first occurrence, so training tie-breaks are unchanged
+def get_chunk_counts(chunks: Iterable[str], counts: dict = None) -> dict[bytes, int]:
+    counts = {} if counts is None else counts
+    for chunk in chunks:
+        chunk_bytes = chunk.encode(encoding="utf-8")
+        counts[chunk_bytes] = counts.get(chunk_bytes, 0) + 1
     return counts
 
 
@@ -0,0 +1,115 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from minbpe import GPT4Tokenizer
+from minbpe.service import TokenizationClient, TokenizationServer, LatencyTracker
+from minbpe.service import DEFAULT_MAX_BATCH, DEFAULT_MAX_DELAY, DEFAULT_MAX_PENDING
+from minbpe.shards import load_tokenizer
+from minbpe.constants import BatchBackend
+
+"""
+Local tokenization service (see minbpe.service)
+
+Serve a trained model, or GPT-4, over a Unix socket or localhost TCP:
+    python server.py serve --model models/regex/regex.model --unix /tmp/minbpe.sock
+    python server.py serve --gpt4 --port 8765
+Load test a running server and report client and server latency percentiles:
+    python server.py bench --unix /tmp/minbpe.sock --concurrency 64 --requests 5000
+"""
+
+
+async def serve(args: argparse.Namespace) -> None:
+    if args.gpt4:
+        tokenizer = GPT4Tokenizer()
+    else:
+        tokenizer = load_tokenizer(model_file=args.model)
+    server = TokenizationServer(
+        tokenizer=tokenizer,
+        num_workers=args.num_workers,
+        backend=args.backend,
+        max_batch=args.max_batch,
+        max_delay=args.max_delay,
+        max_pending=args.max_pending,
+    )
+    await server.start(host=args.host, port=args.port, path=args.unix)
+    print(f"Serving on {server.address()}")
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.close()
+
+
+async def bench(args: argparse.Namespace) -> None:
+    with open(args.input, "r", encoding="utf-8") as f:
+        texts = [line for line in f.read().splitlines() if line.strip()]
+
+    client = await TokenizationClient.connect(
+        host=args.host, port=args.port, path=args.unix
+    )
+    latency = LatencyTracker()
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run_request(i: int) -> None:
+        async with semaphore:
+            start = time.perf_counter()
+            text = texts[i % len(texts)]
+            if args.op == "encode":
+                await client.encode(text)
+            elif args.op == "count":
+                await client.count_tokens(text)
+            else:
+                await client.decode(await client.encode(text))
+            latency.add(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_request(i) for i in range(args.requests)))
+    seconds = time.perf_counter() - start
+
+    report = {
+        "requests_per_s": args.requests / seconds,
+        "client": latency.percentiles(),
+        "server": await client.stats(),
+    }
+    print(json.dumps(report, indent=2))
+    await client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="minbpe tokenization service")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for command in ["serve", "bench"]:
+        subparser = subparsers.add_parser(command)
+        subparser.add_argument("--unix", default=None, help="Unix socket path")
+        subparser.add_argument("--host", default="127.0.0.1")
+        subparser.add_argument("--port", type=int, default=8765)
+
+    serve_parser = subparsers.choices["serve"]
+    model_group = serve_parser.add_mutually_exclusive_group(required=True)
+    model_group.add_argument("--model", help=".model file to serve")
+    model_group.add_argument("--gpt4", action="store_true", help="serve GPT-4")
+    serve_parser.add_argument("--num-workers", type=int, default=os.cpu_count())
+    serve_parser.add_argument(
+        "--backend",
+        default=BatchBackend.PROCESS,
+        choices=[BatchBackend.PROCESS, BatchBackend.THREAD],
+    )
+    serve_parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH)
+    serve_parser.add_argument("--max-delay", type=float, default=DEFAULT_MAX_DELAY)
+    serve_parser.add_argument("--max-pending", type=int, default=DEFAULT_MAX_PENDING)
+
+    bench_parser = subparsers.choices["bench"]
+    bench_parser.add_argument("--input", default="data/sample.txt")
+    bench_parser.add_argument(
+        "--op", default="encode", choices=["encode", "count", "roundtrip"]
+    )
+    bench_parser.add_argument("--concurrency", type=int, default=64)
+    bench_parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args) if args.command == "serve" else bench(args))
+    except KeyboardInterrupt:
+        pass
@@ -1,7 +1,34 @@
+import asyncio
+import gc
+import io
+import json
+import multiprocessing
 import os
+import random
+import shutil
+from array import array
+import subprocess
+import sys
+import numpy as np
+import regex as re
 import tiktoken
 
 from minbpe import BasicTokenizer, RegexTokenizer, GPT4Tokenizer, Tokenizer
+from minbpe import numpy_utils
+from minbpe.binary_model import convert_model
+from minbpe.constants import BatchBackend, DecodeEngine, EncodeEngine, SplitPattern
+from minbpe.constants import SplitEngine, TrainEngine
+from minbpe.fast_split import get_fast_splitter
+from minbpe.flat_vocab import FlatVocab
+from minbpe.gpt4_artifact import load_artifact
+from minbpe.pretokenize import count_chunks
+from minbpe.service import TokenizationClient, TokenizationServer
+from minbpe.service import read_frame, write_frame
+from minbpe.sharded_train import train_sharded
+from minbpe.train import group_configs, new_tokenizer, train_bpe
+from minbpe.train_options import heldout_report, prune_words, sample_chunk_counts
+from minbpe.shards import TokenShards, load_tokenizer, tokenize_to_shards
+from minbpe.utils import get_chunk_counts, get_statistics, merge
 
 
 def unpack(text: str) -> str:
@@ -92,9 +119,800 @@ def test_special_token_regex(
             os.remove(file)
 
 
+def test_special_matcher(text: str, num_special_tokens: int) -> None:
+    text = unpack(text)
+
+    tokenizer = RegexTokenizer()
+    tokenizer.load(model_file="models/regex/regex.model")
+    many_special_tokens = {
+        f"<|control_{i}|>": 1024 + i for i in range(num_special_tokens)
+    }
+    many_special_tokens.update(special_tokens)
+    tokenizer.register_special_tokens(special_tokens=many_special_tokens)
+
+    # Reference: split on a freshly built alternation of the allowed tokens
+    allowed_special = {"<|endoftext|>", "<|fim_middle|>", "<|control_0|>"}
+    special_pattern = "(" + "|".join(re.escape(k) for k in allowed_special) + ")"
+    expected = []
+    for chunk in re.split(special_pattern, text):
+        if chunk in allowed_special:
+            expected.append(many_special_tokens[chunk])
+        else:
+            expected.extend(tokenizer.encode_ordinary(chunk))
+
+    assert (
+        tokenizer.encode(text, allowed_special=allowed_special) == expected
+    ), "Failed to encode with the cached special matcher!"
+    assert tokenizer.get_special_matcher("all") is tokenizer.get_special_matcher(
+        "all"
+    ), "Failed to cache the special matcher!"
+
+    tokenizer.register_special_tokens(special_tokens={"<|fim_middle|>": 100259})
+    assert (
+        tokenizer.encode(text, allowed_special="all").count(100257) == 0
+    ), "Failed to rebuild the special matcher after registering special tokens!"
+
+    # The same dict, with a token replaced in place, registered again
+    registered = {"<|fim_middle|>": 100259}
+    tokenizer.register_special_tokens(special_tokens=registered)
+    tokenizer.decode_engine = DecodeEngine.FLAT
+    tokenizer.decode(tokenizer.encode(text, allowed_special="all"))
+    registered["<|endoftext|>"] = registered.pop("<|fim_middle|>")
+    tokenizer.register_special_tokens(special_tokens=registered)
+    ids = tokenizer.encode(text, allowed_special="all")
+    assert ids.count(100259) == text.count(
+        "<|endoftext|>"
+    ), "Failed to rebuild the special matcher after an in-place change!"
+    assert tokenizer.decode(ids) == text
+    print("Passed!")
+
+
+def test_train_engine_equality(
+    tokenizer_factory: Tokenizer,
+    text: str,
+    train_engine: str = TrainEngine.INCREMENTAL,
+    vocab_size: int = 256 + 64,
+) -> None:
+    text = unpack(text)
+
+    naive_tokenizer = tokenizer_factory(train_engine=TrainEngine.NAIVE)
+    naive_tokenizer.train(text=text, vocab_size=vocab_size, verbose=False)
+    tokenizer = tokenizer_factory(train_engine=train_engine)
+    tokenizer.train(text=text, vocab_size=vocab_size, verbose=False)
+
+    assert list(naive_tokenizer.merges.items()) == list(
+        tokenizer.merges.items()
+    ), "Failed to match merges of the naive trainer!"
+    print("Passed!")
+
+
+def test_checkpoint_resume(
+    tokenizer_factory: Tokenizer, text: str, vocab_size: int = 256 + 64
+) -> None:
+    text = unpack(text)
+    tokenizer = tokenizer_factory()
+    tokenizer.train(text=text, vocab_size=vocab_size)
+
+    # Stop after 40 merges, with a checkpoint written after 32 of them
+    checkpoint_file = "checkpoint_tmp.ckpt"
+    partial_tokenizer = tokenizer_factory()
+    partial_tokenizer.train(
+        text=text,
+        vocab_size=256 + 40,
+        checkpoint_file=checkpoint_file,
+        checkpoint_interval=16,
+    )
+    resumed_tokenizer = tokenizer_factory()
+    resumed_tokenizer.train(
+        text=text, vocab_size=vocab_size, checkpoint_file=checkpoint_file
+    )
+    assert list(resumed_tokenizer.merges.items()) == list(
+        tokenizer.merges.items()
+    ), "Failed to resume training from a checkpoint!"
+    if os.path.exists(checkpoint_file):
+        os.remove(checkpoint_file)
+
+    prefix = "extend_tokenizer_tmp"
+    partial_tokenizer.save(file_prefix=prefix)
+    extended_tokenizer = tokenizer_factory()
+    extended_tokenizer.load(model_file=f"{prefix}.model")
+    extended_tokenizer.train(text=text, vocab_size=vocab_size, extend=True)
+    assert list(extended_tokenizer.merges.items()) == list(
+        tokenizer.merges.items()
+    ), "Failed to extend a saved model!"
+    assert extended_tokenizer.decode(extended_tokenizer.encode(text)) == text
+    print("Passed!")
+
+    for file in [f"{prefix}.model", f"{prefix}.vocab"]:
+        os.remove(file)
+
+
+def test_sharded_training(
+    text: str, num_workers: int, vocab_size: int = 256 + 64
+) -> None:
+    text = unpack(text)
+    tokenizer = RegexTokenizer()
+    tokenizer.train(text=text, vocab_size=vocab_size)
+
+    sharded_tokenizer = RegexTokenizer()
+    chunk_counts = get_chunk_counts(re.findall(sharded_tokenizer.pattern, text))
+    train_sharded(
+        tokenizer=sharded_tokenizer,
+        chunk_counts=chunk_counts,
+        vocab_size=vocab_size,
+        num_workers=num_workers,
+    )
+    assert list(sharded_tokenizer.merges.items()) == list(
+        tokenizer.merges.items()
+    ), "Failed to match merges of single-process training!"
+    assert sharded_tokenizer.vocab == tokenizer.vocab
+    print("Passed!")
+
+
+def test_train_options(
+    text: str, heldout_text: str, train_engine: str, vocab_size: int = 256 + 128
+) -> None:
+    tokenizer = RegexTokenizer(train_engine=train_engine)
+    tokenizer.train(text=text, vocab_size=vocab_size)
+    merges = list(tokenizer.merges.items())
+
+    for min_frequency, prune in [(1, True), (100, False), (100, True)]:
+        frequent_tokenizer = RegexTokenizer(train_engine=train_engine)
+        frequent_tokenizer.train(
+            text=text, vocab_size=vocab_size, min_frequency=min_frequency, prune=prune
+        )
+        frequent_merges = list(frequent_tokenizer.merges.items())
+        assert (
+            frequent_merges == merges[: len(frequent_merges)]
+        ), "Failed to match merges of the full training!"
+        if min_frequency > 1:
+            assert 0 < len(frequent_merges) < len(merges)
+
+    sampled_merges = []
+    for _ in range(2):
+        sampled_tokenizer = RegexTokenizer(train_engine=train_engine)
+        sampled_tokenizer.train(
+            text=text, vocab_size=vocab_size, sample_rate=0.5, seed=1
+        )
+        sampled_merges.append(sampled_tokenizer.merges)
+    assert sampled_merges[0] == sampled_merges[1], "Failed to sample deterministically!"
+    report = heldout_report(sampled_tokenizer, heldout_text, reference=tokenizer)
+    assert report["tokens"] == len(sampled_tokenizer.encode_ordinary(heldout_text))
+    assert -0.05 < report["inflation"] < 0.05, report
+    print("Passed!")
+
+
+def test_train_bpe_groups(
+    text: str, tokenizers: list[dict], num_groups: int, block_size: int
+) -> None:
+    input_file = "train_bpe_tmp.txt"
+    output_dir = "train_bpe_tmp"
+    with open(input_file, "w", encoding="utf-8") as f:
+        f.write(text)
+    assert len(group_configs(tokenizers)) == num_groups
+    train_bpe(
+        input_path=input_file,
+        output_dir=output_dir,
+        tokenizers=tokenizers,
+        block_size=block_size,
+        num_workers=1,
+        train_workers=2,
+    )
+
+    for tokenizer_dict in tokenizers:
+        tokenizer = new_tokenizer(tokenizer_dict)
+        tokenizer.train(text, vocab_size=tokenizer_dict["vocab_size"])
+        name = tokenizer_dict.get("output_name", tokenizer_dict["name"])
+        saved_tokenizer = load_tokenizer(
+            model_file=os.path.join(output_dir, name, f"{name}.model")
+        )
+        assert type(saved_tokenizer) is type(tokenizer)
+        assert saved_tokenizer.pattern == tokenizer.pattern
+        assert list(saved_tokenizer.merges.items()) == list(
+            tokenizer.merges.items()
+        ), "Failed to match merges of a separate training run!"
+        assert saved_tokenizer.vocab == tokenizer.vocab
+
+    os.remove(input_file)
+    shutil.rmtree(output_dir)
+    print("Passed!")
+
+
+def test_count_and_truncate(
+    tokenizer: RegexTokenizer, text: str, allowed_special: str | set = "none_raise"
+) -> None:
+    text = unpack(text)
+    ids = tokenizer.encode(text, allowed_special=allowed_special)
+    assert tokenizer.count_tokens(text, allowed_special=allowed_special) == len(ids)
+
+    for max_tokens in [0, 1, 7, len(ids) // 2, len(ids), len(ids) + 5]:
+        assert (
+            tokenizer.encode(
+                text, allowed_special=allowed_special, max_tokens=max_tokens
+            )
+            == ids[:max_tokens]
+        ), "Failed to match the prefix of the full encoding!"
+        truncated = tokenizer.truncate(
+            text, max_tokens, allowed_special=allowed_special
+        )
+        assert text.startswith(truncated)
+        assert (
+            tokenizer.count_tokens(truncated, allowed_special=allowed_special)
+            <= max_tokens
+        ), "Failed to truncate text within max_tokens!"
+    assert tokenizer.truncate(text, len(ids), allowed_special=allowed_special) == text
+    print("Passed!")
+
+
+def test_lazy_import(code: str, unloaded_modules: list[str]) -> None:
+    check = "; import sys; print([m for m in {} if m in sys.modules])".format(
+        unloaded_modules
+    )
+    loaded = subprocess.run(
+        [sys.executable, "-c", code + check],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+    assert loaded == "[]", "Failed to import lazily, loaded {}".format(loaded)
+    print("Passed!")
+
+
+def test_flat_decode(
+    tokenizer: Tokenizer, text: str, allowed_special: str | set = "none_raise"
+) -> None:
+    text = unpack(text)
+    if isinstance(tokenizer, BasicTokenizer):
+        ids = tokenizer.encode(text)
+    else:
+        ids = tokenizer.encode(text, allowed_special=allowed_special)
+    tokenizer.decode_engine = DecodeEngine.DICT
+    expected = tokenizer.decode_bytes(ids)
+    assert tokenizer.decode(ids) == expected.decode(encoding="utf-8", errors="replace")
+
+    tokenizer.decode_engine = DecodeEngine.FLAT
+    for ids_array in [ids, array("I", ids), np.array(ids, dtype=np.uint32)]:
+        assert (
+            tokenizer.decode_bytes(ids_array) == expected
+        ), "Failed to match bytes of the dict decode engine!"
+    assert tokenizer.decode(ids) == text
+
+    unknown_id = max(tokenizer.decode_table()) + 1
+    try:
+        tokenizer.decode(ids + [unknown_id])
+        assert False, "Failed to reject an unknown token!"
+    except ValueError:
+        pass
+
+    # Sparse ids far past the vocab (special tokens) are not stored densely
+    flat_vocab = FlatVocab({**tokenizer.decode_table(), 1 << 31: b"<|far|>"})
+    assert len(flat_vocab.offsets) <= len(tokenizer.decode_table()) + 2
+    far_ids = [1 << 31] + ids + [1 << 31] + ids[:1]
+    assert flat_vocab.gather(far_ids) == b"<|far|>" + expected + b"<|far|>" + (
+        tokenizer.decode_bytes(ids[:1])
+    ), "Failed to gather sparse token ids!"
+    for bad_ids in [[(1 << 31) + 1], ids + [-1]]:
+        try:
+            flat_vocab.gather(bad_ids)
+            assert False, "Failed to reject an unknown token!"
+        except ValueError:
+            pass
+    tokenizer.decode_engine = DecodeEngine.DICT
+    print("Passed!")
+
+
+def test_tokenization_service(
+    tokenizer: RegexTokenizer, texts: list[str], backend: str
+) -> None:
+    texts = [unpack(text) for text in texts]
+
+    async def run() -> None:
+        server = TokenizationServer(
+            tokenizer=tokenizer, num_workers=2, backend=backend, max_pending=8
+        )
+        await server.start(port=0)
+        host, port = server.address()[:2]
+        client = await TokenizationClient.connect(host=host, port=port)
+
+        requests = []
+        for text in texts * 4:
+            requests.append(client.encode(text, allowed_special="all"))
+            requests.append(client.count_tokens(text, allowed_special="all"))
+        results = await asyncio.gather(*requests)
+        for i, text in enumerate(texts * 4):
+            ids = tokenizer.encode(text, allowed_special="all")
+            assert results[2 * i] == ids, "Failed to match encode of the server!"
+            assert results[2 * i + 1] == len(ids)
+            assert await client.decode(ids) == text
+
+        # A failing request does not fail the rest of its batch
+        special_text = "<|endoftext|>" if tokenizer.special_tokens else None
+        if special_text is not None:
+            results = await asyncio.gather(
+                client.encode(special_text),
+                client.encode(texts[-1]),
+                return_exceptions=True,
+            )
+            assert isinstance(results[0], RuntimeError)
+            assert results[1] == tokenizer.encode(texts[-1])
+
+        # A malformed allowed_special fails its request only
+        results = await asyncio.gather(
+            client.request("encode", text=texts[-1], allowed_special={"a": 1}),
+            client.request("count", text=texts[-1], allowed_special=[1, "a"]),
+            client.encode(texts[-1]),
+            return_exceptions=True,
+        )
+        assert isinstance(results[0], RuntimeError)
+        assert isinstance(results[1], RuntimeError)
+        assert results[2] == tokenizer.encode(texts[-1]), "Failed to answer a batch!"
+
+        # Pipelined requests, then a half-close: every response still arrives,
+        # and frames that are not request objects get an error response
+        reader, writer = await asyncio.open_connection(host=host, port=port)
+        for i, text in enumerate(texts):
+            write_frame(writer, {"id": i, "op": "encode", "text": text})
+        write_frame(writer, [])
+        write_frame(writer, 1)
+        write_frame(writer, {"id": -1})
+        writer.write_eof()
+        responses = []
+        while (response := await read_frame(reader)) is not None:
+            responses.append(response)
+        writer.close()
+        results = {r["id"]: r["result"] for r in responses if "result" in r}
+        assert results == {
+            i: tokenizer.encode(text) for i, text in enumerate(texts)
+        }, "Failed to answer pipelined requests before closing!"
+        assert sum("error" in response for response in responses) == 3
+
+        stats = await client.stats()
+        assert stats["latency"]["count"] > 0 and "p99_ms" in stats["latency"]
+        await client.close()
+        await server.close()
+
+    asyncio.run(run())
+    print("Passed!")
+
+
+def random_unicode_text(rng: random.Random, length: int) -> str:
+    # Characters around the class boundaries of the split patterns, and random ones
+    alphabet = (
+        " \t\r\n\x0b\x0c\x1c\x85\xa0'sSdDmMtTlLvVeErR\u017fKaZ09"
+        "\u0660\xb2\u2163!.,-_\u3000\u4e00\xe9\U0001f600"
+    )
+    chars = []
+    while len(chars) < length:
+        char = chr(rng.randrange(0x110000))
+        if rng.random() < 0.7:
+            chars.append(rng.choice(alphabet))
+        elif not 0xD800 <= ord(char) <= 0xDFFF:  # no surrogates in utf-8
+            chars.append(char)
+    return "".join(chars)
+
+
+def test_fast_split(pattern: str, texts: list[str], train_text: str) -> None:
+    splitter = get_fast_splitter(pattern)
+    compiled_pattern = re.compile(pattern)
+    for text in texts:
+        assert splitter.findall(text) == compiled_pattern.findall(
+            text
+        ), "Failed to match chunks of the split pattern!"
+        assert list(splitter.spans(text)) == [
+            match.span() for match in compiled_pattern.finditer(text)
+        ]
+
+    tokenizer = RegexTokenizer(pattern=pattern)
+    tokenizer.train(train_text, vocab_size=256 + 32)
+    fast_tokenizer = RegexTokenizer(pattern=pattern, split_engine=SplitEngine.FAST)
+    fast_tokenizer.train(train_text, vocab_size=256 + 32)
+    assert fast_tokenizer.merges == tokenizer.merges
+    for text in texts:
+        ids = tokenizer.encode_ordinary(text)
+        assert fast_tokenizer.encode_ordinary(text) == ids
+        assert fast_tokenizer.count_tokens(text) == len(ids)
+    print("Passed!")
+
+
+def test_numpy_utils(ids: list[int], pair: tuple[int, int]) -> None:
+    assert list(get_statistics(ids).items()) == list(
+        numpy_utils.get_statistics(ids).items()
+    ), "Failed to match statistics of the numpy backend!"
+    assert numpy_utils.merge(ids, pair, 1000).tolist() == merge(
+        ids, pair, 1000
+    ), "Failed to match merge of the numpy backend!"
+    print("Passed!")
+
+
+def test_encode_engine_equality(
+    tokenizer_factory: Tokenizer, model_file: str, text: str
+) -> None:
+    text = unpack(text)
+
+    naive_tokenizer = tokenizer_factory(encode_engine=EncodeEngine.NAIVE)
+    naive_tokenizer.load(model_file=model_file)
+    tokenizer = tokenizer_factory(encode_engine=EncodeEngine.HEAP)
+    tokenizer.load(model_file=model_file)
+
+    assert naive_tokenizer.encode(text) == tokenizer.encode(
+        text
+    ), "Failed to match ids of the naive encoder!"
+    print("Passed!")
+
+
+def test_chunk_cache(model_file: str, text: str) -> None:
+    text = unpack(text)
+
+    tokenizer = RegexTokenizer()
+    tokenizer.load(model_file=model_file)
+    cached_tokenizer = RegexTokenizer(cache_size=128, cache_max_chunk_len=16)
+    cached_tokenizer.load(model_file=model_file)
+
+    assert tokenizer.encode(text) == cached_tokenizer.encode(
+        text
+    ), "Failed to match ids of the uncached encoder!"
+    stats = cached_tokenizer.cache_stats()
+    assert stats["size"] <= 128, "Failed to bound the chunk cache!"
+    assert (
+        stats["misses"] - stats["evictions"] == stats["size"]
+    ), "Failed to count chunk cache misses and evictions!"
+
+    # Ids handed out must not alias the cached ones
+    for _ in range(2):
+        for ids, _ in cached_tokenizer.iter_encode(text):
+            ids.append(-1)
+    assert tokenizer.encode(text) == cached_tokenizer.encode(
+        text
+    ), "Failed to protect cached ids from the caller!"
+    print("Passed!")
+
+
+def test_batch_encode_decode(
+    tokenizer_factory: Tokenizer, texts: list[str], backend: str
+) -> None:
+    texts = [unpack(text) for text in texts]
+    tokenizer = tokenizer_factory()
+
+    ids_batch = tokenizer.encode_batch(texts, num_workers=2, backend=backend)
+    assert ids_batch == [
+        tokenizer.encode(text) for text in texts
+    ], "Failed to encode batch in order!"
+    assert (
+        tokenizer.decode_batch(ids_batch, num_workers=2, backend=backend) == texts
+    ), "Failed to decode batch in order!"
+
+    # Workers see settings changed after the pool started
+    tokenizer.decode_engine = "unknown"
+    try:
+        tokenizer.decode_batch(ids_batch, num_workers=2, backend=backend)
+        assert False, "Failed to pass a changed setting to the workers!"
+    except ValueError:
+        pass
+    tokenizer.decode_engine = DecodeEngine.DICT
+    tokenizer.close_worker_pool()
+
+    # A tokenizer collected without close_worker_pool shuts its workers down
+    tokenizer.encode_batch(texts, num_workers=2, backend=backend)
+    del tokenizer
+    gc.collect()
+    assert not multiprocessing.active_children(), "Failed to shut the workers down!"
+    print("Passed!")
+
+
+def test_encode_stream(
+    text: str,
+    special_tokens: dict[str, int],
+    allowed_special: str | set,
+    buffer_size: int,
+    pattern: str = None,
+) -> None:
+    text = unpack(text)
+    if pattern is None:
+        tokenizer = RegexTokenizer()
+        tokenizer.load(model_file="models/regex/regex.model")
+    else:
+        # Merges of the pattern, which span what the GPT-4 pattern splits
+        tokenizer = RegexTokenizer(pattern=pattern)
+        tokenizer.train(unpack("FILE:data/sample.txt"), vocab_size=256 + 64)
+    tokenizer.register_special_tokens(special_tokens=special_tokens)
+
+    ids = []
+    for block_ids in tokenizer.encode_stream(
+        io.StringIO(text), allowed_special=allowed_special, buffer_size=buffer_size
+    ):
+        ids.extend(block_ids)
+
+    assert ids == tokenizer.encode(
+        text, allowed_special=allowed_special
+    ), "Failed to match ids of encode on the whole text!"
+    print("Passed!")
+
+
+def test_streaming_decoder(tokenizer_factory: Tokenizer, text: str) -> None:
+    text = unpack(text)
+    tokenizer = tokenizer_factory()
+    ids = tokenizer.encode(text)
+
+    decoder = tokenizer.streaming_decoder()
+    pieces = [decoder.decode(idx) for idx in ids]
+    decoded = "".join(pieces) + decoder.flush()
+
+    assert decoded == text, "Failed to decode token by token!"
+    assert all(
+        "\ufffd" not in piece for piece in pieces
+    ), "Failed to hold back incomplete utf-8 sequences!"
+    print("Passed!")
+
+
+def test_binary_model(
+    model_file: str, special_tokens: dict[str, int], text: str
+) -> None:
+    tokenizer = RegexTokenizer()
+    tokenizer.load(model_file=model_file)
+    tokenizer.register_special_tokens(special_tokens=special_tokens)
+    ids = tokenizer.encode(text, allowed_special="all")
+
+    prefix = "binary_tokenizer_tmp"
+    tokenizer.save(file_prefix=prefix, binary=True)
+
+    binary_tokenizer = RegexTokenizer()
+    binary_tokenizer.load(model_file=f"{prefix}.bin")
+    assert list(binary_tokenizer.merges.items()) == list(
+        tokenizer.merges.items()
+    ), "Failed to load merges from binary model"
+    assert (
+        binary_tokenizer.encode(text, allowed_special="all") == ids
+    ), "Failed to encode after loading binary model"
+    assert (
+        binary_tokenizer.decode(ids) == text
+    ), "Failed to decode after loading binary model"
+
+    convert_model(input_file=f"{prefix}.bin", output_file=f"{prefix}.model")
+    text_tokenizer = RegexTokenizer()
+    text_tokenizer.load(model_file=f"{prefix}.model")
+    assert (
+        text_tokenizer.merges == tokenizer.merges
+        and text_tokenizer.special_tokens == special_tokens
+    ), "Failed to convert binary model to text model"
+
+    # A load replaces the whole previous model and unmaps it, whatever the formats
+    mapped_vocab = binary_tokenizer.vocab
+    binary_tokenizer.load(model_file=model_file)
+    assert mapped_vocab.buffer.closed, "Failed to unmap the previous binary model"
+    reference = RegexTokenizer()
+    reference.load(model_file=model_file)
+    assert (
+        binary_tokenizer.merges == reference.merges
+        and binary_tokenizer.special_tokens == reference.special_tokens
+    ), "Failed to replace the previous model"
+
+    with RegexTokenizer() as closed_tokenizer:
+        closed_tokenizer.load(model_file=f"{prefix}.bin")
+        mapped_vocab = closed_tokenizer.vocab
+        assert closed_tokenizer.decode(ids) == text
+    assert mapped_vocab.buffer.closed, "Failed to unmap the binary model on close"
+
+    # A truncated binary model is rejected with ValueError
+    with open(f"{prefix}.bin", "rb") as f:
+        data = f.read()
+    for size in [8, 40, len(data) // 2, len(data) - 1]:
+        with open(f"{prefix}.bin", "wb") as f:
+            f.write(data[:size])
+        try:
+            RegexTokenizer().load(model_file=f"{prefix}.bin")
+            assert False, "Failed to reject a truncated binary model!"
+        except ValueError as e:
+            assert "truncated" in str(e), "Failed to reject a truncated binary model!"
+    print("Passed!")
+
+    for file in [f"{prefix}.bin", f"{prefix}.model", f"{prefix}.vocab"]:
+        if os.path.exists(file):
+            os.remove(file)
+
+
+def test_gpt4_artifact(text: str) -> None:
+    text = unpack(text)
+    artifact_file = "gpt4_tokenizer_tmp.gpt4"
+    if os.path.exists(artifact_file):
+        os.remove(artifact_file)
+
+    tokenizer = GPT4Tokenizer(artifact_file=artifact_file)
+    assert os.path.exists(artifact_file), "Failed to save GPT4Tokenizer artifact"
+    ids = tokenizer.encode(text)
+
+    cached_tokenizer = GPT4Tokenizer(artifact_file=artifact_file)
+    assert (
+        cached_tokenizer.merges == tokenizer.merges
+    ), "Failed to load merges from GPT4Tokenizer artifact"
+    assert (
+        cached_tokenizer.encode(text) == ids
+    ), "Failed to encode after loading GPT4Tokenizer artifact"
+    assert (
+        cached_tokenizer.decode(ids) == text
+    ), "Failed to decode after loading GPT4Tokenizer artifact"
+
+    verified_tokenizer = GPT4Tokenizer(
+        artifact_file=artifact_file, verify_artifact=True
+    )
+    assert (
+        verified_tokenizer.merges == tokenizer.merges
+    ), "Failed to verify GPT4Tokenizer artifact"
+
+    # A truncated or corrupt artifact is rebuilt and rewritten
+    size = os.path.getsize(artifact_file)
+    for offset, data in [(size // 2, None), (size // 2, b"\xff\xff"), (0, b"")]:
+        with open(artifact_file, "r+b") as f:
+            if data is None:
+                f.truncate(offset)
+            else:
+                f.seek(offset)
+                f.write(data)
+                if not data:
+                    f.truncate(offset)
+        rebuilt_tokenizer = GPT4Tokenizer(artifact_file=artifact_file)
+        assert (
+            rebuilt_tokenizer.encode(text) == ids
+        ), "Failed to rebuild a damaged GPT4Tokenizer artifact"
+        assert (
+            os.path.getsize(artifact_file) == size
+        ), "Failed to rewrite a damaged GPT4Tokenizer artifact"
+        load_artifact(artifact_file)
+    print("Passed!")
+
+    os.remove(artifact_file)
+
+
+def test_streaming_chunk_counts(
+    input_path: str, pattern: str, block_size: int, num_workers: int
+) -> None:
+    text = unpack(f"FILE:{input_path}")
+    expected = get_chunk_counts(re.findall(pattern, text))
+
+    chunk_counts = count_chunks(
+        input_paths=os.path.join(os.path.dirname(__file__), input_path),
+        pattern=pattern,
+        block_size=block_size,
+        num_workers=num_workers,
+    )
+
+    assert list(chunk_counts.items()) == list(
+        expected.items()
+    ), "Failed to match chunk counts of the whole text!"
+    print("Passed!")
+
+
+def test_instrumentation(tokenizer_factory: Tokenizer, text: str) -> None:
+    text = unpack(text)
+
+    tokenizer = tokenizer_factory()
+    tokenizer.progress_interval = 0.0
+    events = []
+    tokenizer.enable_instrumentation(callback=lambda event, info: events.append(event))
+    tokenizer.train(text=text, vocab_size=256 + 16, verbose=False)
+    assert events == ["train_progress"] * len(tokenizer.merges) + [
+        "train_end"
+    ], "Failed to report training progress!"
+
+    ids = tokenizer.encode(text)
+    assert tokenizer.decode(ids) == text, "Failed to encode and decode!"
+    stats = tokenizer.stats()
+    assert stats["counters"]["merges"] == len(tokenizer.merges)
+    assert stats["counters"]["tokens"] == len(ids)
+    assert stats["counters"]["decoded_tokens"] == len(ids)
+    assert stats["counters"]["encoded_bytes"] == len(text.encode("utf-8"))
+    assert "bpe" in stats["timers"] and "decode" in stats["timers"]
+
+    tokenizer.disable_instrumentation()
+    tokenizer.instrumentation.reset()
+    tokenizer.encode(text)
+    assert tokenizer.stats()["counters"] == {}, "Failed to disable instrumentation!"
+
+    # Training that stops early (out of pairs, min_frequency) still reports its
+    # last merge before train_end
+    runs = [(text[:1000], {})]
+    if tokenizer_factory is RegexTokenizer:
+        runs.append((text, {"min_frequency": 100}))
+    for train_text, options in runs:
+        tokenizer = tokenizer_factory()
+        tokenizer.progress_interval = 3600.0
+        events = []
+        tokenizer.enable_instrumentation(
+            callback=lambda event, info: events.append((event, info))
+        )
+        tokenizer.train(
+            text=train_text, vocab_size=256 + 1000, verbose=False, **options
+        )
+        assert [event for event, _ in events] == ["train_progress"] * bool(
+            tokenizer.merges
+        ) + ["train_end"], "Failed to finish training progress!"
+        if tokenizer.merges:
+            assert events[0][1]["merges"] == len(tokenizer.merges) < 1000
+    print("Passed!")
+
+
+def test_token_shards(
+    model_file: str, texts: list[str], separator: str, shard_size: int
+) -> None:
+    texts = [unpack(text) for text in texts]
+    tokenizer = load_tokenizer(model_file=model_file)
+    tokenizer.register_special_tokens(special_tokens=special_tokens)
+    separator_ids = [special_tokens[separator]] if separator else []
+    expected = [tokenizer.encode_ordinary(text) + separator_ids for text in texts]
+
+    input_file = "shards_tmp.jsonl"
+    with open(input_file, "w", encoding="utf-8") as f:
+        for text in texts:
+            f.write(json.dumps({"text": text}) + "\n")
+
+    # A worker pool of the caller is left running
+    tokenizer.get_worker_pool(num_workers=2)
+    output_dirs = ["shards_tmp", "shards_resumed_tmp"]
+    for output_dir in output_dirs:
+        tokenize_to_shards(
+            input_file,
+            tokenizer,
+            output_dir,
+            separator=separator,
+            shard_size=shard_size,
+            batch_size=1,
+            num_workers=1,
+        )
+    assert tokenizer.has_worker_pool(), "Failed to keep the caller's worker pool!"
+    tokenizer.close_worker_pool()
+    shards = TokenShards(output_dirs[0])
+    assert [
+        shards.document(i).tolist() for i in range(len(shards))
+    ] == expected, "Failed to read documents from shards!"
+
+    # Roll back to one committed document and leave garbage after it, as if killed
+    meta_file = os.path.join(output_dirs[1], "meta.json")
+    with open(meta_file, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    meta.update(num_docs=1, num_tokens=len(expected[0]), complete=False)
+    with open(meta_file, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    with open(os.path.join(output_dirs[1], "shard_00000.bin"), "ab") as f:
+        f.write(b"garbage")
+    tokenize_to_shards(
+        input_file,
+        tokenizer,
+        output_dirs[1],
+        separator=separator,
+        shard_size=shard_size,
+        batch_size=2,
+        num_workers=1,
+    )
+    for name in sorted(os.listdir(output_dirs[0])):
+        with open(os.path.join(output_dirs[0], name), "rb") as f0, open(
+            os.path.join(output_dirs[1], name), "rb"
+        ) as f1:
+            assert f0.read() == f1.read(), "Failed to resume writing shards!"
+
+    # Resuming with inputs that lost documents is refused
+    with open(meta_file, "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    meta.update(complete=False)
+    with open(meta_file, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+    with open(input_file, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"text": texts[0]}) + "\n")
+    try:
+        tokenize_to_shards(input_file, tokenizer, output_dirs[1], separator=separator)
+        assert len(texts) <= 1, "Failed to detect inputs that lost documents!"
+    except ValueError:
+        pass
+    print("Passed!")
+
+    os.remove(input_file)
+    for output_dir in output_dirs:
+        shutil.rmtree(output_dir)
+
+
 def test_gpt4_tiktoken_equality(
     text: str,
     allowed_special: set | str = "none_raise",
+    encode_engine: str = EncodeEngine.RANKS,
 ) -> None:
     text = unpack(text)
 
@@ -104,7 +922,7 @@ def test_gpt4_tiktoken_equality(
     else:
         titoken_ids = enc.encode(text)
 
-    tokenizer = GPT4Tokenizer()
+    tokenizer = GPT4Tokenizer(encode_engine=encode_engine)
     gpt4_tokenizer_ids = tokenizer.encode(text, allowed_special=allowed_special)
 
     assert titoken_ids == gpt4_tokenizer_ids, "Failed to encode with GPT4Tokenizer!"
@@ -118,6 +936,188 @@ if __name__ == "__main__":
         for text in test_strings:
             test_encode_decode(tokenizer, text)
 
+    print("\nTesting checkpoint resume and model extension...")
+    for tokenizer in [BasicTokenizer, RegexTokenizer]:
+        print(tokenizer.__name__)
+        for text in test_strings:
+            test_checkpoint_resume(tokenizer, text)
+
+    print("\nTesting sharded training...")
+    for num_workers in [1, 3]:
+        for text in test_strings:
+            test_sharded_training(text, num_workers)
+
+    print("\nTesting min_frequency, pruning and sampling training options...")
+    assert prune_words([[1], [1, 2, 3], [2, 3]], [5, 1, 1], min_frequency=2) == (
+        [[2, 3], [2, 3]],
+        [1, 1],
+    )
+    assert sample_chunk_counts({b"ab": 10, b"c": 1}, sample_rate=1.0) == {
+        b"ab": 10,
+        b"c": 1,
+    }
+    with open("data/sample.txt", "r", encoding="utf-8") as f:
+        sample_text = f.read()
+    with open("data/text.txt", "r", encoding="utf-8") as f:
+        heldout_text = f.read()
+    for train_engine in [TrainEngine.INCREMENTAL, TrainEngine.NUMPY]:
+        print(train_engine)
+        test_train_options(sample_text[:50000], heldout_text[:50000], train_engine)
+
+    print("\nTesting shared pre-tokenization and prefix snapshots in train_bpe...")
+    test_train_bpe_groups(
+        sample_text[:20000],
+        [
+            {"name": "regex", "vocab_size": 256 + 32, "output_name": "regex_32"},
+            {"name": "regex", "vocab_size": 256 + 64, "verbose": False},
+            {
+                "name": "regex",
+                "vocab_size": 256 + 48,
+                "pattern": SplitPattern.GPT2_SPLIT_PATTERN,
+                "output_name": "regex_gpt2",
+            },
+            {
+                "name": "regex",
+                "vocab_size": 256 + 48,
+                "pattern": r"[^\n]+",
+                "output_name": "regex_lines",
+            },
+            {"name": "basic", "vocab_size": 256 + 32},
+            {"name": "basic", "vocab_size": 256 + 16, "output_name": "basic_16"},
+        ],
+        num_groups=4,
+        block_size=256,
+    )
+
+    print("\nTesting lazy package imports...")
+    test_lazy_import("import minbpe", ["regex", "tiktoken", "minbpe.base"])
+    test_lazy_import(
+        "from minbpe import BasicTokenizer; BasicTokenizer()", ["regex", "tiktoken"]
+    )
+    test_lazy_import(
+        "from minbpe import GPT4Tokenizer; GPT4Tokenizer",
+        ["tiktoken", "multiprocessing"],
+    )
+
+    print("\nTesting numpy statistics and merge...")
+    for ids, pair in [
+        ([], (1, 2)),
+        ([1, 1, 1], (1, 1)),
+        ([1, 1, 1, 1, 2, 1, 1], (1, 1)),
+        ([1, 2, 1, 2, 2, 1], (1, 2)),
+        (list("hello world".encode(encoding="utf-8")), (108, 108)),
+    ]:
+        test_numpy_utils(ids, pair)
+
+    print("\nTesting incremental and numpy trainers against naive trainer...")
+    for train_engine in [TrainEngine.INCREMENTAL, TrainEngine.NUMPY]:
+        for tokenizer in [BasicTokenizer, RegexTokenizer]:
+            print(train_engine, tokenizer.__name__)
+            for text in test_strings:
+                test_train_engine_equality(tokenizer, text, train_engine)
+
+    print("\nTesting heap encoder against naive encoder...")
+    test_encode_engine_equality(BasicTokenizer, "models/basic/basic.model", llama_text)
+    for text in test_strings + [llama_text]:
+        test_encode_engine_equality(RegexTokenizer, "models/regex/regex.model", text)
+
+    print("\nTesting chunk cache...")
+    for text in test_strings + [llama_text]:
+        test_chunk_cache("models/regex/regex.model", text)
+
+    print("\nTesting batch encode and decode...")
+    for tokenizer in [BasicTokenizer, RegexTokenizer, GPT4Tokenizer]:
+        print(tokenizer.__name__)
+        for backend in [BatchBackend.PROCESS, BatchBackend.THREAD]:
+            test_batch_encode_decode(tokenizer, test_strings, backend)
+
+    print("\nTesting streaming encoder...")
+    for buffer_size in [1, 7, 64, 4096]:
+        test_encode_stream(
+            "FILE:data/text.txt", special_tokens, "none_raise", buffer_size
+        )
+        test_encode_stream(llama_text, special_tokens, "all", buffer_size)
+        test_encode_stream(specials_string, special_tokens, "all", buffer_size)
+        # A custom pattern has no safe boundaries: only cut at special tokens
+        for text in ["FILE:data/sample.txt", llama_text]:
+            test_encode_stream(text, special_tokens, "all", buffer_size, r"[^\n]+")
+
+    print("\nTesting streaming decoder...")
+    for tokenizer in [BasicTokenizer, RegexTokenizer, GPT4Tokenizer]:
+        print(tokenizer.__name__)
+        for text in test_strings:
+            test_streaming_decoder(tokenizer, text)
+
+    print("\nTesting streaming pre-tokenization...")
+    for pattern in [
+        SplitPattern.GPT2_SPLIT_PATTERN,
+        SplitPattern.GPT4_SPLIT_PATTERN,
+        r"[^\n]+",
+    ]:
+        for block_size, num_workers in [(16, 1), (4096, 2)]:
+            test_streaming_chunk_counts(
+                "data/text.txt", pattern, block_size, num_workers
+            )
+
+    print("\nTesting cached special matcher...")
+    for num_special_tokens in [0, 500]:
+        test_special_matcher(specials_string, num_special_tokens)
+
+    print("\nTesting instrumentation...")
+    for tokenizer in [BasicTokenizer, RegexTokenizer]:
+        print(tokenizer.__name__)
+        for text in test_strings[2:]:
+            test_instrumentation(tokenizer, text)
+
+    print("\nTesting token shards...")
+    for separator, shard_size in [(None, 1 << 16), ("<|endoftext|>", 7)]:
+        test_token_shards(
+            "models/regex/regex.model",
+            test_strings + [llama_text],
+            separator,
+            shard_size,
+        )
+
+    print("\nTesting count_tokens and truncation...")
+    regex_tokenizer = RegexTokenizer()
+    regex_tokenizer.load(model_file="models/regex/regex.model")
+    for tokenizer in [regex_tokenizer, GPT4Tokenizer()]:
+        print(type(tokenizer).__name__)
+        for text in test_strings:
+            test_count_and_truncate(tokenizer, text)
+    regex_tokenizer.register_special_tokens(special_tokens)
+    test_count_and_truncate(regex_tokenizer, llama_text, allowed_special="all")
+    test_count_and_truncate(GPT4Tokenizer(), specials_string, allowed_special="all")
+
+    print("\nTesting flat decode engine...")
+    for tokenizer_factory in [BasicTokenizer, RegexTokenizer]:
+        print(tokenizer_factory.__name__)
+        tokenizer = tokenizer_factory()
+        tokenizer.train(unpack(test_strings[-1]), vocab_size=256 + 32)
+        for text in test_strings:
+            test_flat_decode(tokenizer, text)
+    regex_tokenizer = RegexTokenizer()
+    regex_tokenizer.load(model_file="models/regex/regex.model")
+    regex_tokenizer.register_special_tokens(special_tokens)
+    test_flat_decode(regex_tokenizer, llama_text, allowed_special="all")
+    test_flat_decode(GPT4Tokenizer(), specials_string, allowed_special="all")
+
+    print("\nTesting tokenization service...")
+    for backend in [BatchBackend.THREAD, BatchBackend.PROCESS]:
+        print(backend)
+        test_tokenization_service(regex_tokenizer, test_strings, backend)
+
+    print("\nTesting fast split against split patterns...")
+    rng = random.Random(0)
+    texts = [unpack(text) for text in test_strings]
+    for file_name in sorted(os.listdir("data")):
+        with open(os.path.join("data", file_name), "r", encoding="utf-8") as f:
+            texts.append(f.read())
+    texts += [random_unicode_text(rng, rng.randrange(200)) for _ in range(500)]
+    for pattern in [SplitPattern.GPT2_SPLIT_PATTERN, SplitPattern.GPT4_SPLIT_PATTERN]:
+        test_fast_split(pattern, texts, train_text=texts[len(test_strings)])
+    assert get_fast_splitter(r"\w+|\W+") is None
+
     print("\nTesting RegexTokenizer with special tokens...")
     test_special_token_regex(
         text=llama_text,
@@ -125,9 +1125,17 @@ if __name__ == "__main__":
         allowed_special="all",
     )
 
+    print("\nTesting binary model format...")
+    test_binary_model("models/regex/regex.model", special_tokens, llama_text)
+
+    print("\nTesting GPT4Tokenizer artifact...")
+    test_gpt4_artifact("FILE:data/text.txt")
+
     print('\nTesting GPT4Tokenizer with "cl100k_base" for plain text...')
-    for text in test_strings:
-        test_gpt4_tiktoken_equality(text)
+    for encode_engine in [EncodeEngine.RANKS, EncodeEngine.HEAP, EncodeEngine.NAIVE]:
+        print(encode_engine)
+        for text in test_strings:
+            test_gpt4_tiktoken_equality(text, encode_engine=encode_engine)
 
     print("\nTesting GPT4Tokenizer with special tokens in text...")
     test_gpt4_tiktoken_equality(text=specials_string, allowed_special="all")